@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+基准用的模拟 `p4` 可执行文件：RunBench 在临时 bin 目录里生成名为 p4 的启动脚本指向本文件，
+并放到 PATH 最前面，使 SubprocessBackend 照常启动子进程，由这里按 fixture 作答。
+
+    环境变量 P4CASESYNC_BENCH_FIXTURE  FakeServer 快照（JSON）；move 等修改会写回
+    环境变量 P4CASESYNC_BENCH_LOG      可选；每次调用追加一行命令名，用于统计子进程数
+
+支持 FakeServer 实现的命令（info/client/opened/where/files/changes/move/login），
+`-G` 时输出 marshal 记录，否则输出近似 p4 的文本。
+"""
+
+import os
+import sys
+import marshal
+
+def InjectSysPath():
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for p in [os.path.join(base, "Source", "Logic"), os.path.dirname(os.path.abspath(__file__))]:
+        if p not in sys.path:
+            sys.path.insert(0, p)
+InjectSysPath()
+
+from P4Backend import _records_to_text
+from Workspace import LoadServer, SaveServer
+
+_WRITE_COMMANDS = {"move"}
+
+def _split_args(argv):
+    """去掉全局参数（-p/-u/-c 及其值、-G），返回 (是否 -G, 命令及其参数)。"""
+    tagged = False
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a in ("-p", "-u", "-c", "-P", "-H"):
+            i += 2
+            continue
+        if a == "-G":
+            tagged = True
+            i += 1
+            continue
+        break
+    return tagged, argv[i:]
+
+def _locked(path, exclusive):
+    """fixture 读写锁（POSIX flock）；其它平台不加锁。"""
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    fp = open(path + ".lock", "a")
+    fcntl.flock(fp, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return fp
+
+def Main(argv=None) -> int:
+    tagged, args = _split_args(sys.argv[1:] if argv is None else argv)
+    fixture = os.environ.get("P4CASESYNC_BENCH_FIXTURE", "")
+    if not fixture:
+        sys.stderr.write("P4CASESYNC_BENCH_FIXTURE 未设置\n")
+        return 1
+    log = os.environ.get("P4CASESYNC_BENCH_LOG", "")
+    if log:
+        with open(log, "a", encoding="utf-8") as fp:
+            fp.write((args[0] if args else "") + "\n")
+
+    if args and args[0] == "login":
+        sys.stdin.read()
+    write = bool(args) and args[0] in _WRITE_COMMANDS
+    lock = _locked(fixture, write)
+    try:
+        server = LoadServer(fixture)
+        raw = server.Run(args)
+        if write:
+            SaveServer(server, fixture)
+    finally:
+        if lock is not None:
+            lock.close()
+
+    if tagged:
+        out = sys.stdout.buffer
+        for rec in raw:
+            marshal.dump({k.encode("utf-8"): str(v).encode("utf-8") for (k, v) in rec.items()}, out, 0)
+        out.flush()
+        return 0
+    rc, text, err = _records_to_text(args, raw)
+    sys.stdout.write(text)
+    if err:
+        sys.stderr.write(err + "\n")
+    return rc
+
+if __name__ == "__main__":
+    sys.exit(Main())
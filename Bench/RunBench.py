@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+基准测试：在合成工作区上测量扫描、应用与列表渲染随规模的变化。
+
+用法示例：
+    python Bench/RunBench.py                                   # 默认：三种形状 × 1k/10k
+    python Bench/RunBench.py --sizes 1000,50000,200000 --shapes mixed
+    python Bench/RunBench.py --save-baseline Bench/baseline.json
+    python Bench/RunBench.py --baseline Bench/baseline.json    # 有回退时退出码为 1
+
+阶段：
+    scan    GetOpenedPairs（全部 changelist，冷缓存）
+    warm    同上，但 ResolveCache 已由一次未计时的扫描填充
+    render  MainFrame.RenderPairs（需要可用的 Tk 显示，否则跳过）
+    apply   ApplyMoves（会修改 fixture 状态，最后执行）
+
+后端：
+    exe   模拟的 p4 可执行文件（Bench/FakeP4.py）放在 PATH 最前，经 SubprocessBackend 真实启动子进程
+    fake  进程内 FakeBackend，无子进程开销
+    auto  POSIX 上规模 <= 20000 用 exe，其余用 fake（默认）
+
+每个阶段报告：耗时、p4 调用数（exe 下即子进程数）、文件系统调用数（listdir/scandir/stat）、
+本进程内的峰值内存增量（tracemalloc）。
+
+退出码：0 正常；1 相对基线有回退；2 参数或运行错误。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+def InjectSysPath():
+    bench = os.path.dirname(os.path.abspath(__file__))
+    base = os.path.dirname(bench)
+    for p in [base, os.path.join(base, "Source", "UI"), os.path.join(base, "Source", "Logic"), bench]:
+        if p not in sys.path:
+            sys.path.insert(0, p)
+InjectSysPath()
+
+from P4Backend import SubprocessBackend, FakeBackend
+from Core import P4Context, GetOpenedPairs, ApplyMoves, ALL_CHANGELISTS, DEFAULT_MOVE_JOBS
+from ResolveCache import ResolveCache
+from Workspace import SHAPES, DEFAULT_MISMATCH, DEFAULT_SEED, Generate, LoadServer
+
+STAGES = ("scan", "warm", "render", "apply")
+DEFAULT_SIZES = (1000, 10000)
+EXE_MAX_FILES = 20000          # auto 模式下使用子进程后端的最大规模
+DEFAULT_TOLERANCE = 0.25       # 耗时/内存允许的相对增长
+_MIN_WALL_DELTA = 0.05         # 秒；小于此绝对差的耗时波动不算回退
+_MIN_MEM_DELTA_KB = 1024       # KB；同上，内存
+
+_FAKE_P4 = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FakeP4.py")
+
+# ===================== 计数 =====================
+class FsCounter:
+    """在本进程内统计 os.listdir / os.scandir / os.stat 调用次数（线程安全）；退出时还原。"""
+    NAMES = ("listdir", "scandir", "stat")
+
+    def __init__(self):
+        self.Counts: Dict[str, int] = {n: 0 for n in self.NAMES}
+        self._Lock = threading.Lock()
+        self._Orig: Dict[str, Callable] = {}
+
+    def _wrap(self, name: str, fn: Callable) -> Callable:
+        def counted(*a, **kw):
+            with self._Lock:
+                self.Counts[name] += 1
+            return fn(*a, **kw)
+        return counted
+
+    def __enter__(self) -> "FsCounter":
+        for n in self.NAMES:
+            self._Orig[n] = getattr(os, n)
+            setattr(os, n, self._wrap(n, self._Orig[n]))
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        for n, fn in self._Orig.items():
+            setattr(os, n, fn)
+
+    def Snapshot(self) -> Dict[str, int]:
+        with self._Lock:
+            return dict(self.Counts)
+
+class Stage:
+    """一个计时阶段：with 块内的耗时、p4 调用数、文件系统调用数与峰值内存增量。"""
+    def __init__(self, p4_calls: Callable[[], int], fs: FsCounter, TraceMemory: bool = True):
+        self._P4Calls = p4_calls
+        self._Fs = fs
+        self._Trace = TraceMemory
+        self.Result: Dict[str, float] = {}
+
+    def __enter__(self) -> "Stage":
+        self._Calls0 = self._P4Calls()
+        self._Fs0 = self._Fs.Snapshot()
+        if self._Trace:
+            tracemalloc.reset_peak()
+            self._Mem0 = tracemalloc.get_traced_memory()[0]
+        self._T0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        wall = time.perf_counter() - self._T0
+        fs = self._Fs.Snapshot()
+        self.Result = {
+            "wall_s": round(wall, 4),
+            "p4_calls": self._P4Calls() - self._Calls0,
+            "fs_calls": sum(fs[n] - self._Fs0[n] for n in fs),
+            **{n: fs[n] - self._Fs0[n] for n in fs},
+        }
+        if self._Trace:
+            self.Result["peak_kb"] = max(0, tracemalloc.get_traced_memory()[1] - self._Mem0) // 1024
+
+# ===================== 后端 =====================
+def _write_shim(bin_dir: str) -> None:
+    """生成名为 p4 的启动脚本，转发到 FakeP4.py。"""
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "p4")
+    with open(path, "w", encoding="utf-8") as fp:
+        fp.write(f'#!/bin/sh\nexec "{sys.executable}" "{_FAKE_P4}" "$@"\n')
+    os.chmod(path, 0o755)
+
+def _pick_backend(kind: str, size: int) -> str:
+    if kind == "auto":
+        return "exe" if os.name == "posix" and size <= EXE_MAX_FILES else "fake"
+    if kind == "exe" and os.name != "posix":
+        raise SystemExit("exe 后端需要 POSIX（p4 启动脚本为 sh）；Windows 上请用 --backend fake")
+    return kind
+
+class _Backend:
+    """按后端类型准备 P4Context 与 p4 调用计数；exe 模式下临时改写 PATH 等环境变量。"""
+    def __init__(self, kind: str, state: str, scratch: str):
+        self.Kind = kind
+        self._Env: Dict[str, Optional[str]] = {}
+        if kind == "exe":
+            bin_dir = os.path.join(scratch, "bin")
+            self._Log = os.path.join(scratch, "p4_calls.log")
+            open(self._Log, "w").close()
+            _write_shim(bin_dir)
+            self._setenv("PATH", bin_dir + os.pathsep + os.environ.get("PATH", ""))
+            self._setenv("P4CASESYNC_BENCH_FIXTURE", state)
+            self._setenv("P4CASESYNC_BENCH_LOG", self._Log)
+            self.Ctx = P4Context("bench:1666", "bench", "bench", SubprocessBackend())
+        else:
+            self.Server = LoadServer(state)
+            self.Ctx = P4Context("bench:1666", "bench", "bench", FakeBackend(self.Server))
+
+    def _setenv(self, k: str, v: str) -> None:
+        self._Env.setdefault(k, os.environ.get(k))
+        os.environ[k] = v
+
+    def Calls(self) -> int:
+        if self.Kind == "exe":
+            with open(self._Log, encoding="utf-8") as fp:
+                return sum(1 for _ in fp)
+        return self.Server.CommandCount
+
+    def Close(self) -> None:
+        for k, v in self._Env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+# ===================== 各阶段 =====================
+def _bench_render(pairs, targets, stage: Stage) -> Optional[str]:
+    """返回跳过原因；成功时为 None。"""
+    try:
+        import tkinter as Tk
+        from MainUI import MainFrame
+        root = Tk.Tk()
+    except Exception as e:
+        return f"无法创建 Tk 窗口（{e.__class__.__name__}）"
+    try:
+        root.withdraw()
+        f = MainFrame(root)
+        f.pack(fill="both", expand=True)
+        root.update_idletasks()
+        with stage:
+            f.RenderPairs(pairs, targets)
+            root.update_idletasks()
+    finally:
+        root.destroy()
+    return None
+
+def RunCase(args, shape: str, size: int) -> Dict[str, object]:
+    case_dir = os.path.join(args.workdir, f"{shape}-{size}-{args.seed}-m{round(args.mismatch * 100)}")
+    t0 = time.perf_counter()
+    fixture = Generate(case_dir, shape, size, Mismatch=args.mismatch, Seed=args.seed)
+    gen_s = time.perf_counter() - t0
+
+    state = os.path.join(case_dir, "state.json")
+    shutil.copyfile(fixture, state)  # apply 会修改状态，每次从生成的 fixture 重新开始
+    kind = _pick_backend(args.backend, size)
+    backend = _Backend(kind, state, case_dir)
+    stages: Dict[str, Dict[str, object]] = {}
+    case = {"shape": shape, "size": size, "backend": kind, "generate_s": round(gen_s, 3), "stages": stages}
+    try:
+        with FsCounter() as fs:
+            new_stage = lambda: Stage(backend.Calls, fs, not args.no_trace_memory)
+
+            st = new_stage()
+            with st:
+                ok, pairs, targets, msg = GetOpenedPairs(backend.Ctx, ALL_CHANGELISTS)
+            if not ok:
+                raise RuntimeError(f"扫描失败：{msg}")
+            moves = [(i, src, dst) for i, ((src, _c), dst) in enumerate(zip(pairs, targets)) if dst and dst != src]
+            stages["scan"] = dict(st.Result, files=len(pairs), mismatched=len(moves))
+            case["files"] = len(pairs)
+
+            if "warm" in args.stages:
+                cache = ResolveCache(CachePath=os.path.join(case_dir, "resolve_cache.json"))
+                GetOpenedPairs(backend.Ctx, ALL_CHANGELISTS, Cache=cache)
+                st = new_stage()
+                with st:
+                    GetOpenedPairs(backend.Ctx, ALL_CHANGELISTS, Cache=cache)
+                stages["warm"] = st.Result
+
+            if "render" in args.stages:
+                st = new_stage()
+                skipped = _bench_render(pairs, targets, st)
+                stages["render"] = {"skipped": skipped} if skipped else st.Result
+
+            if "apply" in args.stages and moves:
+                st = new_stage()
+                with st:
+                    results, _logs = ApplyMoves(backend.Ctx, moves, Jobs=args.jobs)
+                counts = {k: sum(1 for v in results.values() if v == k) for k in ("ok", "fail", "skip")}
+                stages["apply"] = dict(st.Result, moves=len(moves), **counts)
+    finally:
+        backend.Close()
+    if "scan" not in args.stages:
+        stages.pop("scan", None)
+    return case
+
+# ===================== 基线比较 =====================
+def _case_key(case: Dict[str, object]) -> str:
+    return f"{case['shape']}-{case['size']}-{case['backend']}"
+
+def Compare(baseline: Dict[str, object], current: Dict[str, object],
+            tolerance: float, count_tolerance: float) -> List[str]:
+    """
+    返回回退描述列表；基线中没有的用例/阶段/指标不参与比较。
+    tracemalloc 会显著拖慢执行，两边是否统计内存不一致时只比较调用次数。
+    """
+    out: List[str] = []
+    same_mode = baseline.get("meta", {}).get("trace_memory") == current.get("meta", {}).get("trace_memory")
+    base_cases = baseline.get("cases", {})
+    for key, case in current.get("cases", {}).items():
+        base = base_cases.get(key)
+        if not base:
+            continue
+        for stage, cur in case["stages"].items():
+            old = base["stages"].get(stage)
+            if not old or "skipped" in old or "skipped" in cur:
+                continue
+            for metric, limit, floor in (("wall_s", tolerance, _MIN_WALL_DELTA),
+                                         ("peak_kb", tolerance, _MIN_MEM_DELTA_KB),
+                                         ("p4_calls", count_tolerance, 0),
+                                         ("fs_calls", count_tolerance, 0)):
+                if metric not in old or metric not in cur:
+                    continue
+                if not same_mode and metric in ("wall_s", "peak_kb"):
+                    continue
+                a, b = old[metric], cur[metric]
+                if b > a * (1 + limit) and b - a > floor:
+                    out.append(f"{key} {stage} {metric}: {a} -> {b}（+{(b - a) / a * 100 if a else 100:.0f}%）")
+    return out
+
+def _print_case(case: Dict[str, object]) -> None:
+    head = f"{case['shape']:<6} {case['size']:>7} {case['backend']:<4}"
+    for stage, r in case["stages"].items():
+        if "skipped" in r:
+            print(f"{head} {stage:<6} 跳过：{r['skipped']}")
+            continue
+        mem = f"  peak {r['peak_kb'] / 1024:7.1f} MB" if "peak_kb" in r else ""
+        print(f"{head} {stage:<6} {r['wall_s']:8.3f}s  p4 {r['p4_calls']:>6}  fs {r['fs_calls']:>7}{mem}")
+    sys.stdout.flush()
+
+def _parse_args(argv):
+    ap = argparse.ArgumentParser(prog="RunBench.py", description="P4CaseSync 扫描/应用/渲染基准测试")
+    ap.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                    help="逗号分隔的文件数，范围 1000～200000（默认 1000,10000）")
+    ap.add_argument("--shapes", default=",".join(SHAPES), help=f"逗号分隔：{'/'.join(SHAPES)}")
+    ap.add_argument("--stages", default=",".join(STAGES), help=f"逗号分隔：{'/'.join(STAGES)}")
+    ap.add_argument("--backend", choices=("auto", "exe", "fake"), default="auto")
+    ap.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "p4casesync-bench"),
+                    help="生成工作区的目录（按形状/规模/种子复用）")
+    ap.add_argument("--jobs", type=int, default=DEFAULT_MOVE_JOBS, help="apply 阶段的并发数")
+    ap.add_argument("--mismatch", type=float, default=DEFAULT_MISMATCH, help="depot 大小写不一致的比例")
+    ap.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    ap.add_argument("--no-trace-memory", action="store_true", help="不统计峰值内存（tracemalloc 会拖慢执行）")
+    ap.add_argument("--json", default="", help="把结果写到该 JSON 文件")
+    ap.add_argument("--baseline", default="", help="与该基线比较，有回退时退出码为 1")
+    ap.add_argument("--save-baseline", default="", help="把本次结果保存为基线")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                    help=f"耗时/内存允许的相对增长（默认 {DEFAULT_TOLERANCE}）")
+    ap.add_argument("--count-tolerance", type=float, default=0.0,
+                    help="p4/文件系统调用数允许的相对增长（默认 0：任何增加都算回退）")
+    args = ap.parse_args(argv)
+    try:
+        args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    except ValueError:
+        ap.error("--sizes 需要逗号分隔的整数")
+    args.shapes = [s.strip() for s in args.shapes.split(",") if s.strip()]
+    args.stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    for s in args.shapes:
+        if s not in SHAPES:
+            ap.error(f"未知形状：{s}")
+    for s in args.stages:
+        if s not in STAGES:
+            ap.error(f"未知阶段：{s}")
+    return args
+
+def Main(argv=None) -> int:
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if not args.no_trace_memory:
+        tracemalloc.start()
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "mismatch": args.mismatch, "seed": args.seed, "jobs": args.jobs,
+                 "trace_memory": not args.no_trace_memory},
+        "cases": {},
+    }
+    try:
+        for shape in args.shapes:
+            for size in args.sizes:
+                case = RunCase(args, shape, size)
+                report["cases"][_case_key(case)] = case
+                _print_case(case)
+    except (OSError, RuntimeError) as e:
+        sys.stderr.write(f"错误：{e}\n")
+        return 2
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as fp:
+                json.dump(report, fp, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding="utf-8") as fp:
+                baseline = json.load(fp)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"错误：无法读取基线 {args.baseline}：{e}\n")
+            return 2
+        if baseline.get("meta", {}).get("trace_memory") != report["meta"]["trace_memory"]:
+            print("提示：基线与本次的内存统计设置不同，只比较 p4/文件系统调用次数")
+        regressions = Compare(baseline, report, args.tolerance, args.count_tolerance)
+        for r in regressions:
+            print(f"[REGRESSION] {r}")
+        if regressions:
+            return 1
+        print("与基线相比无回退")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(Main())
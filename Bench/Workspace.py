@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+基准用的合成工作区：在磁盘上生成真实大小写的目录/文件，并生成对应的 FakeServer 快照（fixture）。
+
+形状：
+    deep   深层目录（12 层，每层 3 个分支），每个叶子目录少量文件
+    wide   浅而宽：每个目录约 5000 个文件
+    mixed  接近真实项目：Game/Content/Area/Sub/Leaf，每个叶子目录约 40 个文件
+
+depot 路径按 Mismatch 比例把部分目录层级或文件名写成小写，模拟被 P4 “弱化”的大小写。
+同一 (形状, 规模, 种子) 的工作区生成一次后复用（以 fixture.json 是否存在为准）。
+"""
+
+import os, json, random
+from typing import List
+
+from P4Backend import FakeServer
+
+SHAPES = ("deep", "wide", "mixed")
+DEFAULT_MISMATCH = 0.3
+DEFAULT_SEED = 1234
+
+_DEEP_LEVELS = 12
+_WIDE_PER_DIR = 5000
+_MIXED_PER_DIR = 40
+
+def _dirs_for(shape: str, i: int, n: int) -> List[str]:
+    if shape == "deep":
+        leaf = i // 8
+        return [f"Node{k:02d}_{(leaf // 3 ** k) % 3}" for k in range(_DEEP_LEVELS)]
+    if shape == "wide":
+        return ["Wide", f"Bucket{i % max(1, n // _WIDE_PER_DIR)}"]
+    if shape == "mixed":
+        leaf = i // _MIXED_PER_DIR
+        return ["Game", "Content", f"Area{leaf % 17}", f"SubGroup{leaf // 17 % 97}", f"LeafDir{leaf}"]
+    raise ValueError(f"未知形状：{shape}")
+
+def _weaken(parts: List[str], rng: random.Random, mismatch: float) -> List[str]:
+    """按比例把某一层（目录或文件名）改成小写，模拟 depot 里的错误大小写。"""
+    if rng.random() >= mismatch:
+        return parts
+    k = rng.randrange(len(parts))
+    return parts[:k] + [parts[k].lower()] + parts[k + 1:]
+
+def Generate(root: str, shape: str, size: int, Mismatch: float = DEFAULT_MISMATCH,
+             Seed: int = DEFAULT_SEED) -> str:
+    """在 root 下生成工作区与 fixture.json，返回 fixture 路径；已存在时直接返回。"""
+    fixture = os.path.join(root, "fixture.json")
+    if os.path.exists(fixture):
+        return fixture
+    rng = random.Random(f"{shape}:{size}:{Seed}")
+    ws = os.path.join(root, "ws")
+    server = FakeServer(ws, "//depot", "bench", CaseInsensitive=True)
+    made: set = set()
+    for i in range(size):
+        dirs = _dirs_for(shape, i, size)
+        name = f"Asset_{i:06d}.uasset"
+        local_dir = os.path.join(ws, *dirs)
+        if local_dir not in made:
+            os.makedirs(local_dir, exist_ok=True)
+            made.add(local_dir)
+        open(os.path.join(local_dir, name), "wb").close()
+
+        depot = "//depot/" + "/".join(_weaken(dirs + [name], rng, Mismatch))
+        r = rng.random()
+        action = "add" if r < 0.15 else "edit"
+        change = str(1000 + int(r * 100) % 5) if r > 0.9 else "default"
+        server.AddFile(depot, action, change)
+    for c in sorted(server.Changes):
+        server.AddChange(c, f"bench change {c}")
+
+    tmp = fixture + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(server.Snapshot(), fp, separators=(",", ":"))
+    os.replace(tmp, fixture)
+    return fixture
+
+def LoadServer(fixture: str) -> FakeServer:
+    with open(fixture, encoding="utf-8") as fp:
+        return FakeServer.FromSnapshot(json.load(fp))
+
+def SaveServer(server: FakeServer, fixture: str) -> None:
+    tmp = fixture + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fp:
+        json.dump(server.Snapshot(), fp, separators=(",", ":"))
+    os.replace(tmp, fixture)
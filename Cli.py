@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+命令行 / 批处理入口（无界面，不导入 tkinter），供 CI、预提交检查使用。
+
+用法示例：
+    python Cli.py --changelist 12345 --dry-run
+    python Cli.py --changelist default --jobs 8 --format jsonl
+    python Cli.py --resume            # 上次 apply 被中断：按日志续做
+    python Cli.py --rollback          # 上次 apply 被中断：回到原始路径
+
+连接参数：命令行 > 环境变量 P4PORT/P4USER/P4CLIENT > 工具缓存/`p4 set`。
+需要已有有效 ticket；若设置了 P4PASSWD 且未登录，会尝试用它登录一次。
+
+apply 期间每一次 `p4 move` 都记入 ~/.p4_submitlist_tool/journal/，全部成功后删除。
+存在未完成的日志时普通 apply 拒绝执行，需先 --resume 或 --rollback。
+
+退出码：
+    0  无需修改，或全部应用成功
+    1  有条目应用失败 / 被中断
+    2  连接、扫描或参数错误
+    3  --dry-run 且存在需要修改的文件
+"""
+
+import os
+import sys
+import json
+import signal
+import argparse
+import threading
+
+def InjectSysPath():
+    base = os.path.dirname(os.path.abspath(__file__))
+    for p in [base, os.path.join(base, "Source", "Logic")]:
+        if p not in sys.path:
+            sys.path.insert(0, p)
+InjectSysPath()
+
+from Core import (
+    P4Context, GetOpenedPairs, GetOpenedGroups, ApplyMoves, PlanRecovery, ProgressChannel,
+    ALL_CHANGELISTS,
+    GetCachedP4User, DEFAULT_MOVE_JOBS, DEFAULT_FS_WORKERS,
+)
+from ResolveCache import ResolveCache
+from Journal import ApplyJournal, JournalPath, PendingJournal, DiscardJournal
+import Trace
+
+EXIT_OK      = 0
+EXIT_FAILED  = 1
+EXIT_ERROR   = 2
+EXIT_PENDING = 3
+
+PROGRESS_INTERVAL = 0.5  # 秒，stderr 进度刷新间隔
+
+def _parse_args(argv):
+    ap = argparse.ArgumentParser(
+        prog="Cli.py",
+        description="按本地磁盘真实大小写修正 Perforce 已打开文件的路径大小写（无界面模式）。")
+    ap.add_argument("-p", "--port", default="", help="P4PORT")
+    ap.add_argument("-u", "--user", default="", help="P4USER")
+    ap.add_argument("-c", "--client", default="", help="P4CLIENT（workspace）")
+    ap.add_argument("--changelist", default="default",
+                    help="changelist 号、default，或 * 表示所有待提交 changelist（默认 default）")
+    ap.add_argument("--dry-run", action="store_true", help="只输出计划，不执行 p4 move")
+    ap.add_argument("--jobs", type=int, default=DEFAULT_MOVE_JOBS,
+                    help=f"并发执行 move 的连接数（默认 {DEFAULT_MOVE_JOBS}）")
+    ap.add_argument("--fs-workers", type=int, default=DEFAULT_FS_WORKERS,
+                    help=f"扫描时并发读取本地目录的线程数，1 为顺序执行（默认 {DEFAULT_FS_WORKERS}）")
+    ap.add_argument("--format", choices=("text", "json", "jsonl"), default="text",
+                    help="输出格式：text（默认）、json（单个对象）、jsonl（每个文件一行 + 汇总行）")
+    ap.add_argument("--all", action="store_true", help="输出中包含无需修改的文件")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="不读写 ~/.p4_submitlist_tool/ 下的 where/目录解析缓存")
+    ap.add_argument("--trace", nargs="?", const="", default=None, metavar="PATH",
+                    help="结束时在 stderr 输出 p4/文件系统/各阶段耗时汇总；给出 PATH 时另存 Chrome trace JSON"
+                         "（也可设置环境变量 P4CASESYNC_TRACE）")
+    ap.add_argument("--progress", action="store_true",
+                    help="在 stderr 输出执行进度（stderr 为终端时默认开启）")
+    rec = ap.add_mutually_exclusive_group()
+    rec.add_argument("--resume", action="store_true",
+                     help="按日志续做上次被中断的 apply（已完成的 move 不会重复执行）")
+    rec.add_argument("--rollback", action="store_true",
+                     help="按日志把上次被中断的 apply 涉及的文件移回原始路径")
+    rec.add_argument("--no-journal", action="store_true",
+                     help="不记录 apply 日志，也不检查未完成的日志")
+    return ap.parse_args(argv)
+
+def _connect(args):
+    cached = ("", "", "")
+    server = args.port   or os.environ.get("P4PORT", "")
+    user   = args.user   or os.environ.get("P4USER", "")
+    client = args.client or os.environ.get("P4CLIENT", "")
+    if not (server and user and client):
+        cached = GetCachedP4User()
+    server = server or cached[0]
+    user   = user   or cached[1]
+    client = client or cached[2]
+    if not (server and user and client):
+        return None, "缺少 P4PORT / P4USER / P4CLIENT（可用 -p/-u/-c 指定）"
+
+    p4 = P4Context(server, user, client)
+    ok, msg = p4.Test()
+    if not ok:
+        pw = os.environ.get("P4PASSWD", "")
+        if pw:
+            ok, msg = p4.Login(pw)
+    if not ok:
+        return None, msg or "连接 P4 失败"
+    return p4, ""
+
+def _run_apply(p4, moves, jobs, show_progress, journal=None, origins=None):
+    """在工作线程中执行 ApplyMoves；主线程轮询进度通道并响应 Ctrl+C。"""
+    stop_evt = threading.Event()
+    channel = ProgressChannel(len(moves))
+    out = {"results": {}, "logs": []}
+
+    def worker():
+        try:
+            out["results"], out["logs"] = ApplyMoves(
+                p4, moves, OnProgress=channel.Put, StopEvent=stop_evt, Jobs=jobs,
+                Journal=journal, Origins=origins)
+        except Exception as e:
+            out["logs"].append(f"[EXCEPT] err={e!r}")
+        finally:
+            channel.Close()
+
+    prev = signal.signal(signal.SIGINT, lambda *_a: stop_evt.set())
+    try:
+        t = threading.Thread(target=worker, daemon=True)
+        t.start()
+        while t.is_alive():
+            t.join(PROGRESS_INTERVAL)
+            if show_progress:
+                st = channel.Snapshot()
+                rate = f"  {st.Rate:.1f}/s" if st.Rate > 0 else ""
+                sys.stderr.write(f"\r{st.Done}/{st.Total}  成功 {st.Ok} 失败 {st.Fail} 跳过 {st.Skip}{rate}   ")
+                sys.stderr.flush()
+        if show_progress:
+            sys.stderr.write("\n")
+    finally:
+        signal.signal(signal.SIGINT, prev)
+    return out["results"], out["logs"], stop_evt.is_set()
+
+def _scan(p4, changelist, cache, fs_workers=DEFAULT_FS_WORKERS):
+    """(ok, pairs, targets, changes, msg)；changes 与 pairs 对齐，* 模式下一次扫描全部 changelist。"""
+    if changelist != ALL_CHANGELISTS:
+        ok, pairs, targets, msg = GetOpenedPairs(p4, changelist, FsWorkers=fs_workers, Cache=cache)
+        return ok, pairs, targets, [changelist] * len(pairs), msg
+    ok, groups, msg = GetOpenedGroups(p4, FsWorkers=fs_workers, Cache=cache)
+    pairs, targets, changes = [], [], []
+    for g in groups:
+        pairs += g.Pairs
+        targets += g.Targets
+        changes += [g.Change] * len(g.Pairs)
+    return ok, pairs, targets, changes, msg
+
+def _emit(fmt, report):
+    if fmt == "json":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return
+    if fmt == "jsonl":
+        for f in report["files"]:
+            sys.stdout.write(json.dumps(dict(type="file", **f), ensure_ascii=False) + "\n")
+        summary = {k: v for (k, v) in report.items() if k != "files"}
+        sys.stdout.write(json.dumps(dict(type="summary", **summary), ensure_ascii=False) + "\n")
+        return
+
+    for f in report["files"]:
+        tag = f"[{f['change']}] " if report["changelist"] == ALL_CHANGELISTS else ""
+        if f["status"] == "unchanged":
+            sys.stdout.write(f"  {tag}{f['src']}\n")
+        else:
+            sys.stdout.write(f"[{f['status']}] {tag}{f['src']}\n      -> {f['dst']}\n")
+    for w in report["warnings"]:
+        sys.stdout.write(f"[WARN] {w}\n")
+    for line in report["logs"]:
+        if not line.startswith("[OK]"):
+            sys.stdout.write(f"{line}\n")
+    s = report["summary"]
+    sys.stdout.write(
+        f"共 {s['total']} 个文件，需修改 {s['pending']}，成功 {s['ok']}，失败 {s['fail']}，跳过 {s['skip']}\n")
+
+def Main(argv=None) -> int:
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if args.trace is not None:
+        Trace.Enable(args.trace)
+    else:
+        Trace.EnableFromEnv()
+    try:
+        return _main(args)
+    finally:
+        Trace.Finish()
+
+def _main(args) -> int:
+    p4, err = _connect(args)
+    if p4 is None:
+        sys.stderr.write(f"错误：{err}\n")
+        return EXIT_ERROR
+
+    journal_file = None if args.no_journal else JournalPath(p4.Server, p4.User, p4.Client)
+    pending_journal = PendingJournal(p4.Server, p4.User, p4.Client) if journal_file else None
+    if args.resume or args.rollback:
+        try:
+            return _recover(args, p4, pending_journal, journal_file)
+        finally:
+            p4.Close()
+    if pending_journal is not None and not args.dry_run:
+        p4.Close()
+        sys.stderr.write(f"错误：上次 apply（{pending_journal.Time}）未完成，"
+                         f"请先使用 --resume 续做或 --rollback 回滚（日志：{pending_journal.JournalFile}）\n")
+        return EXIT_ERROR
+
+    try:
+        cache = None if args.no_cache else ResolveCache()
+        ok, pairs, targets, changes, msg = _scan(p4, args.changelist, cache, max(1, args.fs_workers))
+        if not ok:
+            sys.stderr.write(f"错误：{msg or '获取 Opened 列表失败'}\n")
+            return EXIT_ERROR
+
+        moves = [(i, src, dst) for i, ((src, _c), dst) in enumerate(zip(pairs, targets)) if dst and dst != src]
+        results, logs, interrupted = {}, [], False
+        if moves and not args.dry_run:
+            show_progress = args.progress or (sys.stderr.isatty() and args.format == "text")
+            journal = ApplyJournal(journal_file) if journal_file else None
+            results, logs, interrupted = _run_apply(p4, moves, max(1, args.jobs), show_progress, journal)
+    finally:
+        p4.Close()
+
+    files = []
+    pending = {i for (i, _s, _d) in moves}
+    for i, ((src, _c), dst, cl) in enumerate(zip(pairs, targets, changes)):
+        if i not in pending:
+            if args.all:
+                files.append({"change": cl, "src": src, "dst": dst or src, "status": "unchanged"})
+            continue
+        status = "pending" if args.dry_run else results.get(i, "skip")
+        files.append({"change": cl, "src": src, "dst": dst, "status": status})
+
+    counts = _count_results(results, moves, args.dry_run)
+    report = {
+        "changelist": args.changelist,
+        "dry_run": bool(args.dry_run),
+        "interrupted": interrupted,
+        "summary": {"total": len(pairs), "pending": len(moves), **counts},
+        "warnings": [w for w in (msg or "").split("；") if w],
+        "logs": logs,
+        "files": files,
+    }
+    _emit(args.format, report)
+
+    if args.dry_run:
+        return EXIT_PENDING if moves else EXIT_OK
+    if interrupted or counts["fail"] or counts["skip"]:
+        return EXIT_FAILED
+    return EXIT_OK
+
+def _count_results(results, moves, dry_run):
+    counts = {st: sum(1 for st2 in results.values() if st2 == st) for st in ("ok", "fail", "skip")}
+    if not dry_run:
+        counts["skip"] += sum(1 for (i, _s, _d) in moves if i not in results)
+    return counts
+
+def _recover(args, p4, state, journal_file) -> int:
+    """--resume / --rollback：按上次 apply 的日志把涉及的文件移到目标路径或原始路径。"""
+    if state is None:
+        sys.stderr.write("没有未完成的 apply 日志，无需恢复\n")
+        return EXIT_OK
+    ok, moves, origins, lost, msg = PlanRecovery(p4, state, Rollback=args.rollback)
+    if not ok:
+        sys.stderr.write(f"错误：{msg or '获取 Opened 列表失败'}\n")
+        return EXIT_ERROR
+
+    results, logs, interrupted = {}, [], False
+    if not args.dry_run:
+        if moves:
+            show_progress = args.progress or (sys.stderr.isatty() and args.format == "text")
+            results, logs, interrupted = _run_apply(
+                p4, moves, max(1, args.jobs), show_progress, ApplyJournal(journal_file), origins)
+        else:
+            DiscardJournal(state)  # 全部已在目标位置（或已无法找到），日志不再有用
+
+    counts = _count_results(results, moves, args.dry_run)
+    report = {
+        "changelist": args.changelist,
+        "recovery": "rollback" if args.rollback else "resume",
+        "journal_time": state.Time,
+        "dry_run": bool(args.dry_run),
+        "interrupted": interrupted,
+        "summary": {"total": len(state.Entries), "pending": len(moves), **counts},
+        "warnings": [f"已打开文件中找不到 {e.Current}（原始路径 {e.Origin}），未处理" for e in lost],
+        "logs": logs,
+        "files": [{"change": "", "src": src, "dst": dst,
+                   "status": "pending" if args.dry_run else results.get(k, "skip")}
+                  for (k, src, dst) in moves],
+    }
+    _emit(args.format, report)
+
+    if args.dry_run:
+        return EXIT_PENDING if moves else EXIT_OK
+    if interrupted or lost or counts["fail"] or counts["skip"]:
+        return EXIT_FAILED
+    return EXIT_OK
+
+if __name__ == "__main__":
+    sys.exit(Main())
@@ -3,6 +3,7 @@
 import os
 import sys
 import threading
+from concurrent.futures import wait
 import tkinter as Tk
 from tkinter import messagebox, ttk
 
@@ -16,17 +17,30 @@ InjectSysPath()
 from LoginUI import LoginFrame
 from MainUI import MainFrame
 from Core import (
-    P4Context, GetOpenedPairs,
-    TrySingleMove, TryTwoMoves,
+    P4Context, IterOpenedPairs, ScanBatch, StartupPrefetch, ALL_CHANGELISTS,
+    ApplyMoves, PlanRecovery, ProgressChannel,
     GetCachedP4User, SaveCachedP4User,
-    GetPendingChangelists,
+    ChangelistProvider, CountByChange,
 )
+from ResolveCache import ResolveCache
+from Watch import LiveRescan
+from Journal import ApplyJournal, JournalPath, PendingJournal, DiscardJournal
+import Trace
 
 def NeedsPassword(msg: str) -> bool:
     s = (msg or "").lower()
     keys = ["password", "login", "logged out", "not yet logged in", "p4 login is required", "ticket", "perforce password"]
     return any(k in s for k in keys)
 
+def _batches_from_result(ok, pairs, targets, msg):
+    """把一次性结果（如启动预取的 GetOpenedPairs）转换成与 IterOpenedPairs 相同的批次序列。"""
+    if not ok:
+        yield ScanBatch(False, [], [], 0, msg)
+        return
+    yield ScanBatch(True, pairs, targets, len(pairs), "")
+    if msg:
+        yield ScanBatch(True, [], [], len(pairs), msg)
+
 def _choose_theme():
     """优先使用带“✔”对勾的原生 Windows 主题，其次退回 clam。"""
     st = ttk.Style()
@@ -41,7 +55,8 @@ def _choose_theme():
     return st.theme_use()
 
 def Main():
-    ctx = {"P4": None}
+    Trace.EnableFromEnv()  # P4CASESYNC_TRACE：退出时在 stderr 输出埋点汇总（可选导出 trace）
+    ctx = {"P4": None, "Cache": None, "Changelists": None}  # Cache: 跨会话的 where/目录解析缓存
 
     root = Tk.Tk()
     root.title("P4 SubmitList Tool")
@@ -62,6 +77,9 @@ def Main():
 
     current = {"frame": None}
     state = {"current_cl": "default"}  # 记录当前选择的 changelist
+    scan = {"token": 0, "stop": None, "seed": {}}  # 当前后台扫描：令牌 + 中断事件 + 各行解析结果（供监视沿用）
+    prefetch = {"job": None}            # 登录时发起的 StartupPrefetch
+    watch = {"live": None}              # 跟踪本地改动的 LiveRescan
 
     def ui(fn, *a, **kw):
         root.after(0, lambda: fn(*a, **kw))
@@ -86,25 +104,34 @@ def Main():
         current["frame"] = f
         f.pack(fill="both", expand=True)
         f.SetOnListChangelists(on_list_changelists)
+        f.SetOnLoadMoreChangelists(lambda: ctx["Changelists"] and ctx["Changelists"].LoadMore())
         f.SetOnRefresh(on_refresh)
         f.SetOnApply(on_apply)
+        f.SetOnCancelScan(cancel_scan)
+        f.SetOnWatchToggle(on_watch_toggle)
+
+        # 预取的 changelist 列表到达后直接填充下拉
+        job = prefetch["job"]
+        if job is not None:
+            def fill_changelists(_fut):
+                def apply():
+                    items = job.TakeChangelists()
+                    provider = ctx["Changelists"]
+                    if items is not None and provider is not None:
+                        provider.Seed(items)
+                        if current["frame"] is f:
+                            f.SetChangelistItems(provider.Items(), provider.HasMore)
+                ui(apply)
+            job.ChangelistsFuture.add_done_callback(fill_changelists)
         on_refresh("default")
+        # 上次 apply 被中断（崩溃/强制退出）：先询问续做还是回滚
+        root.after(0, check_journal)
 
     # ---- UI 便捷 ----
-    def render_pairs(pairs, targets):
-        f = current["frame"]
-        if isinstance(f, MainFrame):
-            f.RenderPairs(pairs, targets)
-
-    def open_progress(total, stop_event, on_closed):
-        f = current["frame"]
-        if isinstance(f, MainFrame):
-            f.OpenProgress(total, stop_event, on_closed)
-
-    def update_progress(done, ok, fail, skip, msg=""):
+    def open_progress(total, stop_event, on_closed, channel):
         f = current["frame"]
         if isinstance(f, MainFrame):
-            f.UpdateProgress(done, ok, fail, skip, msg)
+            f.OpenProgress(total, stop_event, on_closed, channel)
 
     def mark_progress_done(ok, fail, skip):
         f = current["frame"]
@@ -117,7 +144,11 @@ def Main():
     # ---- 事件回调 ----
     def on_connected(server: str, user: str, client: str, password_or_none):
         p4 = P4Context(server, user, client)
-        ok, msg = p4.Test()
+        if ctx["Cache"] is None:
+            ctx["Cache"] = ResolveCache()
+        # info / changelist 列表 / default 的 opened 同时发出；这里只等 info（即连接测试）
+        job = StartupPrefetch(p4, Cache=ctx["Cache"])
+        ok, _info, msg = job.InfoFuture.result()
         if not ok:
             pw = password_or_none
             if NeedsPassword(msg):
@@ -128,37 +159,218 @@ def Main():
             if not ok:
                 show_error(msg or "登录失败")
                 return
+            job = StartupPrefetch(p4, Cache=ctx["Cache"])  # 登录前发出的查询会因未登录失败，重新预取
+        prefetch["job"] = job
         try:
             SaveCachedP4User(server, user, client)
         except Exception:
             pass
         ctx["P4"] = p4
+        ctx["Changelists"] = ChangelistProvider(
+            p4, OnUpdated=lambda items, has_more: ui(fill_changelists, items, has_more))
         show_main()
 
+    def fill_changelists(items, has_more):
+        f = current["frame"]
+        if isinstance(f, MainFrame):
+            f.SetChangelistItems(items, has_more)
+
     def on_list_changelists():
-        if not ctx["P4"]:
-            return [("default", "default (未提交)")]
-        return GetPendingChangelists(ctx["P4"], Max=50)
+        # 只取缓存，过期时由 provider 在后台刷新并经 fill_changelists 送回
+        provider = ctx["Changelists"]
+        if provider is None:
+            return [("default", "default (未提交)")], False
+        return provider.Items(), provider.HasMore
+
+    def cancel_scan():
+        if scan["stop"] is not None:
+            scan["stop"].set()
+
+    def stop_watch():
+        live = watch["live"]
+        watch["live"] = None
+        if live is not None:
+            live.Stop()
+
+    def start_watch():
+        """按当前列表启动实时重扫；更新按扫描令牌投递，列表被新扫描替换后自动作废。"""
+        stop_watch()
+        f = current["frame"]
+        if not ctx["P4"] or not isinstance(f, MainFrame) or not f.WatchVar.get() or f.IsScanning():
+            return
+        depots, autos = f.GetAutoRows()
+        if not depots:
+            return
+        token = scan["token"]
+        live = LiveRescan(ctx["P4"].Clone(), depots, autos, Cache=ctx["Cache"], Seed=scan["seed"])
+        watch["live"] = live
+
+        def deliver(updates):
+            f = current["frame"]
+            if token != scan["token"] or watch["live"] is not live or not isinstance(f, MainFrame):
+                return
+            scan["seed"] = {}  # 刷新时的解析结果已过期，再次开启监视时重新解析
+            f.UpdateAutoTargets(updates)
+
+        live.Start(lambda updates: ui(deliver, updates))
+
+    def on_watch_toggle(on: bool):
+        if on:
+            start_watch()
+        else:
+            stop_watch()
 
     def on_refresh(changelist: str):
         if not ctx["P4"]:
             show_error("尚未连接 P4。"); return
         state["current_cl"] = (changelist or "default")
-        ok, pairs, targets, msg = GetOpenedPairs(ctx["P4"], changelist)
-        if not ok:
-            show_error(msg or "获取 Opened 列表失败"); return
-        render_pairs(pairs, targets)
+
+        # 新的选择会中断上一轮扫描；旧线程送回的批次按令牌丢弃
+        cancel_scan()
+        stop_watch()
+        scan["token"] += 1
+        scan["seed"] = {}
+        token = scan["token"]
+        stop_evt = threading.Event()
+        scan["stop"] = stop_evt
+
+        f = current["frame"]
+        if isinstance(f, MainFrame):
+            f.BeginScan()
+
+        def deliver(batch):
+            f = current["frame"]
+            if token != scan["token"] or not isinstance(f, MainFrame):
+                return
+            if batch.Total:
+                f.SetScanTotal(batch.Total)
+            for (src, _dst), seed in zip(batch.Pairs, batch.Resolved):
+                scan["seed"][src] = seed
+            if batch.Pairs:
+                # 全部 changelist 模式下带上每行所属 changelist，列表按其分组
+                changes = batch.Changes if changelist == ALL_CHANGELISTS else None
+                f.AppendPairs(batch.Pairs, batch.Targets, changes)
+
+        def finish(ok, msg):
+            f = current["frame"]
+            if token != scan["token"] or not isinstance(f, MainFrame):
+                return
+            scan["stop"] = None
+            f.EndScan(cancelled=stop_evt.is_set())
+            if not ok:
+                show_error(msg or "获取 Opened 列表失败")
+                return
+            start_watch()
+            if msg:
+                messagebox.showwarning("提示", msg)
+
+        job = prefetch["job"]
+        opened_fut = job.TakeOpened(changelist) if job is not None else None
+
+        def superseded():
+            # 被中断，或已有更新的刷新：不再投递本轮结果
+            return stop_evt.is_set() or token != scan["token"]
+
+        def worker():
+            ok, warnings = True, []
+            seen_changes = []  # 全部 changelist 扫描时顺带得到各 changelist 的文件数
+            try:
+                if opened_fut is not None:
+                    # 预取结果可能还在路上：等待期间同样响应中断
+                    while not opened_fut.done() and not superseded():
+                        wait([opened_fut], timeout=0.1)
+                    batches = iter(()) if superseded() else _batches_from_result(*opened_fut.result())
+                else:
+                    batches = IterOpenedPairs(ctx["P4"], changelist, StopEvent=stop_evt, Cache=ctx["Cache"])
+                for batch in batches:
+                    if superseded():
+                        break
+                    if not batch.Ok:
+                        ok = False
+                        warnings.append(batch.Msg)
+                        break
+                    if batch.Msg:
+                        warnings.append(batch.Msg)
+                    seen_changes.extend(batch.Changes)
+                    ui(deliver, batch)
+                provider = ctx["Changelists"]
+                if ok and changelist == ALL_CHANGELISTS and not superseded() and provider is not None:
+                    provider.SetCounts(CountByChange(seen_changes))
+            except Exception as e:
+                ok = False
+                warnings.append(f"扫描异常：{e!r}")
+            ui(finish, ok, "；".join(w for w in warnings if w))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def journal_file():
+        p4 = ctx["P4"]
+        return JournalPath(p4.Server, p4.User, p4.Client)
+
+    def check_journal() -> bool:
+        """存在未完成的 apply 日志时询问处理方式；返回 True 表示可以继续新的 apply。"""
+        if not ctx["P4"]:
+            return True
+        p4 = ctx["P4"]
+        pending = PendingJournal(p4.Server, p4.User, p4.Client)
+        if pending is None:
+            return True
+        answer = messagebox.askyesnocancel(
+            "未完成的 apply",
+            f"上次 apply（{pending.Time}）没有正常结束，{len(pending.Pending)} 个文件尚未移动到目标路径。\n\n"
+            "是：继续完成（已完成的 move 不会重复执行）\n"
+            "否：回滚到原始路径\n"
+            "取消：暂不处理（处理之前不能执行新的 apply）")
+        if answer is None:
+            return False
+        recover(pending, rollback=not answer)
+        return False
+
+    def recover(pending, rollback: bool):
+        """后台按日志与 opened 快照生成续做/回滚计划，再按普通 apply 执行。"""
+        def worker():
+            c = ctx["P4"].Clone()
+            try:
+                ok, moves, origins, lost, msg = PlanRecovery(c, pending, Rollback=rollback)
+            except Exception as e:
+                ok, moves, origins, lost, msg = False, [], {}, [], f"{e!r}"
+            finally:
+                c.Close()
+            ui(on_planned, ok, moves, origins, lost, msg)
+
+        def on_planned(ok, moves, origins, lost, msg):
+            if not ok:
+                show_error(msg or "获取 Opened 列表失败"); return
+            notes = [f"[LOST] {e.Current}（原始路径 {e.Origin}）" for e in lost]
+            if not moves:
+                DiscardJournal(pending)
+                messagebox.showinfo("提示", "\n".join(["日志中的文件均已在目标位置，无需处理。"] + notes[:20]))
+                on_refresh(state["current_cl"])
+                return
+            start_apply(moves, origins, notes, on_finished=lambda: on_refresh(state["current_cl"]))
+
+        threading.Thread(target=worker, daemon=True).start()
 
     def on_apply(indices, pairs, targets):
         if not ctx["P4"]:
             show_error("尚未连接 P4。"); return
 
-        total = len(indices)
-        if total == 0:
+        if len(indices) == 0:
             messagebox.showinfo("提示", "没有需要应用的项。"); return
-
+        if not check_journal():
+            return
+        start_apply([(idx, pairs[idx][0], targets[idx]) for idx in indices])
+
+    def start_apply(moves, origins=None, notes=None, on_finished=None):
+        """
+        执行一批 move（普通 apply 与中断恢复共用）；每次 `p4 move` 记入日志。
+        origins: 续做/回滚时各条目的原始路径；on_finished: 结果弹窗关闭后调用
+        """
+        total = len(moves)
+        # move 会改变 depot 路径，当前列表的监视随之失效（应用后刷新会重新开始）
+        stop_watch()
         stop_evt = threading.Event()
-        logs = []
+        logs = list(notes or [])
         ok_count = 0
         fail_count = 0
         skip_count = 0
@@ -170,84 +382,36 @@ def Main():
                 msg_lines.append("")
                 msg_lines.append("\n".join(tail))
             messagebox.showinfo("执行结果", "\n".join(msg_lines))
+            if on_finished is not None:
+                on_finished()
 
-        open_progress(total, stop_event=stop_evt, on_closed=after_progress_closed)
-
-        # —— 一致性检测工具（基于当前 CL）
-        def _opened_paths_in_current_cl():
-            ok2, p2, _t2, _ = GetOpenedPairs(ctx["P4"], state["current_cl"])
-            if not ok2:
-                return []
-            return [src for (src, _dstcand) in p2]
-
-        def _is_exact_match(dst: str) -> bool:
-            return any(p == dst for p in _opened_paths_in_current_cl())
-
-        def _find_casefold_match(dst: str):
-            dlow = (dst or "").casefold()
-            for p in _opened_paths_in_current_cl():
-                if p.casefold() == dlow:
-                    return p
-            return None
+        # 工作线程只写进度通道，由进度弹窗按帧率轮询（避免每条都投递一次 after 回调）
+        channel = ProgressChannel(total)
+        open_progress(total, stop_event=stop_evt, on_closed=after_progress_closed, channel=channel)
+        journal = ApplyJournal(journal_file())
 
         def worker():
             nonlocal ok_count, fail_count, skip_count
-            for i, idx in enumerate(indices, start=1):
-                if stop_evt.is_set():
-                    logs.append("[INTERRUPT] 用户中断")
-                    break
-                try:
-                    src = pairs[idx][0]
-                    dst = targets[idx]
-                    if not dst or src == dst:
-                        skip_count += 1
-                        ui(update_progress, i, ok_count, fail_count, skip_count, "跳过无变化")
-                        continue
-
-                    step_msg = f"{src} → {dst}"
-
-                    # 方法1
-                    if TrySingleMove(ctx["P4"], src, dst):
-                        if _is_exact_match(dst):
-                            ok_count += 1
-                            logs.append(f"[OK] move {src} -> {dst}")
-                            ui(update_progress, i, ok_count, fail_count, skip_count, step_msg)
-                            continue
-                        # 方法2修正
-                        cur = _find_casefold_match(dst)
-                        if cur and TryTwoMoves(ctx["P4"], cur, dst) and _is_exact_match(dst):
-                            ok_count += 1
-                            logs.append(f"[OK] move*2(fix-after-1st) {cur} -> {dst}")
-                            ui(update_progress, i, ok_count, fail_count, skip_count, step_msg)
-                            continue
-                        else:
-                            fail_count += 1
-                            logs.append(f"[FAIL] move(after-1st) {src} -> {dst}")
-                            ui(update_progress, i, ok_count, fail_count, skip_count, step_msg)
-                            continue
-
-                    # 方法2（直接）
-                    cur = _find_casefold_match(dst) or src
-                    if TryTwoMoves(ctx["P4"], cur, dst) and _is_exact_match(dst):
-                        ok_count += 1
-                        logs.append(f"[OK] move*2 {cur} -> {dst}")
-                    else:
-                        fail_count += 1
-                        logs.append(f"[FAIL] move {cur} -> {dst}")
-
-                    ui(update_progress, i, ok_count, fail_count, skip_count, step_msg)
-
-                except Exception as e:
-                    fail_count += 1
-                    logs.append(f"[EXCEPT] idx={idx} err={e!r}")
-                    ui(update_progress, i, ok_count, fail_count, skip_count, f"异常：{e!r}")
-
+            try:
+                # 规划（目录级折叠）+ 执行 + 一次快照复核
+                results, run_logs = ApplyMoves(ctx["P4"], moves, OnProgress=channel.Put, StopEvent=stop_evt,
+                                               Journal=journal, Origins=origins)
+                logs.extend(run_logs)
+            except Exception as e:
+                results = {}
+                logs.append(f"[EXCEPT] err={e!r}")
+            finally:
+                channel.Close()
+            ok_count   = sum(1 for st in results.values() if st == "ok")
+            fail_count = sum(1 for st in results.values() if st == "fail")
+            skip_count = sum(1 for st in results.values() if st == "skip")
             ui(mark_progress_done, ok_count, fail_count, skip_count)
 
         threading.Thread(target=worker, daemon=True).start()
 
     show_login()
     root.mainloop()
+    Trace.Finish()
 
 if __name__ == "__main__":
     Main()
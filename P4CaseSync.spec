@@ -18,6 +18,12 @@ a = Analysis(
         'LoginUI',
         'MainUI',
         'Core',
+        'P4Backend',
+        'AsyncCore',
+        'ResolveCache',
+        'Watch',
+        'Trace',
+        'Journal',
     ],
     hookspath=[],
     hooksconfig={},
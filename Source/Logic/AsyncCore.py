@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Optional
+
+from P4Backend import P4Backend, SubprocessBackend, _collect_records, _decode_p4, _parse_marshal_stream
+from Core import (
+    P4Context, DirCaseCache, DEFAULT_FS_WORKERS,
+    _opened_args, _opened_stage, _chunk_args, _where_from_records, _where_stage,
+    _resolve_local_cases, _target_stage, _changes_args, _changelists_from_records,
+)
+
+# 同时在途的 p4 命令数上限
+DEFAULT_ASYNC_CONCURRENCY = 8
+
+# ===================== 异步 P4 上下文 =====================
+class AsyncP4Context:
+    """
+    P4Context 的 asyncio 版本：
+      - 子进程后端（默认）使用 asyncio 子进程，不占用线程；
+      - 其它后端（P4Python / Fake）在默认线程池中调用其同步接口；
+      - 所有命令经信号量限流，最多 MaxConcurrency 条同时在途。
+    """
+    def __init__(self, Server: str, User: str, Client: str,
+                 MaxConcurrency: int = DEFAULT_ASYNC_CONCURRENCY, Backend: Optional[P4Backend] = None):
+        self.Server = Server
+        self.User   = User
+        self.Client = Client
+        self.Backend = Backend if Backend is not None else SubprocessBackend()
+        self.MaxConcurrency = max(1, int(MaxConcurrency or 1))
+        self._Sem: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def FromContext(ctx: P4Context, MaxConcurrency: int = DEFAULT_ASYNC_CONCURRENCY) -> "AsyncP4Context":
+        return AsyncP4Context(ctx.Server, ctx.User, ctx.Client, MaxConcurrency, ctx.Backend)
+
+    def _sem(self) -> asyncio.Semaphore:
+        # 信号量需要在事件循环内创建（Python 3.8/3.9 会绑定创建时的循环）
+        if self._Sem is None:
+            self._Sem = asyncio.Semaphore(self.MaxConcurrency)
+        return self._Sem
+
+    def _cmd(self, args: List[str]) -> List[str]:
+        return ["p4", "-p", self.Server, "-u", self.User, "-c", self.Client] + (args or [])
+
+    async def _run(self, args: List[str]) -> Tuple[int, bytes, bytes]:
+        proc = await asyncio.create_subprocess_exec(
+            *self._cmd(args), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        out, err = await proc.communicate()
+        return proc.returncode, out, err
+
+    async def ExecAsync(self, args: List[str]) -> subprocess.CompletedProcess:
+        async with self._sem():
+            if not isinstance(self.Backend, SubprocessBackend):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, self.Backend.Exec, self, args)
+            rc, out, err = await self._run(args)
+            return subprocess.CompletedProcess(self._cmd(args), rc, _decode_p4(out), _decode_p4(err))
+
+    async def ExecRecordsAsync(self, args: List[str]) -> Tuple[bool, List[Dict[str, str]], str]:
+        """与 P4Context.ExecRecords 相同的返回约定：(ok, records, msg)。"""
+        async with self._sem():
+            if not isinstance(self.Backend, SubprocessBackend):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, self.Backend.ExecRecords, self, args)
+            rc, out, err = await self._run(["-G"] + (args or []))
+            return _collect_records(rc, _parse_marshal_stream(out), _decode_p4(err))
+
+# ===================== Changelist 列表 =====================
+async def GetPendingChangelistsAsync(actx: AsyncP4Context, Max: int = 50) -> List[Tuple[str, str]]:
+    """GetPendingChangelists 的异步版本。"""
+    ok, records, _msg = await actx.ExecRecordsAsync(_changes_args(actx.Client, Max))
+    if not ok:
+        return []
+    return _changelists_from_records(records)
+
+# ===================== Opened 列表 =====================
+async def GetOpenedPairsAsync(actx: AsyncP4Context, changelist: str,
+                              DirCache: Optional[DirCaseCache] = None,
+                              FsWorkers: int = DEFAULT_FS_WORKERS,
+                              ChunkBudget: int = 4000) -> Tuple[bool, List[Tuple[str, str]], List[str], str]:
+    """
+    GetOpenedPairs 的异步版本，返回值相同。
+    opened 之后把 where 切成较小的块并发查询（受 actx 的信号量限流）；
+    每块 where 一返回，就把该块的本地路径交给线程池做大小写纠正，
+    因此服务器查询与本地文件系统工作相互重叠，而不是逐阶段串行。
+    各块共享同一个 DirCaseCache（同一目录并发请求时只读一次）和同一个 FsWorkers 线程池，
+    祖先目录不会按块重复 listdir，线程数也不随块数增长；输出顺序与 opened 一致。
+    """
+    ok, records, msg = await actx.ExecRecordsAsync(_opened_args(changelist))
+    if not ok:
+        return False, [], [], msg
+    opened, warnings = _opened_stage(records)
+
+    dir_cache = DirCache if DirCache is not None else DirCaseCache()
+    loop = asyncio.get_running_loop()
+    depots = list(dict.fromkeys(o[0] for o in opened))
+    chunks = _chunk_args(depots, ChunkBudget) if depots else []
+
+    async def where_then_resolve(chunk: List[str]) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, str]]:
+        _ok, recs, _m = await actx.ExecRecordsAsync(["where"] + chunk)
+        table = _where_from_records(recs)
+        locals_ = [local for (_client, local) in table.values() if local]
+        cases = await loop.run_in_executor(None, _resolve_local_cases, locals_, dir_cache, FsWorkers, fs_pool)
+        return table, cases
+
+    fs_pool = ThreadPoolExecutor(max_workers=FsWorkers) if FsWorkers > 1 else None
+    where_table: Dict[str, Tuple[str, str]] = {}
+    local_cases: Dict[str, str] = {}
+    try:
+        for table, cases in await asyncio.gather(*(where_then_resolve(c) for c in chunks)):
+            where_table.update(table)
+            local_cases.update(cases)
+    finally:
+        if fs_pool is not None:
+            fs_pool.shutdown(wait=False)
+
+    resolved, unmapped = _where_stage(opened, where_table)
+    pairs, targets = _target_stage(resolved, local_cases, {})
+    if unmapped:
+        warnings.append(f"{unmapped} 个文件 where 未映射，仅按文件名规范化")
+    return True, pairs, targets, "；".join(warnings)
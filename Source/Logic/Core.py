@@ -1,8 +1,16 @@
 # -*- coding: utf-8 -*-
 
-import os, re, json, subprocess
+import os, re, json, hashlib, subprocess, threading, time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import queue
+from collections import deque
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple, Optional
+
+from P4Backend import P4Backend, MakeBackend, _escape_p4_name
+from ResolveCache import ResolveCache, DirSignature
+from Journal import ApplyJournal, JournalEntry, JournalState, MapMove
+import Trace
 
 # ===================== 缓存：Server/User/Client =====================
 def _cache_path() -> Path:
@@ -53,18 +61,49 @@ def SaveCachedP4User(server: str, user: str, client: str) -> None:
 class P4Context:
     """
     封装 p4 命令调用的上下文（Server/User/Client）。
+    实际执行交给 Backend（见 P4Backend.py）：默认每条命令一个 p4 子进程；
+    也可换成持久连接（P4Python）或进程内模拟服务器（FakeBackend）。
     """
-    def __init__(self, Server: str, User: str, Client: str):
+    def __init__(self, Server: str, User: str, Client: str, Backend: Optional[P4Backend] = None):
         self.Server = Server
         self.User   = User
         self.Client = Client
+        self.Backend = Backend if Backend is not None else MakeBackend()
+        self.Info: Optional["ServerInfo"] = None  # GetServerInfo() 成功后缓存
 
-    def _cmd(self, args: List[str]) -> List[str]:
-        base = ["p4", "-p", self.Server, "-u", self.User, "-c", self.Client]
-        return base + (args or [])
+    def Clone(self) -> "P4Context":
+        """同一连接参数的独立上下文，供并发执行线程各自使用。"""
+        c = P4Context(self.Server, self.User, self.Client, self.Backend.Clone())
+        c.Info = self.Info
+        return c
 
     def Exec(self, args: List[str]) -> subprocess.CompletedProcess:
-        return subprocess.run(self._cmd(args), text=True, capture_output=True)
+        if not Trace.Enabled:
+            return self.Backend.Exec(self, args)
+        t0 = Trace.Now()
+        r = self.Backend.Exec(self, args)
+        Trace.Record("p4", args[0] if args else "", t0, Trace.Now(),
+                     Bytes=len(r.stdout or ""), rc=r.returncode, argc=len(args))
+        return r
+
+    def ExecRecords(self, args: List[str]) -> Tuple[bool, List[Dict[str, str]], str]:
+        """
+        以结构化模式（`p4 -G` 或等价的 tagged 输出）执行命令。
+        返回 (ok, records, msg)：
+          - records: code == "stat" 的记录（字段名同 -ztag，如 depotFile/clientFile/path/action/change）
+          - msg: error/info 记录的文本（多条以换行拼接）
+          - ok: 进程返回 0 且没有 severity >= 3（失败/致命）的错误记录；
+                "file(s) not in client view" 之类的警告不影响 ok，但会出现在 msg 中
+        """
+        if not Trace.Enabled:
+            return self.Backend.ExecRecords(self, args)
+        t0 = Trace.Now()
+        ok, records, msg = self.Backend.ExecRecords(self, args)
+        # 结构化输出拿不到原始 stdout，按解码后的键值长度近似
+        size = sum(len(k) + len(v) for rec in records for (k, v) in rec.items())
+        Trace.Record("p4", args[0] if args else "", t0, Trace.Now(),
+                     Bytes=size, ok=ok, records=len(records), argc=len(args))
+        return ok, records, msg
 
     def Test(self) -> Tuple[bool, str]:
         r = self.Exec(["info"])
@@ -73,12 +112,39 @@ class P4Context:
         return ok, msg
 
     def Login(self, password: str) -> Tuple[bool, str]:
-        p = subprocess.Popen(["p4", "-p", self.Server, "-u", self.User, "login"],
-                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        out, err = p.communicate((password or "") + "\n")
-        ok = (p.returncode == 0)
-        msg = (err or out or "").strip()
-        return ok, msg
+        return self.Backend.Login(self, password)
+
+    def Close(self) -> None:
+        self.Backend.Close()
+
+# ===================== 服务器信息 =====================
+class ServerInfo(NamedTuple):
+    Address: str
+    Version: str
+    CaseHandling: str   # "insensitive" / "sensitive"；旧服务器不返回时为 ""
+    ClientRoot: str
+
+    @property
+    def CaseInsensitive(self) -> bool:
+        return self.CaseHandling != "sensitive"
+
+def GetServerInfo(ctx: P4Context) -> Tuple[bool, Optional[ServerInfo], str]:
+    """
+    `p4 info`：既作为连接测试，也取回服务器大小写策略等信息。
+    返回 (ok, info, msg)；成功时同时缓存到 ctx.Info。
+    """
+    ok, records, msg = ctx.ExecRecords(["info"])
+    if not ok or not records:
+        return False, None, msg
+    rec = records[0]
+    info = ServerInfo(
+        Address=rec.get("serverAddress", ""),
+        Version=rec.get("serverVersion", ""),
+        CaseHandling=(rec.get("caseHandling") or "").strip().lower(),
+        ClientRoot=rec.get("clientRoot", ""),
+    )
+    ctx.Info = info
+    return True, info, msg
 
 # ===================== Changelist 列表（待提交）=====================
 def GetPendingChangelists(ctx: P4Context, Max: int = 50) -> List[Tuple[str, str]]:
@@ -88,70 +154,433 @@ def GetPendingChangelists(ctx: P4Context, Max: int = 50) -> List[Tuple[str, str]
         id: "default" 或 数字字符串
         label: 用于 UI 展示，如 "12345 - 修复命名大小写"
     """
+    ok, records, _msg = ctx.ExecRecords(_changes_args(ctx.Client, Max))
+    if not ok:
+        return []
+    return _changelists_from_records(records)
+
+def _changes_args(client: str, Max: int) -> List[str]:
+    return ["changes", "-c", client, "-s", "pending", "-m", str(Max)]
+
+def _changelists_from_records(records: List[Dict[str, str]]) -> List[Tuple[str, str]]:
     out: List[Tuple[str, str]] = []
-    # p4 changes -c <client> -s pending -m N
-    r = ctx.Exec(["changes", "-c", ctx.Client, "-s", "pending", "-m", str(Max)])
-    if r.returncode != 0:
-        return out
-    # 行示例：Change 12345 on 2025/08/10 by user@client 'desc...'
-    for line in (r.stdout or "").splitlines():
-        m = re.match(r"^Change\s+(\d+)\s+on\s+.+? by .+? '(.+)'", line.strip())
-        if not m:
+    for rec in records:
+        cl = (rec.get("change") or "").strip()
+        if not cl:
             continue
-        cl = m.group(1)
-        desc = (m.group(2) or "").strip()
-        label = f"{cl} - {desc}"
+        desc = (rec.get("desc") or "").strip().splitlines()
+        label = f"{cl} - {desc[0].strip() if desc else ''}"
         out.append((cl, label))
     return out
 
+def GetOpenedCounts(ctx: P4Context) -> Optional[Dict[str, int]]:
+    """
+    一次 `p4 opened` 统计每个 changelist 中列表会显示的文件数（edit/add/move/add，含 default）；
+    失败返回 None。
+    """
+    ok, records, _msg = ctx.ExecRecords(_opened_args(ALL_CHANGELISTS))
+    if not ok:
+        return None
+    return CountByChange(change for (_dep, _action, change) in _opened_stage(records)[0])
+
+def CountByChange(changes: Iterable[str]) -> Dict[str, int]:
+    """[change, ...] -> {change: 文件数}；全部 changelist 扫描的结果可直接交给 ChangelistProvider.SetCounts。"""
+    counts: Dict[str, int] = {}
+    for change in changes:
+        counts[change] = counts.get(change, 0) + 1
+    return counts
+
+DEFAULT_CL_PAGE = 50          # 每页 changelist 数
+DEFAULT_CL_TTL  = 30.0        # 秒，缓存过期后下次打开下拉时在后台刷新
+DEFAULT_CL_COUNTS_TTL = 600.0 # 秒，文件数统计（工作区范围的 `p4 opened`，大工作区上很贵）的有效期
+
+class ChangelistProvider:
+    """
+    下拉用的待提交 changelist 列表：
+      - Items() 立即返回缓存（从不等待服务器），过期时顺带在后台刷新；
+      - LoadMore() 把条数上限增加一页后在后台重新查询（`changes -m` 只能从最新往前取）；
+      - 标签里的文件数来自工作区范围的 `p4 opened`，单独按 CountsTtl 过期，不随列表的 Ttl 重查；
+        全部 changelist 扫描完成后可用 SetCounts() 直接更新，Refresh() 使其失效；
+      - 后台结果到达后调用 OnUpdated(items, has_more)（在后台线程中调用）。
+    同一时间只有一个后台查询，期间的新请求合并为结束后再查一次。
+    """
+    def __init__(self, ctx: P4Context, PageSize: int = DEFAULT_CL_PAGE, Ttl: float = DEFAULT_CL_TTL,
+                 OnUpdated: Optional[Callable[[List[Tuple[str, str]], bool], None]] = None,
+                 CountsTtl: float = DEFAULT_CL_COUNTS_TTL):
+        self.Ctx = ctx
+        self.PageSize = max(1, int(PageSize))
+        self.Ttl = float(Ttl)
+        self.CountsTtl = float(CountsTtl)
+        self.OnUpdated = OnUpdated
+        self._Lock = threading.Lock()
+        self._Limit = self.PageSize
+        self._Changes: List[Tuple[str, str]] = []    # [(id, "id - 描述")]，不含 default
+        self._Counts: Optional[Dict[str, int]] = None
+        self._CountsStamp = 0.0                      # 上次得到文件数的时间（monotonic）
+        self._HasMore = False
+        self._Stamp = 0.0                            # 上次成功查询 changes 的时间（monotonic）
+        self._Busy = False
+        self._Again = False
+
+    @property
+    def HasMore(self) -> bool:
+        return self._HasMore
+
+    def Seed(self, items: List[Tuple[str, str]]) -> None:
+        """用已有结果（如启动预取）填充，视为刚刚查询过；文件数随后在后台补齐。"""
+        with self._Lock:
+            self._Changes = [i for i in items if i[0] != "default"]
+            self._HasMore = len(self._Changes) >= self._Limit
+            self._Stamp = time.monotonic()
+        self._kick()
+
+    def Items(self) -> List[Tuple[str, str]]:
+        """缓存的 [(id, label)]（default 在最前，label 带文件数）；过期时发起后台刷新。"""
+        with self._Lock:
+            stale = self._changes_stale() or self._counts_stale()
+            items = self._items_locked()
+        if stale:
+            self._kick()
+        return items
+
+    def SetCounts(self, counts: Dict[str, int]) -> None:
+        """用已有的全部 changelist 扫描结果更新文件数（免去一次 `p4 opened`）。"""
+        with self._Lock:
+            self._Counts = dict(counts)
+            self._CountsStamp = time.monotonic()
+            items, has_more = self._items_locked(), self._HasMore
+        if callable(self.OnUpdated):
+            self.OnUpdated(items, has_more)
+
+    def Refresh(self) -> None:
+        """强制在后台重新查询列表与文件数（如应用修改后）。"""
+        with self._Lock:
+            self._Stamp = 0.0
+            self._CountsStamp = 0.0
+        self._kick()
+
+    def _changes_stale(self) -> bool:
+        return not self._Stamp or time.monotonic() - self._Stamp >= self.Ttl
+
+    def _counts_stale(self) -> bool:
+        return self._Counts is None or not self._CountsStamp or time.monotonic() - self._CountsStamp >= self.CountsTtl
+
+    def LoadMore(self) -> None:
+        with self._Lock:
+            self._Limit += self.PageSize
+            self._Stamp = 0.0
+        self._kick()
+
+    def _items_locked(self) -> List[Tuple[str, str]]:
+        counts = self._Counts
+        def with_count(cl: str, label: str) -> str:
+            if counts is None:
+                return label
+            return f"{label}（{counts.get(cl, 0)} 个文件）"
+        items = [("default", with_count("default", "default (未提交)"))]
+        items += [(cl, with_count(cl, label)) for (cl, label) in self._Changes]
+        return items
+
+    def _kick(self) -> None:
+        with self._Lock:
+            if self._Busy:
+                self._Again = True
+                return
+            self._Busy = True
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def _worker(self) -> None:
+        c = self.Ctx.Clone()
+        try:
+            while True:
+                with self._Lock:
+                    self._Again = False
+                    limit = self._Limit
+                    need_changes = self._changes_stale()
+                    need_counts = self._counts_stale()
+                changes = counts = None
+                if need_changes:
+                    ok, records, _msg = c.ExecRecords(_changes_args(c.Client, limit))
+                    changes = _changelists_from_records(records) if ok else None
+                if need_counts:
+                    counts = GetOpenedCounts(c)
+                with self._Lock:
+                    if changes is not None:
+                        self._Changes = changes
+                        self._HasMore = len(changes) >= limit
+                        self._Stamp = time.monotonic()
+                    if counts is not None:
+                        self._Counts = counts
+                        self._CountsStamp = time.monotonic()
+                    items, has_more = self._items_locked(), self._HasMore
+                    again = self._Again
+                    if not again:
+                        self._Busy = False
+                if callable(self.OnUpdated):
+                    self.OnUpdated(items, has_more)
+                if not again:
+                    return
+        except Exception:
+            with self._Lock:
+                self._Busy = False
+        finally:
+            if c.Backend is not self.Ctx.Backend:
+                c.Close()
+
 # ===================== 名称规范化 & Opened 解析 =====================
 def NormalizeName(name: str) -> str:
     # 可在这里扩展大小写/非法字符处理规则；当前仅 strip
     return (name or "").strip()
 
-def _parse_opened_lines(text: str) -> List[Tuple[str, str]]:
+def _opened_from_records(records: List[Dict[str, str]]) -> Tuple[List[Tuple[str, str, str]], int]:
     """
-    解析 p4 opened 输出。
-    返回: [(depot_path, action), ...]
-      例：//depot/Path/File.uasset#3 - edit default change (text)
+    从 `p4 -G opened` 记录中取出 [(depot_path, action, change), ...]。
+    第二个返回值是缺少 depotFile 的记录数，用于提示（不再静默丢弃）。
     """
     out = []
-    for line in (text or "").splitlines():
-        s = line.strip()
-        m = re.match(r"^(//.+?)(?:#\d+)?\s+-\s+([a-zA-Z/]+)\b", s)
-        if m:
-            depot = m.group(1)
-            action = (m.group(2) or "").lower()
-            out.append((depot, action))
-    return out
+    bad = 0
+    for rec in records:
+        depot = rec.get("depotFile") or ""
+        if not depot.startswith("//"):
+            bad += 1
+            continue
+        out.append((depot, (rec.get("action") or "").lower(), (rec.get("change") or "default").strip()))
+    return out, bad
 
 # ===================== where & 路径大小写纠正 =====================
 def _p4_where(ctx: P4Context, any_path: str) -> Optional[Tuple[str, str, str]]:
     """
     调用 `p4 where <path>`，<path> 可以是 depot/client/local 任意一种。
     返回 (depotPath, clientPath, localPath)；失败返回 None。
-    只取第一行映射（多数工作区场景足够）。
+    多行映射（排除/overlay）按 _where_from_records 的规则取生效的那一条。
     """
-    r = ctx.Exec(["where", any_path])
-    if r.returncode != 0:
+    _ok, records, _msg = ctx.ExecRecords(["where", any_path])
+    table = _where_from_records(records)
+    if not table:
         return None
-    line = (r.stdout or "").strip().splitlines()[0].strip()
-    # depot client local  —— client 不含空格，local 可能含空格
-    m = re.match(r"^(//\S+)\s+(//\S+)\s+(.+)$", line)
-    if not m:
+    depot, (client, local) = list(table.items())[-1]
+    return depot, client, local
+
+# 单次命令行参数总长度上限（Windows CreateProcess 上限约 32767，留出余量给 p4 全局参数）
+_WHERE_CMDLINE_BUDGET = 24000
+
+def _chunk_args(items: List[str], budget: int = _WHERE_CMDLINE_BUDGET) -> List[List[str]]:
+    """按命令行长度预算把参数切块，保证每次调用都不超过系统限制。"""
+    chunks: List[List[str]] = []
+    cur: List[str] = []
+    size = 0
+    for it in items:
+        n = len(it) + 3  # 引号 + 空格
+        if cur and size + n > budget:
+            chunks.append(cur); cur = []; size = 0
+        cur.append(it); size += n
+    if cur:
+        chunks.append(cur)
+    return chunks
+
+def _where_from_records(records: List[Dict[str, str]]) -> Dict[str, Tuple[str, str]]:
+    """
+    解析 `p4 -G where` 的记录。
+    返回: {depotPath: (clientPath, localPath)}
+      - 带 unmap 字段（或 depotFile 以 "-" 开头）的是排除映射，忽略；
+      - depotFile 以 "+" 开头的是 overlay 映射，去掉前缀后照常处理；
+      - 同一 depot 出现多条时，以最后一条为准（视图中靠后的映射优先）。
+    """
+    out: Dict[str, Tuple[str, str]] = {}
+    for rec in records:
+        depot = rec.get("depotFile") or ""
+        if "unmap" in rec or depot.startswith("-"):
+            continue
+        depot = depot.lstrip("+")
+        client = rec.get("clientFile") or ""
+        local = rec.get("path") or ""
+        if not depot.startswith("//"):
+            continue
+        out[depot] = (client, local)
+    return out
+
+def _p4_where_batch(ctx: P4Context, depot_paths: List[str],
+                    Cache: Optional[ResolveCache] = None, CacheKey: str = "") -> Dict[str, Tuple[str, str]]:
+    """
+    批量 `p4 where`：把整个 opened 列表按命令行长度切块，每块一次调用。
+    返回: {depotPath: (clientPath, localPath)}；未映射的文件不在表中。
+    部分文件失败（如不在视图中）不影响同一批次里其它文件的记录，因此总是解析全部记录。
+    Cache/CacheKey（见 _where_cache_key）给出时，先查持久缓存，只对未命中的文件发 where。
+    """
+    table: Dict[str, Tuple[str, str]] = {}
+    uniq = list(dict.fromkeys(p for p in depot_paths if p))
+    if Cache is not None and CacheKey:
+        table, uniq = Cache.WhereGet(CacheKey, uniq)
+    fresh: Dict[str, Tuple[str, str]] = {}
+    for chunk in _chunk_args(uniq):
+        _ok, records, _msg = ctx.ExecRecords(["where"] + chunk)
+        fresh.update(_where_from_records(records))
+    if Cache is not None and CacheKey:
+        Cache.WherePut(CacheKey, fresh)
+    table.update(fresh)
+    return table
+
+def GetClientViewHash(ctx: P4Context) -> str:
+    """
+    `client -o` 中影响 where 结果的字段（Root/AltRoots/View/Stream 等）的哈希；
+    视图或根目录一变哈希就变，用作 where 缓存的分桶键。失败时返回 ""。
+    """
+    ok, records, _msg = ctx.ExecRecords(["client", "-o"])
+    if not ok or not records:
+        return ""
+    spec = records[0]
+    keys = sorted(k for k in spec if k in ("Client", "Root", "Stream", "StreamAtChange")
+                  or k.startswith("AltRoots") or k.startswith("View"))
+    h = hashlib.sha1()
+    for k in keys:
+        h.update(f"{k}={spec[k]}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def _where_cache_key(ctx: P4Context, Cache: Optional[ResolveCache]) -> str:
+    if Cache is None:
+        return ""
+    view_hash = GetClientViewHash(ctx)
+    return ResolveCache.WhereKey(ctx.Client, view_hash) if view_hash else ""
+
+def _lookup_where(table: Dict[str, Tuple[str, str]], folded: Dict[str, str],
+                  depot_path: str) -> Optional[Tuple[str, str, str]]:
+    """
+    从批量 where 表中取出 (depotPath, clientPath, localPath)。
+    大小写不敏感的服务器返回的 depot 路径大小写可能与 opened 不同，精确匹配失败时按 casefold 兜底。
+    """
+    key = depot_path if depot_path in table else folded.get(depot_path.casefold())
+    if key is None:
         return None
-    return m.group(1), m.group(2), m.group(3)
+    client, local = table[key]
+    return key, client, local
 
 def _listdir_safe(path: str) -> List[str]:
+    t0 = Trace.Now() if Trace.Enabled else 0.0
     try:
-        return os.listdir(path or os.sep)
+        names = os.listdir(path or os.sep)
     except Exception:
-        return []
+        names = []
+    if t0:
+        Trace.Record("fs", "listdir", t0, Trace.Now(), path=path, entries=len(names))
+    return names
 
-def _correct_case_along_path(local_path: str) -> str:
+class DirCaseCache:
+    """
+    单次扫描（一次刷新）内的目录列表缓存：{目录: {casefold 名称: 真实名称}}。
+    - 每个目录最多 listdir 一次，查找为 O(1)；多个线程同时请求同一目录时只有一个实际读取，
+      其余等待它的结果（single-flight），并发的分块纠正共享祖先目录也不会重复 listdir；
+    - Hits/Misses 统计命中与实际 listdir 次数，可通过 Stats() 查看节省了多少文件系统调用。
+    """
+    def __init__(self):
+        self._Dirs: Dict[str, Tuple[Dict[str, str], set]] = {}
+        self._Reading: Dict[str, Future] = {}  # 正在读取的目录 -> 结果
+        self._Lock = threading.Lock()
+        self.Hits = 0
+        self.Misses = 0
+
+    def _store(self, parent: str, names: List[str]) -> Tuple[Dict[str, str], set]:
+        folded: Dict[str, str] = {}
+        for e in names:
+            folded.setdefault(e.casefold(), e)  # 大小写敏感的文件系统上可能有多个同名，取第一个
+        ent = (folded, set(names))
+        with self._Lock:
+            self.Misses += 1
+            return self._Dirs.setdefault(parent, ent)
+
+    def _entries(self, parent: str) -> Tuple[Dict[str, str], set]:
+        with self._Lock:
+            ent = self._Dirs.get(parent)
+            if ent is not None:
+                self.Hits += 1
+                return ent
+            fut = self._Reading.get(parent)
+            owner = fut is None
+            if owner:
+                fut = self._Reading[parent] = Future()
+            else:
+                self.Hits += 1
+        if not owner:
+            return fut.result()  # 其它线程正在读取同一目录
+        try:
+            ent = self._store(parent, self._read(parent))
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._Lock:
+                self._Reading.pop(parent, None)
+        fut.set_result(ent)
+        return ent
+
+    def _read(self, parent: str) -> List[str]:
+        """实际读取目录内容；子类可在此接入持久缓存。"""
+        return _listdir_safe(parent)
+
+    def Prefetch(self, parents: List[str], pool: Optional[Executor] = None) -> None:
+        """
+        并发预读一批目录（I/O 受限时，如网络盘）。已缓存的目录跳过。
+        pool 为 None 时退化为顺序读取。
+        """
+        with self._Lock:
+            todo = [p for p in dict.fromkeys(parents) if p not in self._Dirs]
+        if pool is None or len(todo) <= 1:
+            for p in todo:
+                self._entries(p)
+            return
+        list(pool.map(self._entries, todo))
+
+    def Lookup(self, parent: str, name: str) -> Optional[str]:
+        """返回 parent 下与 name 大小写不敏感匹配的真实名称；精确同名优先；找不到返回 None。"""
+        folded, exact = self._entries(parent)
+        if name in exact:
+            return name
+        return folded.get((name or "").casefold())
+
+    def Stats(self) -> Dict[str, int]:
+        return {"dirs": len(self._Dirs), "hits": self.Hits, "misses": self.Misses}
+
+class PersistentDirCache(DirCaseCache):
+    """
+    接入 ResolveCache 的目录缓存：先 stat 目录，(mtime, inode) 与磁盘缓存一致时直接复用名称列表，
+    只有真正变化过（或从未见过）的目录才 listdir，并把新结果写回 ResolveCache。
+    Misses 为本次加载的目录数（含复用）；Reused 为其中免去 listdir 的目录数。
+    """
+    def __init__(self, Store: ResolveCache):
+        super().__init__()
+        self.Store = Store
+        self.Reused = 0
+
+    def _read(self, parent: str) -> List[str]:
+        t0 = Trace.Now() if Trace.Enabled else 0.0
+        sig = DirSignature(parent)
+        if t0:
+            Trace.Record("fs", "stat", t0, Trace.Now(), path=parent)
+        if sig is not None:
+            names = self.Store.DirGet(parent, sig)
+            if names is not None:
+                with self._Lock:
+                    self.Reused += 1
+                return names
+        names = _listdir_safe(parent)
+        if sig is not None:
+            self.Store.DirPut(parent, sig, names)
+        return names
+
+    def Stats(self) -> Dict[str, int]:
+        st = super().Stats()
+        st["reused"] = self.Reused
+        return st
+
+def _make_dir_cache(DirCache: Optional[DirCaseCache], Cache: Optional[ResolveCache]) -> DirCaseCache:
+    if DirCache is not None:
+        return DirCache
+    return PersistentDirCache(Cache) if Cache is not None else DirCaseCache()
+
+def _correct_case_along_path(local_path: str, cache: Optional[DirCaseCache] = None) -> str:
     """
     逐级把 local_path 纠正为“磁盘上的真实大小写”。
     即使尾部不存在，也会尽量纠正到能访问到的最深父目录。
+    cache 为同一次扫描共享的目录缓存；不传则临时建一个（仅本次调用有效）。
     """
     if not local_path:
         return local_path
@@ -161,15 +590,78 @@ def _correct_case_along_path(local_path: str) -> str:
     if not parts:
         return local_path
 
+    cache = cache if cache is not None else DirCaseCache()
     # Windows 盘符单独处理（比如 'C:\\'）
     acc = Path(parts[0])
     for name in parts[1:]:
-        parent = str(acc)
-        entries = _listdir_safe(parent)
-        fixed = next((e for e in entries if e.lower() == (name or "").lower()), name)
+        fixed = cache.Lookup(str(acc), name) or name
         acc = acc / fixed
     return str(acc)
 
+class _TrieNode:
+    __slots__ = ("Children", "Ends")
+
+    def __init__(self):
+        self.Children: Dict[str, "_TrieNode"] = {}
+        self.Ends: List[str] = []  # 以该节点结尾的原始本地路径
+
+def _build_path_trie(local_paths: List[str]) -> Dict[str, _TrieNode]:
+    """按路径层级构建前缀树；顶层按根（盘符或 '/'）分组。"""
+    roots: Dict[str, _TrieNode] = {}
+    for lp in local_paths:
+        parts = Path(lp).parts
+        if not parts:
+            continue
+        node = roots.setdefault(parts[0], _TrieNode())
+        for name in parts[1:]:
+            child = node.Children.get(name)
+            if child is None:
+                child = node.Children[name] = _TrieNode()
+            node = child
+        node.Ends.append(lp)
+    return roots
+
+# 目录纠正阶段的默认并发数（listdir 在网络盘上是 I/O 延迟受限的）
+DEFAULT_FS_WORKERS = 8
+
+def _resolve_local_cases(local_paths: List[str], cache: DirCaseCache,
+                         workers: int = DEFAULT_FS_WORKERS,
+                         pool: Optional[Executor] = None) -> Dict[str, str]:
+    """
+    对整批本地路径做大小写纠正：构建前缀树后自顶向下按层遍历，
+    每个目录层级只纠正一次，纠正后的前缀直接传给所有子孙节点。
+    文件系统工作量从 O(文件数 × 深度) 降为 O(唯一目录数)。
+    同一层上互不依赖的目录由有界线程池并发 listdir（workers <= 1 时顺序执行）；
+    纠正结果只依赖目录内容，与执行顺序无关，因此输出是确定的。
+    pool: 可选，调用方共享的线程池（多个分块并发纠正时使用同一个池，线程数不随分块数增长）；
+          不传时按 workers 临时建池
+    返回: {原始本地路径: 纠正后的本地路径}
+    """
+    out: Dict[str, str] = {}
+    level: List[Tuple[Path, _TrieNode]] = [(Path(r), n) for (r, n) in _build_path_trie(local_paths).items()]
+    own_pool = pool is None and workers > 1
+    if own_pool:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while level:
+            if pool is not None:
+                cache.Prefetch([str(acc) for (acc, node) in level if node.Children], pool)
+            nxt: List[Tuple[Path, _TrieNode]] = []
+            for acc, node in level:
+                for lp in node.Ends:
+                    out[lp] = str(acc)
+                if not node.Children:
+                    continue
+                parent = str(acc)
+                for name, child in node.Children.items():
+                    fixed = cache.Lookup(parent, name) or name
+                    nxt.append((acc / fixed, child))
+            level = nxt
+    finally:
+        if own_pool:
+            pool.shutdown(wait=True)
+    return out
+
 def _split_ns_root(ns_path: str) -> Tuple[str, List[str]]:
     """
     将 //xxx/aa/bb 拆成 ('//xxx', ['aa','bb'])
@@ -211,8 +703,7 @@ def _apply_full_local_case_to_depot(depot_path: str, client_path: str, local_cas
     l_tail_use = l_tail[-tail_len:]
     new_tail = []
     for i in range(tail_len):
-        local_name = l_tail_use[i]
-        new_tail.append(local_name if local_name else d_tail[-tail_len + i])
+        new_tail.append(_case_from_local(d_tail[-tail_len + i], l_tail_use[i]))
 
     # 如果 depot 比 client 更深（极少见），保留更高层不变 + 未覆盖的前缀
     if len(d_tail) > tail_len:
@@ -223,33 +714,291 @@ def _apply_full_local_case_to_depot(depot_path: str, client_path: str, local_cas
 
     return d_root + "/" + "/".join(d_tail_final)
 
+def _case_from_local(depot_name: str, local_name: str) -> str:
+    """
+    depot 的一层名称按本地名称取大小写：本地名先按 depot 语法转义（@ # % *），
+    与 depot 名称只差大小写时采用，否则（视图改名、为空等）保留 depot 原名。
+    """
+    esc = _escape_p4_name(local_name) if local_name else ""
+    return esc if esc and esc.casefold() == depot_name.casefold() else depot_name
+
+def _split_last(path: str, sep: str) -> Tuple[str, str]:
+    if sep in path:
+        head, tail = path.rsplit(sep, 1)
+        return head, tail
+    return "", path
+
+def _rewrite_depot_by_dir(depot_path: str, client_path: str, local_cased: str,
+                          dir_memo: Dict[Tuple[str, str, str], str]) -> str:
+    """
+    与 _apply_full_local_case_to_depot 结果相同，但按目录做一次前缀替换：
+      - (depot 目录, client 目录, 纠正后的本地目录) 相同的文件共享同一个目录改写结果；
+      - 每个文件只需再拼上纠正后的文件名。
+    dir_memo 由同一次扫描共享。
+    """
+    d_dir, d_base = _split_last(depot_path, "/")
+    c_dir, _c_base = _split_last(client_path, "/")
+    l_dir, l_base = os.path.split(local_cased)
+    if not d_dir.startswith("//") or not c_dir.startswith("//") or not l_base:
+        return _apply_full_local_case_to_depot(depot_path, client_path, local_cased)
+
+    key = (d_dir, c_dir, l_dir)
+    fixed_dir = dir_memo.get(key)
+    if fixed_dir is None:
+        # 只在目录层级上做一次完整的尾部对齐替换
+        fixed_dir = _apply_full_local_case_to_depot(d_dir, c_dir, l_dir) if l_dir else d_dir
+        dir_memo[key] = fixed_dir
+    return f"{fixed_dir}/{_case_from_local(d_base, l_base)}"
+
 # ===================== Opened 列表（以本地为准生成“更改后”） =====================
-def GetOpenedPairs(ctx: P4Context, changelist: str) -> Tuple[bool, List[Tuple[str,str]], List[str], str]:
+_ALLOWED_ACTIONS = {"edit", "add", "move/add"}
+
+# 表示“当前工作区的所有已打开文件”（不限 changelist）
+ALL_CHANGELISTS = "*"
+
+_Opened   = Tuple[str, str, str]  # (depot, action, change)
+_Resolved = Tuple[str, str, Optional[Tuple[str, str, str]]]  # (depot, 保底目标, (depot, client, local) 或 None)
+
+def _opened_args(changelist: str) -> List[str]:
+    cl = (changelist or "").strip() or "default"
+    if cl == ALL_CHANGELISTS:
+        return ["opened"]
+    return ["opened", "-c", cl]
+
+def GetOpenedPairs(ctx: P4Context, changelist: str,
+                   DirCache: Optional[DirCaseCache] = None,
+                   FsWorkers: int = DEFAULT_FS_WORKERS,
+                   Cache: Optional[ResolveCache] = None) -> Tuple[bool, List[Tuple[str,str]], List[str], str]:
     """
     ok, pairs, targets, msg
-    - changelist 可为 "" / "default" / "12345"
+    - DirCache: 本次扫描使用的目录缓存；传入后可在调用结束时读取 DirCache.Stats()
+    - FsWorkers: 本地目录纠正的并发线程数（1 为顺序执行）
+    - Cache: 跨会话的持久缓存（where 映射 + 目录列表），扫描结束时写回
+    - changelist 可为 "" / "default" / "12345"，或 ALL_CHANGELISTS（全部待提交，见 GetOpenedGroups）
+    - ok 为 True 时 msg 可能携带提示（如部分文件 where 未映射），调用方可选择展示
     - 仅返回 {edit, add, move/add}，过滤 delete/move/delete 等
     - “更改后”默认来自**本地真实大小写**（整条路径全部层级纠正），然后回写为 depot 目标路径
       * 若 where 或本地访问失败，则降级：只对文件名做 NormalizeName
     """
-    args = ["opened"]
-    cl = (changelist or "").strip()
-    if cl and cl != "default":
-        args += ["-c", cl]
-    r = ctx.Exec(args)
-    if r.returncode != 0:
-        return False, [], [], (r.stderr or r.stdout or "").strip()
+    ok, pairs, targets, _changes, msg = _scan_opened(ctx, changelist, DirCache, FsWorkers, Cache)
+    return ok, pairs, targets, msg
 
-    paths_actions = _parse_opened_lines(r.stdout)
-    pairs: List[Tuple[str, str]] = []
-    targets: List[str] = []
+def _scan_opened(ctx: P4Context, changelist: str, DirCache: Optional[DirCaseCache], FsWorkers: int,
+                 Cache: Optional[ResolveCache]) -> Tuple[bool, List[Tuple[str, str]], List[str], List[str], str]:
+    """GetOpenedPairs / GetOpenedGroups 共用：额外返回与 pairs 对齐的 change 列表。"""
+    with Trace.Span("scan", "opened", changelist=changelist):
+        ok, records, msg = ctx.ExecRecords(_opened_args(changelist))
+        if not ok:
+            return False, [], [], [], msg
+        opened, warnings = _opened_stage(records)
 
-    allowed = {"edit", "add", "move/add"}
-    for dep, action in paths_actions:
-        if action not in allowed:
-            continue
+    # 整个 opened 列表一次性批量 where，避免每个文件单独起一个 p4 进程
+    with Trace.Span("scan", "where", files=len(opened)):
+        where_table = _p4_where_batch(ctx, [o[0] for o in opened], Cache, _where_cache_key(ctx, Cache))
+        resolved, unmapped = _where_stage(opened, where_table)
+
+    # 整批本地路径走前缀树，每个目录只纠正一次
+    dir_cache = _make_dir_cache(DirCache, Cache)
+    with Trace.Span("scan", "resolve", files=len(resolved)):
+        local_cases = _resolve_local_cases([w[2] for (_d, _f, w) in resolved if w], dir_cache, FsWorkers)
+    if Cache is not None:
+        with Trace.Span("scan", "cache_flush"):
+            Cache.Flush()
+
+    with Trace.Span("scan", "target"):
+        pairs, targets = _target_stage(resolved, local_cases, {})
+    if unmapped:
+        warnings.append(f"{unmapped} 个文件 where 未映射，仅按文件名规范化")
+    return True, pairs, targets, [o[2] for o in opened], "；".join(warnings)
+
+# ===================== 全部待提交 changelist（一次扫描，按 change 分组） =====================
+class ChangeGroup(NamedTuple):
+    Change: str                     # "default" 或 数字字符串
+    Pairs: List[Tuple[str, str]]
+    Targets: List[str]
+
+def ChangeSortKey(change: str) -> Tuple[int, int, str]:
+    """changelist 的展示顺序：default 在前，其余按编号升序。"""
+    c = (change or "default").strip()
+    if c == "default":
+        return (0, 0, c)
+    return (1, int(c), c) if c.isdigit() else (2, 0, c)
+
+def GetOpenedGroups(ctx: P4Context, DirCache: Optional[DirCaseCache] = None,
+                    FsWorkers: int = DEFAULT_FS_WORKERS,
+                    Cache: Optional[ResolveCache] = None) -> Tuple[bool, List[ChangeGroup], str]:
+    """
+    当前工作区所有待提交 changelist 的 opened 结果，按 change 分组返回 (ok, groups, msg)。
+    只发一次 `p4 opened`（不带 -c），where 与本地大小写纠正对全部文件统一做一遍，
+    多个 changelist 共享的目录也只 listdir 一次。groups 按 ChangeSortKey 排序。
+    """
+    ok, pairs, targets, changes, msg = _scan_opened(ctx, ALL_CHANGELISTS, DirCache, FsWorkers, Cache)
+    if not ok:
+        return False, [], msg
+    by_change: Dict[str, ChangeGroup] = {}
+    for pair, dst, cl in zip(pairs, targets, changes):
+        g = by_change.get(cl)
+        if g is None:
+            g = by_change[cl] = ChangeGroup(cl, [], [])
+        g.Pairs.append(pair)
+        g.Targets.append(dst)
+    return True, [by_change[c] for c in sorted(by_change, key=ChangeSortKey)], msg
+
+# ===================== Opened 列表（流式，供后台刷新逐批渲染） =====================
+class ScanBatch(NamedTuple):
+    """
+    IterOpenedPairs 产出的一批结果：
+      - Ok 为 False 时 Msg 为错误信息，扫描结束；
+      - Total 为本次需要处理的文件总数（opened 返回后即已知）；
+      - Pairs/Targets 与 GetOpenedPairs 的返回值含义相同，只是分批给出；
+      - Changes 与 Pairs 对齐，给出每个文件所在的 changelist；
+      - Resolved 与 Pairs 对齐，给出 (where 结果, 纠正后本地路径)，供 LiveRescan 直接沿用；
+      - 最后一批可能只带 Msg（提示信息）。
+    """
+    Ok: bool
+    Pairs: List[Tuple[str, str]]
+    Targets: List[str]
+    Total: int
+    Msg: str
+    Changes: List[str] = []
+    Resolved: List[Tuple[_Resolved, str]] = []
+
+def _stream_chunks(items: List[Tuple[str, str, str]], first: int,
+                   largest: int) -> Iterator[List[Tuple[str, str, str]]]:
+    """第一批较小（尽快出首屏），之后批量逐步翻倍，直到 largest。"""
+    size = max(1, first)
+    i = 0
+    while i < len(items):
+        yield items[i:i + size]
+        i += size
+        size = min(size * 2, max(largest, 1))
+
+def IterOpenedPairs(ctx: P4Context, changelist: str,
+                    StopEvent: Optional[threading.Event] = None,
+                    DirCache: Optional[DirCaseCache] = None,
+                    FsWorkers: int = DEFAULT_FS_WORKERS,
+                    FirstBatch: int = 200, MaxBatch: int = 5000,
+                    Cache: Optional[ResolveCache] = None) -> Iterator[ScanBatch]:
+    """
+    GetOpenedPairs 的流式版本：opened 之后按批 where -> 本地纠正 -> 产出结果，
+    首批很小，保证大 changelist 也能在一次往返后就出现第一批行。
+    各批共享 DirCaseCache 与目录改写缓存，目录仍然只 listdir 一次。
+    StopEvent 置位后在批与批之间停止（不再产出）；Cache 在扫描结束或中止时写回。
+    """
+    def stopped() -> bool:
+        return bool(StopEvent is not None and StopEvent.is_set())
 
-        dep = dep.replace("\\", "/")
+    with Trace.Span("scan", "opened", changelist=changelist):
+        ok, records, msg = ctx.ExecRecords(_opened_args(changelist))
+        opened, warnings = _opened_stage(records) if ok else ([], [])
+    if not ok:
+        yield ScanBatch(False, [], [], 0, msg)
+        return
+    total = len(opened)
+    yield ScanBatch(True, [], [], total, "")
+
+    dir_cache = _make_dir_cache(DirCache, Cache)
+    where_key = _where_cache_key(ctx, Cache)
+    dir_memo: Dict[Tuple[str, str, str], str] = {}
+    unmapped = 0
+    try:
+        for chunk in _stream_chunks(opened, FirstBatch, MaxBatch):
+            if stopped():
+                return
+            with Trace.Span("scan", "where", files=len(chunk)):
+                where_table = _p4_where_batch(ctx, [o[0] for o in chunk], Cache, where_key)
+                resolved, um = _where_stage(chunk, where_table)
+            unmapped += um
+            with Trace.Span("scan", "resolve", files=len(resolved)):
+                local_cases = _resolve_local_cases([w[2] for (_d, _f, w) in resolved if w], dir_cache, FsWorkers)
+            with Trace.Span("scan", "target"):
+                pairs, targets = _target_stage(resolved, local_cases, dir_memo)
+            if stopped():
+                return
+            seeds = [(r, local_cases.get(r[2][2], r[2][2]) if r[2] else "") for r in resolved]
+            yield ScanBatch(True, pairs, targets, total, "", [o[2] for o in chunk], seeds)
+    finally:
+        if Cache is not None:
+            Cache.Flush()
+
+    if unmapped:
+        warnings.append(f"{unmapped} 个文件 where 未映射，仅按文件名规范化")
+    if warnings:
+        yield ScanBatch(True, [], [], total, "；".join(warnings))
+
+# ===================== 启动预取 =====================
+class StartupPrefetch:
+    """
+    凭据确定后立即在后台并行发起：
+      - p4 info（连接测试 + 服务器大小写策略）
+      - 待提交 changelist 列表
+      - 指定 changelist（默认 default）的 opened 结果
+    三者各用一个 Clone 出来的上下文，总耗时约等于一次往返，而不是逐个串行。
+    结果以 Future 形式暴露；Take*() 只交出一次，之后调用方回到正常的按需查询。
+    """
+    def __init__(self, ctx: P4Context, Changelist: str = "default", MaxChangelists: int = 50,
+                 Cache: Optional[ResolveCache] = None):
+        self.Changelist = Changelist
+        pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="p4-prefetch")
+        self.InfoFuture: Future = pool.submit(GetServerInfo, ctx)
+        self.ChangelistsFuture: Future = pool.submit(
+            self._with_clone, ctx, lambda c: GetPendingChangelists(c, Max=MaxChangelists))
+        def opened(c: P4Context):
+            if Cache is not None:
+                Cache.Load()  # 缓存文件可能较大：在预取线程上解析，不占用调用方（界面）线程
+            return GetOpenedPairs(c, Changelist, Cache=Cache)
+        self.OpenedFuture: Future = pool.submit(self._with_clone, ctx, opened)
+        pool.shutdown(wait=False)
+        self._taken: set = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _with_clone(ctx: P4Context, fn: Callable[[P4Context], object]) -> object:
+        c = ctx.Clone()
+        try:
+            return fn(c)
+        finally:
+            if c.Backend is not ctx.Backend:
+                c.Close()
+
+    def _take(self, name: str, fut: Future, wait_done: bool) -> Optional[Future]:
+        with self._lock:
+            if name in self._taken or (not wait_done and not fut.done()):
+                return None
+            self._taken.add(name)
+            return fut
+
+    def TakeChangelists(self) -> Optional[List[Tuple[str, str]]]:
+        """预取的 changelist 列表（仅在已完成时交出，不阻塞）。"""
+        fut = self._take("changelists", self.ChangelistsFuture, False)
+        if fut is None or fut.exception() is not None:
+            return None
+        return fut.result()
+
+    def TakeOpened(self, changelist: str) -> Optional[Future]:
+        """changelist 与预取目标一致时交出 opened 的 Future（可能尚未完成，由调用方在后台等待）。"""
+        if (changelist or "default") != self.Changelist:
+            return None
+        return self._take("opened", self.OpenedFuture, True)
+
+# —— GetOpenedPairs 的各阶段（同步/异步版本共用）
+def _opened_stage(records: List[Dict[str, str]]) -> Tuple[List[_Opened], List[str]]:
+    """opened 记录 -> [(depot, action, change)]（仅 edit/add/move/add）+ 提示信息。"""
+    opened, bad = _opened_from_records(records)
+    items = [(dep.replace("\\", "/"), action, change)
+             for (dep, action, change) in opened if action in _ALLOWED_ACTIONS]
+    warnings: List[str] = []
+    if bad:
+        warnings.append(f"{bad} 条 opened 记录缺少 depot 路径，已忽略")
+    return items, warnings
+
+def _where_stage(opened: List[_Opened],
+                 where_table: Dict[str, Tuple[str, str]]) -> Tuple[List[_Resolved], int]:
+    """where 查表，得到每个文件的 (depot, client, local)；返回 (resolved, 未映射数)。"""
+    where_folded = {k.casefold(): k for k in where_table}
+    unmapped = 0
+    resolved: List[_Resolved] = []
+    for dep, _action, _change in opened:
         ddir = dep.rsplit("/", 1)[0] if "/" in dep else dep
         dbase = dep.rsplit("/", 1)[-1]
 
@@ -257,36 +1006,707 @@ def GetOpenedPairs(ctx: P4Context, changelist: str) -> Tuple[bool, List[Tuple[st
         new_base = NormalizeName(dbase)
         dst_fallback = f"{ddir}/{new_base}" if new_base else dep
 
-        # 用 where 获取本地与 client，并用本地真实大小写修正“整条路径”
-        where_info = _p4_where(ctx, dep)
+        where_info = _lookup_where(where_table, where_folded, dep)
         if not where_info:
-            pairs.append((dep, dst_fallback)); targets.append(dst_fallback); continue
+            unmapped += 1
+        elif not where_info[2]:
+            where_info = None
+        resolved.append((dep, dst_fallback, where_info))
+    return resolved, unmapped
 
-        depot0, client0, local0 = where_info
-        if not local0:
+def _target_stage(resolved: List[_Resolved], local_cases: Dict[str, str],
+                  dir_memo: Dict[Tuple[str, str, str], str]) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """用本地真实大小写的每一层，映射回 depot 尾部所有层级（根保持不变），按目录做前缀替换。"""
+    pairs: List[Tuple[str, str]] = []
+    targets: List[str] = []
+    for dep, dst_fallback, where_info in resolved:
+        if not where_info:
             pairs.append((dep, dst_fallback)); targets.append(dst_fallback); continue
-
-        local_cased = _correct_case_along_path(local0)
-        # 用本地真实大小写的每一层，映射回 depot 尾部所有层级（根保持不变）
-        dst = _apply_full_local_case_to_depot(depot0, client0, local_cased) or dst_fallback
-
+        depot0, client0, local0 = where_info
+        local_cased = local_cases.get(local0, local0)
+        dst = _rewrite_depot_by_dir(depot0, client0, local_cased, dir_memo) or dst_fallback
         pairs.append((dep, dst))
         targets.append(dst)
+    return pairs, targets
+
+# ===================== 已打开文件索引（应用后一致性检测）=====================
+class OpenedIndex:
+    """
+    已打开文件的内存索引：精确集合 + casefold 字典。
+    - 由一次 `p4 opened` 快照建立（LoadOpenedIndex），不做 where/文件系统纠正；
+    - 每次 move 后按 move 自身输出（fromFile -> depotFile）增量更新，避免逐项重新 opened；
+    - 线程安全，可被多个执行线程共享。
+    """
+    def __init__(self, paths: Optional[List[str]] = None, all_paths: Optional[List[str]] = None):
+        self._Lock = threading.Lock()
+        self._Exact: set = set()
+        self._Folded: Dict[str, str] = {}
+        for p in paths or []:
+            self._add(p)
+        # 快照中的全部已打开路径（含 delete 等动作），供目录级 move 规划判断“目录下是否只有这些文件”
+        self.All: List[str] = list(all_paths if all_paths is not None else (paths or []))
+
+    def _add(self, path: str) -> None:
+        self._Exact.add(path)
+        self._Folded[path.casefold()] = path
+
+    def _remove(self, path: str) -> None:
+        self._Exact.discard(path)
+        if self._Folded.get(path.casefold()) == path:
+            del self._Folded[path.casefold()]
+
+    def Has(self, path: str) -> bool:
+        with self._Lock:
+            return path in self._Exact
 
-    return True, pairs, targets, ""
+    def FindCasefold(self, path: str) -> Optional[str]:
+        """返回与 path 大小写不敏感相同的已打开路径（实际大小写）；没有则 None。"""
+        with self._Lock:
+            return self._Folded.get((path or "").casefold())
+
+    def ApplyMove(self, src: str, dst: str) -> None:
+        with self._Lock:
+            self._remove(src)
+            self._add(dst)
+
+    def __len__(self) -> int:
+        return len(self._Exact)
+
+def LoadOpenedIndex(ctx: P4Context, changelist: str) -> Tuple[bool, OpenedIndex, str]:
+    """对指定 changelist 做一次 `p4 opened` 快照，建立 OpenedIndex。"""
+    ok, records, msg = ctx.ExecRecords(_opened_args(changelist))
+    if not ok:
+        return False, OpenedIndex(), msg
+    opened, _bad = _opened_from_records(records)
+    return True, OpenedIndex([dep for (dep, action, _c) in opened if action in _ALLOWED_ACTIONS],
+                             [dep for (dep, _action, _c) in opened]), ""
+
+def VerifyTargets(ctx: P4Context, changelist: str, targets: List[str]) -> Tuple[bool, List[str], str]:
+    """
+    批次结束后用一次 `p4 opened` 快照确认所有目标路径（精确大小写）都已存在。
+    返回 (ok, missing, msg)；ok 为 False 表示快照本身失败，此时 missing 为空。
+    """
+    ok, index, msg = LoadOpenedIndex(ctx, changelist)
+    if not ok:
+        return False, [], msg
+    return True, [t for t in targets if not index.Has(t)], ""
 
 # ===================== 移动（大小写修正）=====================
-def TrySingleMove(ctx: P4Context, src_depot: str, dst_depot: str) -> bool:
-    r = ctx.Exec(["move", src_depot, dst_depot])
-    return r.returncode == 0
-
-def TryTwoMoves(ctx: P4Context, src_depot: str, dst_depot: str) -> bool:
-    dir_ = os.path.dirname(dst_depot).replace("\\", "/")
-    base = os.path.basename(dst_depot)
-    temp_name = f"{base}.__tmp__"
-    temp_depot = f"{dir_}/{temp_name}" if dir_ else f"/{temp_name}"
-    r1 = ctx.Exec(["move", src_depot, temp_depot])
-    if r1.returncode != 0:
+def _move(ctx: P4Context, src_depot: str, dst_depot: str, index: Optional[OpenedIndex],
+          journal: Optional[ApplyJournal] = None) -> bool:
+    """
+    执行一次 `p4 move`，并按输出记录（fromFile -> depotFile）更新索引。
+    大小写不敏感的服务器可能报告成功但实际大小写未变，以输出中的 depotFile 为准。
+    journal 非空时，执行前写 step、执行后写 done（含实际移动记录），供崩溃后续做/回滚。
+    """
+    n = journal.Step(src_depot, dst_depot) if journal is not None else 0
+    ok, records, _msg = ctx.ExecRecords(["move", src_depot, dst_depot])
+    moved = [(r.get("fromFile") or "", r.get("depotFile") or "") for r in records] if ok else []
+    moved = [(a, b) for (a, b) in moved if a and b]
+    if journal is not None:
+        journal.Done(n, ok, moved)
+    if not ok:
+        return False
+    if index is not None:
+        for a, b in moved or [(src_depot, dst_depot)]:
+            index.ApplyMove(a, b)
+    return True
+
+def TrySingleMove(ctx: P4Context, src_depot: str, dst_depot: str,
+                  Index: Optional[OpenedIndex] = None, Journal: Optional[ApplyJournal] = None) -> bool:
+    return _move(ctx, src_depot, dst_depot, Index, Journal)
+
+def TryTwoMoves(ctx: P4Context, src_depot: str, dst_depot: str,
+                Index: Optional[OpenedIndex] = None, Journal: Optional[ApplyJournal] = None) -> bool:
+    temp_depot = _temp_path(dst_depot)
+    if not _move(ctx, src_depot, temp_depot, Index, Journal):
+        return False
+    return _move(ctx, temp_depot, dst_depot, Index, Journal)
+
+def _temp_path(depot_path: str) -> str:
+    """TryTwoMoves / 目录双步移动使用的临时名：<path>.__tmp__"""
+    dir_ = os.path.dirname(depot_path).replace("\\", "/")
+    base = os.path.basename(depot_path)
+    return f"{dir_}/{base}.__tmp__" if dir_ else f"/{base}.__tmp__"
+
+# ===================== move 计划校验 =====================
+class PlanIssue(NamedTuple):
+    """
+    计划校验发现的问题。Kind:
+      - "noop"            : 源与目标完全相同（不阻塞，直接跳过）
+      - "duplicate-target": 多个源映射到同一个（casefold）目标
+      - "target-exists"   : 目标与 depot/已打开的其它文件冲突（casefold）
+      - "temp-exists"     : 双步 move 的临时名 <dst>.__tmp__ 已存在或被本批次占用
+      - "chain"           : 目标是本批次另一条的源（执行顺序相关，如 A->B 且 B->C）
+      - "cycle"           : 互相占用的环（如 A->b 且 B->a）
+    """
+    Kind: str
+    Keys: Tuple[int, ...]
+    Detail: str
+
+def _p4_files_batch(ctx: P4Context, depot_paths: List[str]) -> Dict[str, str]:
+    """
+    批量 `p4 files`，返回 {casefold 路径: depot 实际路径}；head 为删除的文件视为不存在。
+    不存在的文件只产生警告记录，不影响同批其它文件。
+    """
+    out: Dict[str, str] = {}
+    uniq = list(dict.fromkeys(p for p in depot_paths if p))
+    for chunk in _chunk_args(uniq):
+        _ok, records, _msg = ctx.ExecRecords(["files"] + chunk)
+        for rec in records:
+            depot = rec.get("depotFile") or ""
+            if depot and "delete" not in (rec.get("action") or rec.get("headAction") or ""):
+                out[depot.casefold()] = depot
+    return out
+
+def ValidateMoves(moves: List[Tuple[int, str, str]], index: OpenedIndex,
+                  existing: Optional[Dict[str, str]] = None,
+                  Origins: Optional[Dict[int, str]] = None) -> List[PlanIssue]:
+    """
+    在执行任何 move 之前，用哈希索引在 O(N) 内检查整批目标：
+      moves: [(key, src, dst), ...]
+      index: 已打开文件快照（OpenedIndex）
+      existing: 可选，{casefold 路径: depot 路径}，通常来自 _p4_files_batch(目标 + 临时名)
+      Origins: 可选，{key: 第一次 apply 前的路径}；续做/回滚中断的 apply 时，
+               源可能是临时名，目标与条目自身的原始路径只差大小写，不算冲突
+    返回问题列表；除 "noop" 外，出现在问题中的条目都不应执行。
+    """
+    issues: List[PlanIssue] = []
+    existing = existing or {}
+    origins = Origins or {}
+    live = [(k, s, d) for (k, s, d) in moves if d and s != d]
+    for k, s, d in moves:
+        if d and s == d:
+            issues.append(PlanIssue("noop", (k,), s))
+
+    by_src: Dict[str, List[int]] = {}
+    by_dst: Dict[str, List[int]] = {}
+    for k, s, d in live:
+        by_src.setdefault(s.casefold(), []).append(k)
+        by_dst.setdefault(d.casefold(), []).append(k)
+    src_of = {k: s for (k, s, _d) in live}
+    dst_of = {k: d for (k, _s, d) in live}
+
+    for df, keys in by_dst.items():
+        if len(keys) > 1:
+            issues.append(PlanIssue("duplicate-target", tuple(keys), dst_of[keys[0]]))
+
+    for k, s, d in live:
+        df = d.casefold()
+        if df == s.casefold() or df == origins.get(k, s).casefold() or df in by_src:
+            continue  # 大小写改名自身 / 本批次内的源，由链/环检查处理
+        other = index.FindCasefold(d) or existing.get(df)
+        if other:
+            issues.append(PlanIssue("target-exists", (k,), f"{d} ↔ {other}"))
+
+    for k, s, d in live:
+        tmp = _temp_path(d)
+        tf = tmp.casefold()
+        if tf == s.casefold():
+            continue  # 中断在双步 move 中间：源本身就是临时名
+        if index.FindCasefold(tmp) or tf in existing or tf in by_src or tf in by_dst:
+            issues.append(PlanIssue("temp-exists", (k,), tmp))
+
+    # 链与环：边 k -> j 表示 k 的目标占用了 j 的源（j != k）
+    nxt: Dict[int, List[int]] = {}
+    for k, _s, d in live:
+        js = [j for j in by_src.get(d.casefold(), []) if j != k]
+        if js:
+            nxt[k] = js
+    color: Dict[int, int] = {}  # 0/缺省=未访问，1=栈中，2=完成
+    in_cycle: set = set()
+    for start in nxt:
+        if color.get(start):
+            continue
+        stack: List[Tuple[int, int]] = [(start, 0)]
+        path: List[int] = []
+        while stack:
+            node, i = stack.pop()
+            if i == 0:
+                color[node] = 1
+                path.append(node)
+            children = nxt.get(node, [])
+            if i < len(children):
+                stack.append((node, i + 1))
+                c = children[i]
+                if color.get(c) == 1:
+                    in_cycle.update(path[path.index(c):])
+                elif not color.get(c):
+                    stack.append((c, 0))
+                continue
+            color[node] = 2
+            path.pop()
+    if in_cycle:
+        keys = tuple(k for (k, _s, _d) in live if k in in_cycle)
+        issues.append(PlanIssue("cycle", keys, " / ".join(f"{src_of[k]} -> {dst_of[k]}" for k in keys)))
+    for k, js in nxt.items():
+        if k not in in_cycle:
+            issues.append(PlanIssue("chain", (k,) + tuple(js), f"{src_of[k]} -> {dst_of[k]}"))
+    return issues
+
+# ===================== 目录级 move 规划 =====================
+class MoveOp(NamedTuple):
+    """
+    一步 move 计划：
+      - IsDir 为 False：单文件 Src -> Dst，Keys 只有一个条目；
+      - IsDir 为 True ：目录 Src/... -> Dst/...，覆盖 Keys 中所有条目（其路径以 Src 为前缀）。
+    """
+    Src: str
+    Dst: str
+    Keys: Tuple[int, ...]
+    IsDir: bool
+
+def _ns_parts(depot_path: str) -> List[str]:
+    return depot_path[2:].split("/") if depot_path.startswith("//") else []
+
+def _ns_join(parts: List[str]) -> str:
+    return "//" + "/".join(parts)
+
+def _count_under(paths: List[str]) -> Dict[str, int]:
+    """{casefold 目录: 其下（递归）已打开文件数}；大小写不敏感的服务器上通配符按 casefold 匹配。"""
+    counts: Dict[str, int] = {}
+    for p in paths:
+        parts = _ns_parts(p.casefold())
+        for k in range(1, len(parts)):
+            d = _ns_join(parts[:k])
+            counts[d] = counts.get(d, 0) + 1
+    return counts
+
+def PlanMoves(moves: List[Tuple[int, str, str]], opened_all: List[str]) -> List[MoveOp]:
+    """
+    把逐文件 move 列表折叠为尽量少的目录级 move。
+    moves: [(key, src, dst), ...]，src != dst
+    opened_all: 工作区全部已打开文件（任意动作、任意 changelist），用于保证通配符不会带上计划外的文件
+
+    规则：
+      - 对每个条目找到第一个不同的目录层级 S -> T（文件名层级的差异不参与目录折叠）；
+      - 若 S 下（按 casefold）的全部已打开文件恰好都是同一组 S -> T 的条目，则生成一条 `S/... -> T/...`；
+      - 折叠后把这些条目的当前路径改写到 T 下，继续查找更深层的差异（父目录先于子目录）；
+      - 无法折叠的条目最后按单文件 move 处理（以改写后的当前路径为源）。
+    """
+    cur: Dict[int, str] = {key: src for (key, src, _dst) in moves}
+    dst_of: Dict[int, str] = {key: dst for (key, _src, dst) in moves}
+    opened = list(opened_all)
+    active = [key for (key, src, dst) in moves if src != dst]
+    ops: List[MoveOp] = []
+
+    while active:
+        groups: Dict[str, List[int]] = {}
+        group_targets: Dict[str, set] = {}
+        next_active: List[int] = []
+        for key in active:
+            s_parts, d_parts = _ns_parts(cur[key]), _ns_parts(dst_of[key])
+            if not s_parts or len(s_parts) != len(d_parts):
+                continue
+            k = next((i for i in range(len(s_parts)) if s_parts[i] != d_parts[i]), None)
+            if k is None or k == 0 or k >= len(s_parts) - 1:
+                continue  # 无差异 / depot 根不同 / 只有文件名不同
+            S = _ns_join(s_parts[:k + 1])
+            groups.setdefault(S, []).append(key)
+            group_targets.setdefault(S, set()).add(_ns_join(d_parts[:k + 1]))
+        if not groups:
+            break
+
+        counts = _count_under(opened)
+        owners: Dict[str, int] = {}
+        for S in groups:
+            owners[S.casefold()] = owners.get(S.casefold(), 0) + 1
+
+        for S in sorted(groups):
+            keys = groups[S]
+            Ts = group_targets[S]
+            Sf = S.casefold()
+            if len(Ts) != 1 or owners[Sf] != 1 or counts.get(Sf, 0) != len(keys):
+                continue  # 不可折叠：这些条目留给单文件 move
+            T = next(iter(Ts))
+            ops.append(MoveOp(S, T, tuple(keys), True))
+            for key in keys:
+                cur[key] = T + cur[key][len(S):]
+                if cur[key] != dst_of[key]:
+                    next_active.append(key)
+            prefix = Sf + "/"
+            opened = [T + p[len(S):] if p.casefold().startswith(prefix) else p for p in opened]
+        active = next_active
+
+    for key, _src, dst in moves:
+        if cur[key] != dst:
+            ops.append(MoveOp(cur[key], dst, (key,), False))
+    return ops
+
+# ===================== 进度通道（工作线程 -> UI）=====================
+class ProgressState(NamedTuple):
+    Done: int
+    Total: int
+    Ok: int
+    Fail: int
+    Skip: int
+    Msg: str
+    Rate: float            # 条目/秒（最近几秒的滑动窗口）
+    Eta: Optional[float]   # 预计剩余秒数；速率未知时为 None
+    Version: int           # 每次 Put 自增，UI 据此判断是否需要重绘
+
+class ProgressChannel:
+    """
+    工作线程写、UI 线程轮询的进度通道。
+      - Put() 只在锁内覆盖“最新状态”，不排队、不阻塞，可直接作为 ApplyMoves 的 OnProgress；
+      - UI 按固定帧率调用 Snapshot()，多次 Put 合并为一次重绘；
+      - 速率与 ETA 在 Snapshot() 中按滑动窗口计算，写入端不承担额外开销。
+    """
+    RATE_WINDOW = 5.0  # 秒
+
+    def __init__(self, total: int):
+        self._lock = threading.Lock()
+        self._total = max(0, int(total))
+        self._state = (0, 0, 0, 0, "")
+        self._version = 0
+        self._closed = False
+        self._samples: deque = deque()  # [(t, done)]
+        self._start = time.monotonic()
+
+    def Put(self, done: int, ok: int, fail: int, skip: int, msg: str = "") -> None:
+        with self._lock:
+            self._state = (done, ok, fail, skip, msg or "")
+            self._version += 1
+
+    def Close(self) -> None:
+        """工作线程结束时调用；UI 读到最后一次状态后即可停止轮询。"""
+        with self._lock:
+            self._closed = True
+            self._version += 1
+
+    @property
+    def Closed(self) -> bool:
+        with self._lock:
+            return self._closed
+
+    def Snapshot(self) -> ProgressState:
+        with self._lock:
+            done, ok, fail, skip, msg = self._state
+            version = self._version
+        now = time.monotonic()
+        samples = self._samples
+        if not samples or samples[-1][1] != done:
+            samples.append((now, done))
+        while len(samples) > 2 and now - samples[0][0] > self.RATE_WINDOW:
+            samples.popleft()
+
+        t0, d0 = samples[0] if samples[0][1] < done else (self._start, 0)
+        span = now - t0
+        rate = (done - d0) / span if span > 0 and done > d0 else 0.0
+        eta = (self._total - done) / rate if rate > 0 else None
+        return ProgressState(done, self._total, ok, fail, skip, msg, rate, eta, version)
+
+# ===================== 执行 move 计划 =====================
+def _apply_file_move(ctx: P4Context, src: str, dst: str, index: OpenedIndex,
+                     journal: Optional[ApplyJournal] = None) -> Tuple[bool, str]:
+    """单文件：先单步 move，大小写未生效时用双步 move（临时名 -> 目标名）修正。"""
+    if TrySingleMove(ctx, src, dst, Index=index, Journal=journal):
+        if index.Has(dst):
+            return True, f"[OK] move {src} -> {dst}"
+        cur = index.FindCasefold(dst)
+        if cur and TryTwoMoves(ctx, cur, dst, Index=index, Journal=journal) and index.Has(dst):
+            return True, f"[OK] move*2(fix-after-1st) {cur} -> {dst}"
+        return False, f"[FAIL] move(after-1st) {src} -> {dst}"
+    cur = index.FindCasefold(dst) or src
+    if TryTwoMoves(ctx, cur, dst, Index=index, Journal=journal) and index.Has(dst):
+        return True, f"[OK] move*2 {cur} -> {dst}"
+    return False, f"[FAIL] move {cur} -> {dst}"
+
+def _apply_dir_move(ctx: P4Context, op: MoveOp, paths: List[str], index: OpenedIndex,
+                    journal: Optional[ApplyJournal] = None) -> Tuple[bool, str]:
+    """
+    目录：`p4 move S/... T/...`，大小写未生效时走 `S/... -> T.__tmp__/... -> T/...`。
+    paths 为 op.Keys 中各条目执行前的当前路径。
+    """
+    S, T = op.Src, op.Dst
+    expected = [T + p[len(S):] for p in paths]
+    moved = _move(ctx, f"{S}/...", f"{T}/...", index, journal)
+    if moved and all(index.Has(e) for e in expected):
+        return True, f"[OK] move {S}/... -> {T}/... ({len(op.Keys)})"
+    # 单步未生效（大小写不敏感的服务器）：从实际所在前缀双步移动
+    first = index.FindCasefold(expected[0]) if expected else None
+    actual = first[:len(T)] if (first and len(first) >= len(T) and first[len(T):] == expected[0][len(T):]) else S
+    tmp = _temp_path(T)
+    if (_move(ctx, f"{actual}/...", f"{tmp}/...", index, journal)
+            and _move(ctx, f"{tmp}/...", f"{T}/...", index, journal)
+            and all(index.Has(e) for e in expected)):
+        return True, f"[OK] move*2 {actual}/... -> {T}/... ({len(op.Keys)})"
+    return False, f"[FAIL] move {S}/... -> {T}/..."
+
+def _plan_dependencies(ops: List[MoveOp]) -> List[List[int]]:
+    """
+    计算每一步依赖的前序目录 move：若某一步的源路径位于前面某条目录 move 的目标目录下（casefold），
+    则必须等它完成（父目录先于子目录）。双步 move 的两步在同一步内顺序执行，不需要额外约束。
+    返回 deps[j] = [i, ...]
+    """
+    dir_dst: Dict[str, int] = {}
+    deps: List[List[int]] = []
+    for j, op in enumerate(ops):
+        parts = _ns_parts(op.Src.casefold())
+        upto = len(parts) if op.IsDir else len(parts) - 1
+        deps.append([dir_dst[d] for d in (_ns_join(parts[:k]) for k in range(1, upto + 1)) if d in dir_dst])
+        if op.IsDir:
+            dir_dst[op.Dst.casefold()] = j
+    return deps
+
+# apply 阶段默认并发的 p4 执行线程数（高延迟链路上串行 move 是主要瓶颈）
+DEFAULT_MOVE_JOBS = 4
+
+class _OpRunner:
+    """
+    按依赖关系并发执行 move 计划：
+      - 一个协调线程（调用方）负责调度、更新条目状态与进度回调；
+      - Jobs 个执行线程各自持有独立的 P4Context（从上下文池中借用/归还）；
+      - StopEvent 置位后不再派发新步骤，已在执行的步骤等待其完成；
+      - 每次 `p4 move` 前后写入 journal（可选）。
+    """
+    def __init__(self, ctx: P4Context, index: OpenedIndex, jobs: int, journal: Optional[ApplyJournal] = None):
+        self.Index = index
+        self.Journal = journal
+        self.Jobs = max(1, int(jobs or 1))
+        self._Ctx = ctx
+        self._Ctxs: "queue.Queue[P4Context]" = queue.Queue()
+        for i in range(self.Jobs):
+            self._Ctxs.put(ctx if i == 0 else ctx.Clone())
+
+    def Close(self) -> None:
+        """关闭池中克隆出的上下文（调用方传入的 ctx 由调用方负责）；须在 Run 全部返回后调用。"""
+        while True:
+            try:
+                c = self._Ctxs.get_nowait()
+            except queue.Empty:
+                return
+            if c.Backend is not self._Ctx.Backend:
+                c.Close()
+
+    def _run(self, op: MoveOp, paths: List[str], dst: str) -> Tuple[bool, str]:
+        c = self._Ctxs.get()
+        try:
+            with Trace.Span("apply", "dir_move" if op.IsDir else "file_move", files=len(paths)):
+                if op.IsDir:
+                    return _apply_dir_move(c, op, paths, self.Index, self.Journal)
+                return _apply_file_move(c, paths[0], dst, self.Index, self.Journal)
+        finally:
+            self._Ctxs.put(c)
+
+    def Run(self, ops: List[MoveOp], deps: List[List[int]], cur: Dict[int, str], dst_of: Dict[int, str],
+            on_done: Callable[[MoveOp, bool, str, Optional[BaseException]], None],
+            should_skip: Callable[[MoveOp], bool],
+            stop_requested: Callable[[], bool]) -> bool:
+        """执行全部步骤；返回是否因中断而提前结束。"""
+        remaining = [len(d) for d in deps]
+        children: List[List[int]] = [[] for _ in ops]
+        for j, ds in enumerate(deps):
+            for i in ds:
+                children[i].append(j)
+        ready = [j for j in range(len(ops)) if remaining[j] == 0]
+        running: Dict[Future, int] = {}
+        stopped = False
+
+        def release(j: int) -> None:
+            for c in children[j]:
+                remaining[c] -= 1
+                if remaining[c] == 0:
+                    ready.append(c)
+
+        with ThreadPoolExecutor(max_workers=self.Jobs) as pool:
+            while ready or running:
+                while ready and len(running) < self.Jobs and not stopped:
+                    if stop_requested():
+                        stopped = True
+                        break
+                    j = ready.pop(0)
+                    op = ops[j]
+                    if should_skip(op):
+                        release(j)
+                        continue
+                    paths = [cur[k] for k in op.Keys]
+                    running[pool.submit(self._run, op, paths, dst_of[op.Keys[0]])] = j
+                if not running:
+                    if stopped or not ready:
+                        break
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    j = running.pop(fut)
+                    exc = fut.exception()
+                    ok, line = (False, "") if exc else fut.result()
+                    on_done(ops[j], ok, line, exc)
+                    release(j)
+        return stopped
+
+def ApplyMoves(ctx: P4Context, moves: List[Tuple[int, str, str]],
+               OnProgress: Optional[Callable[[int, int, int, int, str], None]] = None,
+               StopEvent: Optional[threading.Event] = None,
+               Jobs: int = DEFAULT_MOVE_JOBS,
+               Journal: Optional[ApplyJournal] = None,
+               Origins: Optional[Dict[int, str]] = None) -> Tuple[Dict[int, str], List[str]]:
+    """
+    执行一批大小写修正 move：opened 快照 -> 计划校验 -> 目录级折叠规划 -> 并发执行 -> 一次快照复核。
+    moves: [(key, src, dst), ...]
+    OnProgress(done, ok, fail, skip, msg)：每完成一个条目（或一条目录 move 完成若干条目）回调一次，
+        始终在调用 ApplyMoves 的线程上触发
+    Jobs: 并发执行的 p4 上下文数；父目录 move 先于其下的任何步骤，双步 move 的两步保持顺序
+    Journal: 可选，校验通过的条目与每次 `p4 move` 写入日志；全部成功时日志被删除，
+        失败/中断/崩溃时保留，之后可用 PlanRecovery 续做或回滚
+    Origins: 可选，{key: 第一次 apply 前的路径}（续做/回滚时传入，写入日志并放宽校验）；缺省为 src
+    返回 (results, logs)：results[key] 为 "ok" / "fail" / "skip"；被中断而未执行的条目不在 results 中
+    """
+    results: Dict[int, str] = {}
+    logs: List[str] = []
+    counts = {"ok": 0, "fail": 0, "skip": 0}
+
+    def finish(key: int, status: str, msg: str) -> None:
+        results[key] = status
+        counts[status] += 1
+        if OnProgress:
+            OnProgress(len(results), counts["ok"], counts["fail"], counts["skip"], msg)
+
+    todo: List[Tuple[int, str, str]] = []
+    for key, src, dst in moves:
+        if not dst or src == dst:
+            finish(key, "skip", "跳过无变化")
+        else:
+            todo.append((key, src, dst))
+    if not todo:
+        return results, logs
+
+    with Trace.Span("apply", "snapshot"):
+        ok, index, msg = LoadOpenedIndex(ctx, ALL_CHANGELISTS)
+    if not ok:
+        logs.append(f"[FAIL] opened 快照失败：{msg}")
+        for key, _src, _dst in todo:
+            finish(key, "fail", msg)
+        return results, logs
+
+    # 计划校验：冲突/临时名/链与环在执行前一次性排除，避免浪费整轮 apply
+    with Trace.Span("apply", "validate", moves=len(todo)):
+        existing = _p4_files_batch(ctx, [d for (_k, _s, d) in todo] + [_temp_path(d) for (_k, _s, d) in todo])
+        issues = ValidateMoves(todo, index, existing, Origins)
+    blocked: Dict[int, str] = {}
+    for issue in issues:
+        if issue.Kind == "noop":
+            continue
+        logs.append(f"[BLOCK] {issue.Kind}: {issue.Detail}")
+        for k in issue.Keys:
+            blocked.setdefault(k, issue.Kind)
+    for key, src, dst in todo:
+        if key in blocked:
+            finish(key, "fail", f"{blocked[key]}: {src} → {dst}")
+    todo = [m for m in todo if m[0] not in blocked]
+
+    dst_of = {key: dst for (key, _src, dst) in todo}
+    cur = {key: src for (key, src, _dst) in todo}
+    fallback: set = set()  # 目录 move 失败、改走单文件 move 的条目
+
+    def stop_requested() -> bool:
+        return bool(StopEvent is not None and StopEvent.is_set())
+
+    def should_skip(op: MoveOp) -> bool:
+        if op.IsDir and any(k in fallback for k in op.Keys):
+            fallback.update(op.Keys)  # 上层目录 move 失败，计划中的路径已不成立
+            return True
         return False
-    r2 = ctx.Exec(["move", temp_depot, dst_depot])
-    return r2.returncode == 0
+
+    def on_done(op: MoveOp, ok: bool, line: str, exc: Optional[BaseException]) -> None:
+        if exc is not None:
+            for k in op.Keys:
+                if k not in results:
+                    logs.append(f"[EXCEPT] key={k} err={exc!r}")
+                    finish(k, "fail", f"异常：{exc!r}")
+            return
+        logs.append(line)
+        if op.IsDir:
+            if not ok:
+                fallback.update(op.Keys)
+                return
+            for k in op.Keys:
+                cur[k] = op.Dst + cur[k][len(op.Src):]
+                if cur[k] == dst_of[k]:
+                    finish(k, "ok", f"{op.Src}/... → {op.Dst}/...")
+        else:
+            key = op.Keys[0]
+            finish(key, "ok" if ok else "fail", f"{cur[key]} → {dst_of[key]}")
+
+    clean = False
+    runner: Optional[_OpRunner] = None
+    try:
+        if Journal is not None and todo:
+            origins = Origins or {}
+            Journal.Begin([(k, origins.get(k, s), s, d) for (k, s, d) in todo],
+                          server=ctx.Server, user=ctx.User, client=ctx.Client)
+        runner = _OpRunner(ctx, index, Jobs, Journal)
+        with Trace.Span("apply", "plan", moves=len(todo)) as sp:
+            ops = PlanMoves(todo, index.All)
+            deps = _plan_dependencies(ops)
+            sp.Set(ops=len(ops))
+        with Trace.Span("apply", "execute", ops=len(ops), jobs=runner.Jobs):
+            stopped = runner.Run(ops, deps, cur, dst_of, on_done, should_skip, stop_requested)
+
+        # 目录 move 失败且计划中没有后续单文件 move 的条目：逐个兜底（互不依赖，可并发）
+        if not stopped:
+            rest = [MoveOp(cur[k], dst_of[k], (k,), False)
+                    for (k, _s, _d) in todo if k not in results and k in fallback]
+            if rest:
+                with Trace.Span("apply", "fallback", ops=len(rest)):
+                    stopped = runner.Run(rest, [[] for _ in rest], cur, dst_of, on_done, should_skip, stop_requested)
+        if stopped:
+            logs.append("[INTERRUPT] 用户中断")
+
+        # 批次复核：一次 opened 快照确认所有“成功”项
+        done_ok = [k for (k, st) in results.items() if st == "ok" and k in dst_of]
+        if done_ok:
+            if OnProgress:
+                OnProgress(len(results), counts["ok"], counts["fail"], counts["skip"], "复核中…")
+            with Trace.Span("apply", "verify", files=len(done_ok)):
+                ok_v, missing, v_msg = VerifyTargets(ctx, ALL_CHANGELISTS, [dst_of[k] for k in done_ok])
+            if not ok_v:
+                logs.append(f"[WARN] 复核失败：{v_msg}")
+            missing_set = set(missing)
+            for k in done_ok:
+                if dst_of[k] in missing_set:
+                    results[k] = "fail"
+                    logs.append(f"[FAIL] verify {dst_of[k]}")
+        clean = not stopped and all(results.get(k) == "ok" for k in dst_of)
+    finally:
+        # 异常退出同样写 end 并保留日志；只有进程被杀时日志才停在 step/done
+        if runner is not None:
+            runner.Close()
+        if Journal is not None and todo:
+            Journal.End(clean)
+    return results, logs
+
+# ===================== 中断恢复（续做 / 回滚）=====================
+def PlanRecovery(ctx: P4Context, state: JournalState,
+                 Rollback: bool = False) -> Tuple[bool, List[Tuple[int, str, str]], Dict[int, str], List[JournalEntry], str]:
+    """
+    根据 apply 日志与一次 opened 快照，生成把中断的批次续做完（或回滚到原始路径）的 move 列表。
+    每个条目的当前位置依次尝试：日志重放得到的路径、按未确认的 step 推算的路径（崩溃时该 move
+    可能已经生效）；先精确匹配，再按 casefold 匹配。已在目标位置的条目不再移动，
+    因此已完成的 move 不会重复执行。
+    返回 (ok, moves, origins, lost, msg)：
+      moves  [(key, 当前路径, 目标路径)]，可直接交给 ApplyMoves(..., Origins=origins)
+      lost   在已打开文件中找不到的条目（已被 revert/submit 或改动过），不处理
+    """
+    with Trace.Span("apply", "recover", files=len(state.Entries)):
+        ok, index, msg = LoadOpenedIndex(ctx, ALL_CHANGELISTS)
+    if not ok:
+        return False, [], {}, [], msg
+
+    moves: List[Tuple[int, str, str]] = []
+    origins: Dict[int, str] = {}
+    lost: List[JournalEntry] = []
+    for e in state.Entries:
+        candidates = [e.Current] + [p for p in (MapMove(e.Current, s, d) for (s, d) in state.InFlight) if p]
+        where = next((c for c in candidates if index.Has(c)), None)
+        if where is None:
+            where = next((f for f in (index.FindCasefold(c) for c in candidates) if f), None)
+        if where is None:
+            lost.append(e)
+            continue
+        dst = e.Origin if Rollback else e.Target
+        if where != dst:
+            moves.append((e.Key, where, dst))
+            origins[e.Key] = e.Origin
+    return True, moves, origins, lost, ""
+
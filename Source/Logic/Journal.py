@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import os, re, json, time, threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+_FORMAT_VERSION = 1
+
+def DefaultJournalDir() -> Path:
+    # 与 user.json / resolve_cache.json 放在同一目录
+    return Path.home() / ".p4_submitlist_tool" / "journal"
+
+def JournalPath(server: str, user: str, client: str, Dir: Optional[Path] = None) -> Path:
+    """每个 (server, user, client) 一份日志；同一工作区同一时间只有一批 apply。"""
+    name = re.sub(r"[^\w.-]", "_", f"{server}_{user}_{client}")
+    return Path(Dir or DefaultJournalDir()) / f"{name}.jsonl"
+
+# ===================== 写日志 =====================
+class ApplyJournal:
+    """
+    apply 的追加式日志（JSON Lines），进程崩溃或被中断后可据此续做或回滚：
+      begin  本批全部条目 [key, 原始路径, 本次起始路径, 目标路径]（新建文件，原子替换旧日志）
+      step   即将执行的一次 `p4 move`（执行前写入）
+      done   该次 move 的结果与服务器报告的实际移动 [[from, to], ...]（执行后写入）
+      end    本批结束；全部成功时删除日志，否则保留供续做/回滚
+    每行写入后 flush + fsync；最后一行可能因崩溃而不完整，读取时忽略。线程安全。
+    """
+    def __init__(self, JournalFile: Path, Sync: bool = True):
+        self.JournalFile = Path(JournalFile)
+        self.Sync = Sync
+        self._Lock = threading.Lock()
+        self._Fp = None
+        self._Seq = 0
+
+    def _write(self, rec: Dict[str, object]) -> None:
+        line = json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._Fp.write(line)
+        self._Fp.flush()
+        if self.Sync:
+            os.fsync(self._Fp.fileno())
+
+    def Begin(self, entries: List[Tuple[int, str, str, str]], **meta: object) -> None:
+        """entries: [(key, 原始路径, 起始路径, 目标路径)]；meta 记录连接参数等便于排查。"""
+        self.JournalFile.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.JournalFile.with_name(self.JournalFile.name + ".tmp")
+        with self._Lock:
+            # 先在临时文件写完 begin 并关闭，再替换旧日志（Windows 上不能重命名仍打开的文件），
+            # 之后以追加方式重新打开正式路径
+            try:
+                self._Fp = open(tmp, "w", encoding="utf-8")
+                try:
+                    self._write({"t": "begin", "v": _FORMAT_VERSION, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                 "moves": [list(e) for e in entries], **meta})
+                finally:
+                    self._Fp.close()
+                    self._Fp = None
+                os.replace(tmp, self.JournalFile)
+            except BaseException:
+                try:
+                    tmp.unlink()
+                except OSError:
+                    pass
+                raise
+            self._Fp = open(self.JournalFile, "a", encoding="utf-8")
+
+    def Step(self, src: str, dst: str) -> int:
+        with self._Lock:
+            self._Seq += 1
+            self._write({"t": "step", "n": self._Seq, "src": src, "dst": dst})
+            return self._Seq
+
+    def Done(self, n: int, ok: bool, moved: List[Tuple[str, str]]) -> None:
+        with self._Lock:
+            self._write({"t": "done", "n": n, "ok": bool(ok), "moved": [list(m) for m in moved]})
+
+    def End(self, clean: bool) -> None:
+        """clean 为 True（全部成功）时删除日志；否则记下结束状态并保留。"""
+        with self._Lock:
+            if self._Fp is None:
+                return
+            self._write({"t": "end", "clean": bool(clean)})
+            self._Fp.close()
+            self._Fp = None
+            if clean:
+                try:
+                    self.JournalFile.unlink()
+                except OSError:
+                    pass
+
+    def Close(self) -> None:
+        """不写 end 直接关闭（异常路径）；日志保留，下次启动视为未完成。"""
+        with self._Lock:
+            if self._Fp is not None:
+                self._Fp.close()
+                self._Fp = None
+
+# ===================== 读日志 =====================
+class JournalEntry(NamedTuple):
+    Key: int
+    Origin: str      # 第一次 apply 前的路径（回滚目标）
+    Current: str     # 按日志重放得到的当前路径（不含未确认的 move）
+    Target: str      # 本批的目标路径（续做目标）
+
+class JournalState(NamedTuple):
+    JournalFile: Path
+    Time: str
+    Entries: List[JournalEntry]
+    InFlight: List[Tuple[str, str]]   # 已写 step、没有 done 的 move（崩溃时可能已生效，也可能没有）
+    Ended: bool                       # 是否写到了 end（False 表示进程在执行中退出）
+
+    @property
+    def Pending(self) -> List[JournalEntry]:
+        return [e for e in self.Entries if e.Current != e.Target]
+
+def MapMove(path: str, src: str, dst: str) -> Optional[str]:
+    """按一次 move 推算 path 的新位置：单文件按 casefold 相等，目录 `A/... -> B/...` 按前缀；不相关时返回 None。"""
+    if src.endswith("/...") and dst.endswith("/..."):
+        a, b = src[:-4], dst[:-4]
+        if path.casefold().startswith(a.casefold() + "/"):
+            return b + path[len(a):]
+        return None
+    return dst if path.casefold() == src.casefold() else None
+
+def LoadJournal(JournalFile: Path) -> Optional[JournalState]:
+    """读取并重放日志；没有日志、格式不符时返回 None。"""
+    try:
+        lines = Path(JournalFile).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    recs: List[Dict[str, object]] = []
+    for line in lines:
+        try:
+            recs.append(json.loads(line))
+        except ValueError:
+            break  # 崩溃时写了一半的最后一行
+    if not recs or recs[0].get("t") != "begin" or recs[0].get("v") != _FORMAT_VERSION:
+        return None
+
+    begin = recs[0]
+    keys: List[int] = []
+    origin: Dict[int, str] = {}
+    target: Dict[int, str] = {}
+    cur: Dict[int, str] = {}
+    for key, orig, start, dst in begin.get("moves", []):
+        keys.append(key)
+        origin[key], cur[key], target[key] = orig, start, dst
+    at: Dict[str, int] = {p.casefold(): k for (k, p) in cur.items()}
+
+    def relocate(frm: str, to: str) -> None:
+        k = at.pop(frm.casefold(), None)
+        if k is not None:
+            cur[k] = to
+            at[to.casefold()] = k
+
+    steps: Dict[int, Tuple[str, str]] = {}
+    ended = False
+    for rec in recs[1:]:
+        t = rec.get("t")
+        if t == "step":
+            steps[int(rec["n"])] = (rec["src"], rec["dst"])
+        elif t == "done":
+            src, dst = steps.pop(int(rec["n"]), ("", ""))
+            if not rec.get("ok"):
+                continue
+            moved = rec.get("moved") or []
+            if moved:
+                for frm, to in moved:
+                    relocate(frm, to)
+            elif src:
+                # 后端没有返回逐文件记录：按命令本身推算
+                for k in list(cur):
+                    to = MapMove(cur[k], src, dst)
+                    if to is not None:
+                        relocate(cur[k], to)
+        elif t == "end":
+            ended = True
+
+    entries = [JournalEntry(k, origin[k], cur[k], target[k]) for k in keys]
+    return JournalState(Path(JournalFile), str(begin.get("time", "")), entries,
+                        [steps[n] for n in sorted(steps)], ended)
+
+def PendingJournal(server: str, user: str, client: str, Dir: Optional[Path] = None) -> Optional[JournalState]:
+    """该工作区是否有未完成（可续做/回滚）的 apply；日志存在但已无待办时返回 None。"""
+    state = LoadJournal(JournalPath(server, user, client, Dir))
+    if state is None:
+        return None
+    if not state.Pending and not state.InFlight:
+        return None
+    return state
+
+def DiscardJournal(state: JournalState) -> None:
+    try:
+        Path(state.JournalFile).unlink()
+    except OSError:
+        pass
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+
+import io, os, time, locale, marshal, subprocess, threading
+from typing import Any, Dict, List, Tuple, Optional
+
+# ===================== -G（Python marshal）输出解析 =====================
+def _decode_p4(v: Any) -> str:
+    """-G 输出中的键值都是 bytes；unicode 服务器为 UTF-8，非 unicode 服务器退回系统编码。"""
+    if isinstance(v, bytes):
+        try:
+            return v.decode("utf-8")
+        except UnicodeDecodeError:
+            return v.decode(locale.getpreferredencoding(False) or "utf-8", errors="replace")
+    if isinstance(v, (list, tuple)):
+        return "\n".join(_decode_p4(x) for x in v)
+    return "" if v is None else str(v)
+
+def _parse_marshal_stream(data: bytes) -> List[Dict[str, str]]:
+    """把 `p4 -G` 的 stdout 逐条反序列化为 {str: str} 字典。"""
+    out: List[Dict[str, str]] = []
+    fp = io.BytesIO(data or b"")
+    while True:
+        try:
+            rec = marshal.load(fp)
+        except (EOFError, ValueError, TypeError):
+            break
+        if isinstance(rec, dict):
+            out.append({_decode_p4(k): _decode_p4(v) for k, v in rec.items()})
+    return out
+
+def _collect_records(returncode: int, raw: List[Dict[str, str]], stderr: str) -> Tuple[bool, List[Dict[str, str]], str]:
+    """
+    各后端共用的结果整理：
+      - records: code == "stat"（或无 code 字段）的记录
+      - msg: error/info 记录的文本（多条以换行拼接）
+      - ok: 返回码为 0 且没有 severity >= 3（失败/致命）的错误记录
+    """
+    records: List[Dict[str, str]] = []
+    msgs: List[str] = []
+    failed = (returncode != 0)
+    for rec in raw:
+        code = rec.get("code", "stat")
+        if code == "stat":
+            records.append(rec)
+            continue
+        text = (rec.get("data") or "").strip()
+        if text:
+            msgs.append(text)
+        if code == "error":
+            try:
+                failed = failed or int(rec.get("severity") or 3) >= 3
+            except ValueError:
+                failed = True
+    if stderr and stderr.strip():
+        msgs.append(stderr.strip())
+    return (not failed), records, "\n".join(m for m in msgs if m)
+
+# ===================== depot 语法中的特殊字符 =====================
+# 文件名中的 % @ # * 在 depot/client 语法里写作 %25 %40 %23 %2A（% 必须最先转义、最后还原）
+_P4_ESCAPES = (("%", "%25"), ("@", "%40"), ("#", "%23"), ("*", "%2A"))
+
+def _escape_p4_name(name: str) -> str:
+    """本地文件/目录名 -> depot 语法中的一层名称。"""
+    for ch, esc in _P4_ESCAPES:
+        name = name.replace(ch, esc)
+    return name
+
+def _unescape_p4_name(name: str) -> str:
+    """depot 语法中的名称 -> 本地文件系统名称（%xx 大小写均可）。"""
+    if "%" not in name:
+        return name
+    for ch, esc in reversed(_P4_ESCAPES):
+        name = name.replace(esc, ch).replace(esc.lower(), ch)
+    return name
+
+# ===================== 后端接口 =====================
+class P4Backend:
+    """
+    P4Context 背后的命令执行层。conn 为 P4Context（提供 Server/User/Client）。
+      - Exec: 文本输出，返回 subprocess.CompletedProcess（与直接调用 p4 一致）
+      - ExecRecords: 结构化输出，返回 (ok, records, msg)
+      - Clone: 给并发执行线程使用的独立实例（持久连接类后端各自建立连接）
+    """
+    Name = "base"
+
+    def Exec(self, conn, args: List[str]) -> subprocess.CompletedProcess:
+        raise NotImplementedError
+
+    def ExecRecords(self, conn, args: List[str]) -> Tuple[bool, List[Dict[str, str]], str]:
+        raise NotImplementedError
+
+    def Login(self, conn, password: str) -> Tuple[bool, str]:
+        raise NotImplementedError
+
+    def Clone(self) -> "P4Backend":
+        return self
+
+    def Close(self) -> None:
+        pass
+
+# ===================== 子进程后端（默认）=====================
+class SubprocessBackend(P4Backend):
+    """每条命令启动一个 p4 进程；无需第三方依赖。"""
+    Name = "subprocess"
+
+    def _cmd(self, conn, args: List[str]) -> List[str]:
+        base = ["p4", "-p", conn.Server, "-u", conn.User, "-c", conn.Client]
+        return base + (args or [])
+
+    def Exec(self, conn, args: List[str]) -> subprocess.CompletedProcess:
+        return subprocess.run(self._cmd(conn, args), text=True, capture_output=True)
+
+    def ExecRecords(self, conn, args: List[str]) -> Tuple[bool, List[Dict[str, str]], str]:
+        r = subprocess.run(self._cmd(conn, ["-G"] + (args or [])), capture_output=True)
+        return _collect_records(r.returncode, _parse_marshal_stream(r.stdout), _decode_p4(r.stderr))
+
+    def Login(self, conn, password: str) -> Tuple[bool, str]:
+        p = subprocess.Popen(["p4", "-p", conn.Server, "-u", conn.User, "login"],
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        out, err = p.communicate((password or "") + "\n")
+        ok = (p.returncode == 0)
+        msg = (err or out or "").strip()
+        return ok, msg
+
+# ===================== 持久连接后端（P4Python）=====================
+def HasP4Python() -> bool:
+    try:
+        import P4  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+class P4PythonBackend(P4Backend):
+    """
+    通过 P4Python（`pip install p4python`）复用一条连接执行所有命令，省去每条命令的进程启动与重连。
+    一个实例只被一个线程使用；并发时通过 Clone() 为每个执行线程建立各自的连接。
+    """
+    Name = "p4python"
+
+    def __init__(self):
+        import P4  # 可选依赖：未安装时由调用方（MakeBackend）回退到子进程后端
+        self._Mod = P4
+        self._P4 = None
+        self._Lock = threading.Lock()
+
+    def _connect(self, conn):
+        p4 = self._P4
+        if p4 is not None and p4.connected() and (p4.port, p4.user, p4.client) == (conn.Server, conn.User, conn.Client):
+            return p4
+        if p4 is not None and p4.connected():
+            p4.disconnect()
+        p4 = self._Mod.P4()
+        p4.port, p4.user, p4.client = conn.Server, conn.User, conn.Client
+        p4.exception_level = 1  # 只有 error 抛异常，warning 留在 p4.warnings
+        p4.connect()
+        self._P4 = p4
+        return p4
+
+    def _run(self, conn, args: List[str], tagged: bool) -> Tuple[int, List[Any], List[str], List[str]]:
+        with self._Lock:
+            try:
+                p4 = self._connect(conn)
+                p4.tagged = tagged
+                out = p4.run(*args)
+                return 0, list(out or []), list(p4.errors or []), list(p4.warnings or [])
+            except self._Mod.P4Exception as e:
+                p4 = self._P4
+                errs = list(getattr(p4, "errors", None) or []) or [str(e)]
+                warns = list(getattr(p4, "warnings", None) or [])
+                return 1, [], errs, warns
+
+    def Exec(self, conn, args: List[str]) -> subprocess.CompletedProcess:
+        rc, out, errs, warns = self._run(conn, args, tagged=False)
+        stdout = "\n".join(_decode_p4(x) for x in out)
+        stderr = "\n".join(errs + warns)
+        return subprocess.CompletedProcess(["p4"] + list(args), rc, stdout, stderr)
+
+    def ExecRecords(self, conn, args: List[str]) -> Tuple[bool, List[Dict[str, str]], str]:
+        rc, out, errs, warns = self._run(conn, args, tagged=True)
+        raw: List[Dict[str, str]] = []
+        for x in out:
+            if isinstance(x, dict):
+                raw.append({str(k): _decode_p4(v) for k, v in x.items()})
+            else:
+                raw.append({"code": "info", "data": _decode_p4(x)})
+        raw += [{"code": "error", "severity": "3", "data": e} for e in errs]
+        raw += [{"code": "error", "severity": "2", "data": w} for w in warns]
+        return _collect_records(rc, raw, "")
+
+    def Login(self, conn, password: str) -> Tuple[bool, str]:
+        with self._Lock:
+            try:
+                p4 = self._connect(conn)
+                p4.password = password or ""
+                p4.run_login()
+                return True, ""
+            except Exception as e:
+                return False, str(e)
+
+    def Clone(self) -> "P4Backend":
+        return P4PythonBackend()
+
+    def Close(self) -> None:
+        with self._Lock:
+            if self._P4 is not None and self._P4.connected():
+                self._P4.disconnect()
+            self._P4 = None
+
+# ===================== 进程内模拟服务器 =====================
+class FakeServer:
+    """
+    进程内模拟的 depot + 单个 client，用于离线测试与基准：
+      - 视图固定为 `DepotRoot/... //ClientName/...`，本地根为 ClientRoot；
+      - CaseInsensitive 为 True 时按 casefold 匹配路径（模拟 Windows 服务器）；
+      - CaseOnlyMoveNoop 为 True 时，仅大小写不同的 move 报告成功但不改变大小写
+        （本工具需要用双步 move 兜底的那种服务器行为）；
+      - Latency 为每条命令的模拟往返延迟（秒），在锁外等待，可并发。
+    线程安全：所有状态修改在一把锁内完成。
+    """
+    def __init__(self, ClientRoot: str, DepotRoot: str = "//depot", ClientName: str = "fake",
+                 CaseInsensitive: bool = True, CaseOnlyMoveNoop: bool = False, Latency: float = 0.0):
+        self.ClientRoot = ClientRoot
+        self.DepotRoot = DepotRoot.rstrip("/")
+        self.ClientName = ClientName
+        self.CaseInsensitive = CaseInsensitive
+        self.CaseOnlyMoveNoop = CaseOnlyMoveNoop
+        self.Latency = float(Latency or 0.0)
+        self.Files: Dict[str, int] = {}            # 已提交文件: depot 路径 -> head rev
+        self.Opened: Dict[str, Dict[str, str]] = {} # 已打开文件: depot 路径 -> {"action", "change"}
+        self.Changes: Dict[str, str] = {}          # 待提交 changelist: id -> 描述
+        self.CommandCount = 0
+        self._FilesFold: Dict[str, str] = {}       # casefold -> 已提交文件路径
+        self._OpenedFold: Dict[str, set] = {}      # casefold -> 已打开路径集合（可能含 move/delete 残留）
+        self._Lock = threading.Lock()
+
+    # ---------- 构造数据 ----------
+    def AddFile(self, depot_path: str, action: Optional[str] = "edit", change: str = "default") -> None:
+        """登记一个文件；action 为 None 表示只存在于 depot、未打开；"add" 表示仅本地新增。"""
+        with self._Lock:
+            if action != "add":
+                self.Files[depot_path] = self.Files.get(depot_path, 1)
+                self._FilesFold.setdefault(depot_path.casefold(), depot_path)
+            if action:
+                self._open(depot_path, {"action": action, "change": change or "default"})
+            if change and change != "default":
+                self.Changes.setdefault(change, f"change {change}")
+
+    def AddChange(self, change: str, desc: str) -> None:
+        with self._Lock:
+            self.Changes[change] = desc
+
+    # ---------- 快照（供进程外的模拟 p4 可执行文件在多次调用间保存状态）----------
+    def Snapshot(self) -> Dict[str, Any]:
+        """可 JSON 序列化的完整状态。"""
+        with self._Lock:
+            return {"client_root": self.ClientRoot, "depot_root": self.DepotRoot, "client": self.ClientName,
+                    "case_insensitive": self.CaseInsensitive, "case_only_move_noop": self.CaseOnlyMoveNoop,
+                    "files": sorted(self.Files), "changes": dict(self.Changes),
+                    "opened": [[p, o["action"], o["change"]] for (p, o) in sorted(self.Opened.items())]}
+
+    @classmethod
+    def FromSnapshot(cls, snap: Dict[str, Any]) -> "FakeServer":
+        s = cls(snap["client_root"], snap.get("depot_root", "//depot"), snap.get("client", "fake"),
+                CaseInsensitive=bool(snap.get("case_insensitive", True)),
+                CaseOnlyMoveNoop=bool(snap.get("case_only_move_noop", False)))
+        for p in snap.get("files", []):
+            s.Files[p] = 1
+            s._FilesFold.setdefault(p.casefold(), p)
+        for p, action, change in snap.get("opened", []):
+            s._open(p, {"action": action, "change": change})
+        s.Changes.update(snap.get("changes", {}))
+        return s
+
+    # ---------- 路径工具 ----------
+    def _key(self, p: str) -> str:
+        return p.casefold() if self.CaseInsensitive else p
+
+    def _open(self, path: str, rec: Dict[str, str]) -> None:
+        self.Opened[path] = rec
+        self._OpenedFold.setdefault(path.casefold(), set()).add(path)
+
+    def _close(self, path: str) -> Dict[str, str]:
+        rec = self.Opened.pop(path)
+        bucket = self._OpenedFold.get(path.casefold())
+        if bucket is not None:
+            bucket.discard(path)
+            if not bucket:
+                del self._OpenedFold[path.casefold()]
+        return rec
+
+    def _find_opened(self, path: str) -> Optional[str]:
+        """按服务器大小写规则查找一个仍然有效（非 delete）的已打开路径。"""
+        live = lambda p: "delete" not in self.Opened[p]["action"]
+        if path in self.Opened and live(path):
+            return path
+        if not self.CaseInsensitive:
+            return None
+        return next((p for p in sorted(self._OpenedFold.get(path.casefold(), ())) if live(p)), None)
+
+    def _find_file(self, path: str) -> Optional[str]:
+        if path in self.Files:
+            return path
+        return self._FilesFold.get(path.casefold()) if self.CaseInsensitive else None
+
+    def _under(self, path: str, prefix: str) -> bool:
+        return self._key(path).startswith(self._key(prefix) + "/")
+
+    def _map(self, depot_path: str) -> Optional[Tuple[str, str]]:
+        if not self._under(depot_path, self.DepotRoot):
+            return None
+        rel = depot_path[len(self.DepotRoot) + 1:]
+        return f"//{self.ClientName}/{rel}", os.path.join(self.ClientRoot, *map(_unescape_p4_name, rel.split("/")))
+
+    def _opened_rec(self, p: str) -> Dict[str, str]:
+        o = self.Opened[p]
+        client = (self._map(p) or ("", ""))[0]
+        return {"code": "stat", "depotFile": p, "clientFile": client, "action": o["action"],
+                "change": o["change"], "rev": str(self.Files.get(p, 1)), "type": "binary"}
+
+    # ---------- 命令 ----------
+    def Run(self, args: List[str]) -> List[Dict[str, str]]:
+        """执行一条命令，返回 -G 风格的原始记录（含 code 字段）。"""
+        if self.Latency > 0:
+            time.sleep(self.Latency)
+        cmd, rest = (args[0], list(args[1:])) if args else ("", [])
+        fn = getattr(self, "_cmd_" + cmd.replace("-", "_"), None)
+        with self._Lock:
+            self.CommandCount += 1
+            if fn is None:
+                return [{"code": "error", "severity": "3", "data": f"Unknown command.  Try 'p4 help' for info. ({cmd})"}]
+            return fn(rest)
+
+    def _cmd_info(self, _args: List[str]) -> List[Dict[str, str]]:
+        return [{"code": "stat", "userName": "fake", "clientName": self.ClientName, "clientRoot": self.ClientRoot,
+                 "serverAddress": "fake:1666", "caseHandling": "insensitive" if self.CaseInsensitive else "sensitive"}]
+
+    def _cmd_login(self, _args: List[str]) -> List[Dict[str, str]]:
+        return [{"code": "stat", "User": "fake", "TicketExpiration": "43200"}]
+
+    def _cmd_client(self, _args: List[str]) -> List[Dict[str, str]]:
+        return [{"code": "stat", "Client": self.ClientName, "Root": self.ClientRoot,
+                 "View0": f"{self.DepotRoot}/... //{self.ClientName}/..."}]
+
+    def _cmd_opened(self, args: List[str]) -> List[Dict[str, str]]:
+        cl = args[args.index("-c") + 1] if "-c" in args else None
+        recs = [self._opened_rec(p) for p in sorted(self.Opened) if cl is None or self.Opened[p]["change"] == cl]
+        return recs or [{"code": "error", "severity": "2", "data": "File(s) not opened on this client."}]
+
+    def _cmd_where(self, args: List[str]) -> List[Dict[str, str]]:
+        out = []
+        for a in args:
+            m = self._map(a)
+            if m is None:
+                out.append({"code": "error", "severity": "2", "data": f"{a} - file(s) not in client view."})
+            else:
+                out.append({"code": "stat", "depotFile": a, "clientFile": m[0], "path": m[1]})
+        return out
+
+    def _cmd_files(self, args: List[str]) -> List[Dict[str, str]]:
+        out = []
+        for a in args:
+            p = self._find_file(a)
+            if p is None:
+                out.append({"code": "error", "severity": "2", "data": f"{a} - no such file(s)."})
+            else:
+                out.append({"code": "stat", "depotFile": p, "rev": str(self.Files[p]), "action": "edit",
+                            "change": "1", "type": "binary"})
+        return out
+
+    def _cmd_changes(self, args: List[str]) -> List[Dict[str, str]]:
+        m = int(args[args.index("-m") + 1]) if "-m" in args else len(self.Changes)
+        ids = sorted(self.Changes, key=lambda c: int(c) if c.isdigit() else 0, reverse=True)[:m]
+        return [{"code": "stat", "change": c, "desc": self.Changes[c], "status": "pending",
+                 "client": self.ClientName, "user": "fake", "time": "0"} for c in ids]
+
+    def _move_one(self, src: str, dst: str) -> Dict[str, str]:
+        o = self.Opened[src]
+        if self.CaseOnlyMoveNoop and src != dst and src.casefold() == dst.casefold():
+            return {"code": "stat", "depotFile": src, "fromFile": src, "action": o["action"]}
+        self._close(src)
+        if o["action"] == "edit":
+            self._open(src, {"action": "move/delete", "change": o["change"]})
+            o = {"action": "move/add", "change": o["change"]}
+        self._open(dst, o)
+        return {"code": "stat", "depotFile": dst, "fromFile": src, "action": o["action"]}
+
+    def _cmd_move(self, args: List[str]) -> List[Dict[str, str]]:
+        args = [a for a in args if not a.startswith("-")]
+        if len(args) != 2:
+            return [{"code": "error", "severity": "3", "data": "Usage: move fromFile toFile"}]
+        src, dst = args
+        if src.endswith("/...") and dst.endswith("/..."):
+            sp, dp = src[:-4], dst[:-4]
+            hits = [p for p in sorted(self.Opened) if self._under(p, sp) and "delete" not in self.Opened[p]["action"]]
+            if not hits:
+                return [{"code": "error", "severity": "3", "data": f"{src} - file(s) not opened for edit."}]
+            return [self._move_one(p, dp + p[len(sp):]) for p in hits]
+        p = self._find_opened(src)
+        if p is None:
+            return [{"code": "error", "severity": "3", "data": f"{src} - file(s) not opened for edit."}]
+        other = self._find_opened(dst)
+        if other is not None and other != p:
+            return [{"code": "error", "severity": "3", "data": f"{dst} - can't move to an existing file."}]
+        return [self._move_one(p, dst)]
+
+def _records_to_text(args: List[str], raw: List[Dict[str, str]]) -> Tuple[int, str, str]:
+    """把模拟记录渲染为近似 p4 的文本输出（供 Exec 使用）。"""
+    out: List[str] = []
+    err: List[str] = []
+    failed = False
+    for rec in raw:
+        code = rec.get("code", "stat")
+        if code != "stat":
+            err.append(rec.get("data", ""))
+            failed = failed or (code == "error" and int(rec.get("severity") or 3) >= 3)
+            continue
+        cmd = args[0] if args else ""
+        if cmd == "opened":
+            out.append(f"{rec['depotFile']}#{rec.get('rev', '1')} - {rec['action']} "
+                       f"{'default change' if rec['change'] == 'default' else 'change ' + rec['change']} ({rec.get('type', '')})")
+        elif cmd == "move":
+            out.append(f"{rec['depotFile']}#1 - moved from {rec['fromFile']}#1")
+        elif cmd == "where":
+            out.append(f"{rec['depotFile']} {rec['clientFile']} {rec['path']}")
+        else:
+            out.append(" ".join(f"{k}={v}" for (k, v) in rec.items() if k != "code"))
+    return (1 if failed else 0), "\n".join(out) + ("\n" if out else ""), "\n".join(err)
+
+class FakeBackend(P4Backend):
+    """把命令交给进程内的 FakeServer；所有 Clone 共享同一个服务器状态。"""
+    Name = "fake"
+
+    def __init__(self, Server: FakeServer):
+        self.Server = Server
+
+    def Exec(self, conn, args: List[str]) -> subprocess.CompletedProcess:
+        rc, out, err = _records_to_text(args, self.Server.Run(args))
+        return subprocess.CompletedProcess(["p4"] + list(args), rc, out, err)
+
+    def ExecRecords(self, conn, args: List[str]) -> Tuple[bool, List[Dict[str, str]], str]:
+        return _collect_records(0, self.Server.Run(args), "")
+
+    def Login(self, conn, password: str) -> Tuple[bool, str]:
+        return True, ""
+
+# ===================== 选择后端 =====================
+def MakeBackend(kind: str = "") -> P4Backend:
+    """
+    kind: "subprocess" / "p4python" / "auto"（默认读取环境变量 P4CASESYNC_BACKEND，缺省为 subprocess）。
+    "auto" 与 "p4python" 在未安装 P4Python 时回退到子进程后端。
+    """
+    kind = (kind or os.environ.get("P4CASESYNC_BACKEND", "") or "subprocess").strip().lower()
+    if kind in ("p4python", "auto") and HasP4Python():
+        try:
+            return P4PythonBackend()
+        except Exception:
+            pass
+    return SubprocessBackend()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import os, json, tempfile, threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 缓存文件大小上限（按各条目序列化后的字节数估算；超过后按最近使用时间淘汰最旧的）
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+_FORMAT_VERSION = 1
+
+def DefaultCachePath() -> Path:
+    # 与 Core._cache_path() 的 user.json 放在同一目录
+    return Path.home() / ".p4_submitlist_tool" / "resolve_cache.json"
+
+def DirSignature(path: str) -> Optional[Tuple[int, int]]:
+    """目录的 (mtime_ns, inode)；目录内增删/改名都会改变 mtime。不可访问时返回 None。"""
+    try:
+        st = os.stat(path or os.sep)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_ino)
+
+# ===================== 跨会话解析缓存 =====================
+class ResolveCache:
+    """
+    持久化到磁盘的解析缓存（JSON），跨刷新、跨会话复用：
+      - where 映射：按 (client, 视图哈希) 分桶，视图/根目录一变哈希就变，旧桶自然不再命中；
+      - 目录列表：按目录路径保存名称列表，用 (mtime_ns, inode) 校验，目录未变化时免 listdir；
+      - 每个条目记录最近使用序号，Flush() 时按 LRU 淘汰到 MaxBytes 以内再原子写回
+        （目录条目按整份名称列表计大小，大目录不会以“一条”的代价占满文件）；
+        命中只更新内存中的序号，只有新增/更新条目才需要写回文件（随下一次写回一并保存）。
+    构造时不读文件：第一次使用（或显式 Load()）时才解析，由后台线程承担，不阻塞界面。
+    线程安全；读取失败（文件损坏、版本不符）时视为空缓存。
+    """
+    def __init__(self, CachePath: Optional[Path] = None, MaxBytes: int = DEFAULT_MAX_BYTES):
+        self.CachePath = Path(CachePath) if CachePath else DefaultCachePath()
+        self.MaxBytes = max(0, int(MaxBytes))
+        self._Lock = threading.Lock()
+        self._Loaded = False
+        self._Dirs: Dict[str, list] = {}                  # {目录: [mtime_ns, inode, names, tick]}
+        self._Where: Dict[str, Dict[str, list]] = {}      # {桶: {depot: [client, local, tick]}}
+        self._Folded: Dict[str, Dict[str, str]] = {}      # {桶: {casefold depot: depot}}（按需构建）
+        self._Tick = 0
+        self._Dirty = False
+        self.WhereHits = 0
+        self.DirHits = 0
+
+    # ---------- 读写文件 ----------
+    def Load(self) -> None:
+        """解析缓存文件（只做一次）；各读写接口也会按需调用。"""
+        with self._Lock:
+            self._ensure_loaded()
+
+    def _ensure_loaded(self) -> None:
+        # 调用方已持有锁
+        if not self._Loaded:
+            self._Loaded = True
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(self.CachePath.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        if not isinstance(data, dict) or data.get("version") != _FORMAT_VERSION:
+            return
+        self._Tick = int(data.get("tick", 0))
+        self._Dirs = dict(data.get("dirs") or {})
+        self._Where = {k: dict(v) for (k, v) in (data.get("where") or {}).items()}
+
+    def Flush(self) -> None:
+        """
+        有改动时按上限淘汰并原子写回：在锁内序列化（其它线程可能同时 Put），
+        锁外写入本进程独有的临时文件再替换；写回失败时保留改动标记，下次再试。
+        """
+        with self._Lock:
+            if not self._Dirty:
+                return
+            self._evict()
+            data = {"version": _FORMAT_VERSION, "tick": self._Tick, "dirs": self._Dirs, "where": self._Where}
+            text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+            self._Dirty = False
+        tmp = ""
+        try:
+            self.CachePath.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=self.CachePath.name + ".", suffix=".tmp", dir=str(self.CachePath.parent))
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                fp.write(text)
+            os.replace(tmp, self.CachePath)
+        except Exception:
+            with self._Lock:
+                self._Dirty = True
+            if tmp:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def _evict(self) -> None:
+        # 估算每个条目写成 JSON 后的字节数（引号、分隔符、数字按固定开销计）
+        entries = [(ent[3], len(d) + sum(len(n) + 3 for n in ent[2]) + 48, "", d)
+                   for (d, ent) in self._Dirs.items()]
+        entries += [(m[2], len(dep) + len(m[0]) + len(m[1]) + 32, bucket, dep)
+                    for (bucket, b) in self._Where.items() for (dep, m) in b.items()]
+        excess = sum(e[1] for e in entries) - self.MaxBytes
+        if excess <= 0:
+            return
+        entries.sort(key=lambda e: e[0])
+        for _t, size, bucket, key in entries:
+            if excess <= 0:
+                break
+            excess -= size
+            if bucket:
+                del self._Where[bucket][key]
+            else:
+                del self._Dirs[key]
+        for bucket in [k for (k, b) in self._Where.items() if not b]:
+            del self._Where[bucket]
+        self._Folded.clear()
+
+    def _touch(self) -> int:
+        self._Tick += 1
+        return self._Tick
+
+    # ---------- where 映射 ----------
+    @staticmethod
+    def WhereKey(client: str, view_hash: str) -> str:
+        return f"{client}|{view_hash}"
+
+    def WhereGet(self, key: str, depots: List[str]) -> Tuple[Dict[str, Tuple[str, str]], List[str]]:
+        """返回 (已缓存的 {depot: (client, local)}, 仍需查询的 depot 列表)；大小写不同的 depot 也能命中。"""
+        found: Dict[str, Tuple[str, str]] = {}
+        missing: List[str] = []
+        with self._Lock:
+            self._ensure_loaded()
+            bucket = self._Where.get(key)
+            if not bucket:
+                return found, list(depots)
+            folded = self._Folded.get(key)
+            if folded is None:
+                folded = self._Folded[key] = {d.casefold(): d for d in bucket}
+            tick = self._touch()
+            for dep in depots:
+                hit = bucket.get(dep) or bucket.get(folded.get(dep.casefold(), ""))
+                if hit is None:
+                    missing.append(dep)
+                    continue
+                hit[2] = tick
+                found[dep] = (hit[0], hit[1])
+            self.WhereHits += len(found)
+        return found, missing
+
+    def WherePut(self, key: str, table: Dict[str, Tuple[str, str]]) -> None:
+        if not table:
+            return
+        with self._Lock:
+            self._ensure_loaded()
+            bucket = self._Where.setdefault(key, {})
+            folded = self._Folded.get(key)
+            tick = self._touch()
+            for dep, (client, local) in table.items():
+                bucket[dep] = [client, local, tick]
+                if folded is not None:
+                    folded[dep.casefold()] = dep
+            self._Dirty = True
+
+    # ---------- 目录列表 ----------
+    def DirGet(self, path: str, sig: Tuple[int, int]) -> Optional[List[str]]:
+        """签名一致时返回缓存的名称列表，否则 None（调用方重新 listdir 后 DirPut）。"""
+        with self._Lock:
+            self._ensure_loaded()
+            ent = self._Dirs.get(path)
+            if ent is None or ent[0] != sig[0] or ent[1] != sig[1]:
+                return None
+            ent[3] = self._touch()
+            self.DirHits += 1
+            return ent[2]
+
+    def DirPut(self, path: str, sig: Tuple[int, int], names: List[str]) -> None:
+        with self._Lock:
+            self._ensure_loaded()
+            self._Dirs[path] = [sig[0], sig[1], list(names), self._touch()]
+            self._Dirty = True
+
+    def Stats(self) -> Dict[str, int]:
+        with self._Lock:
+            self._ensure_loaded()
+            return {"dirs": len(self._Dirs), "where": sum(len(b) for b in self._Where.values()),
+                    "dir_hits": self.DirHits, "where_hits": self.WhereHits}
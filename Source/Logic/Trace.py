@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+热路径埋点：p4 命令、目录读取、扫描各阶段、apply 各阶段与列表渲染的耗时与计数。
+
+开启方式：
+  - 环境变量 P4CASESYNC_TRACE=1：结束时向 stderr 输出汇总；
+    P4CASESYNC_TRACE=<路径.json>：同时导出 Chrome trace-event JSON（chrome://tracing 或 Perfetto 打开）；
+  - Cli.py --trace [路径]。
+
+关闭时（默认）热路径只多一次模块变量读取：调用方先判断 Trace.Enabled，
+Span() 返回共享的空对象，不分配、不计时、不加锁。
+"""
+
+import os, sys, json, time, threading
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+ENV_VAR = "P4CASESYNC_TRACE"
+MAX_EVENTS = 1000000   # 保留的明细事件上限；超出后只累计汇总
+
+Enabled = False
+
+_Lock = threading.Lock()
+_Events: List[Tuple[str, str, int, float, float, Optional[Dict[str, Any]]]] = []  # (cat, name, tid, start, dur, args)
+_Agg: Dict[Tuple[str, str], List[float]] = {}   # {(cat, name): [次数, 总耗时, 最大耗时, 字节数]}
+_Threads: Dict[int, str] = {}
+_State = {"t0": 0.0, "export": "", "dropped": 0}
+
+# 汇总里各类别的显示顺序
+_CATEGORIES = ("p4", "fs", "scan", "apply", "ui")
+
+def Now() -> float:
+    return time.perf_counter()
+
+def Enable(ExportPath: str = "") -> None:
+    """开启埋点；ExportPath 非空时 Finish() 会导出 Chrome trace。重复开启会清空已有数据。"""
+    global Enabled
+    Reset()
+    _State["export"] = ExportPath or ""
+    Enabled = True
+
+def EnableFromEnv() -> bool:
+    """按环境变量开启；返回是否开启。"""
+    value = os.environ.get(ENV_VAR, "").strip()
+    if not value or value.lower() in ("0", "false", "off", "no"):
+        return False
+    Enable("" if value.lower() in ("1", "true", "on", "yes") else value)
+    return True
+
+def Disable() -> None:
+    global Enabled
+    Enabled = False
+
+def Reset() -> None:
+    with _Lock:
+        _Events.clear()
+        _Agg.clear()
+        _Threads.clear()
+        _State["t0"] = Now()
+        _State["dropped"] = 0
+
+def Record(cat: str, name: str, start: float, end: float, Bytes: int = 0, **args: Any) -> None:
+    """记录一个已结束的区间（start/end 取自 Now()）；Bytes 计入汇总的输出字节数。"""
+    dur = end - start
+    tid = threading.get_ident()
+    if Bytes:
+        args["bytes"] = Bytes
+    with _Lock:
+        agg = _Agg.get((cat, name))
+        if agg is None:
+            agg = _Agg[(cat, name)] = [0, 0.0, 0.0, 0]
+        agg[0] += 1
+        agg[1] += dur
+        if dur > agg[2]:
+            agg[2] = dur
+        agg[3] += Bytes
+        if tid not in _Threads:
+            _Threads[tid] = threading.current_thread().name
+        if len(_Events) < MAX_EVENTS:
+            _Events.append((cat, name, tid, start, dur, args or None))
+        else:
+            _State["dropped"] += 1
+
+class _Span:
+    __slots__ = ("Cat", "Name", "Args", "Start")
+
+    def __init__(self, cat: str, name: str, args: Dict[str, Any]):
+        self.Cat, self.Name, self.Args = cat, name, args
+
+    def __enter__(self) -> "_Span":
+        self.Start = Now()
+        return self
+
+    def __exit__(self, *_exc) -> bool:
+        Record(self.Cat, self.Name, self.Start, Now(), **self.Args)
+        return False
+
+    def Set(self, **args: Any) -> None:
+        """在区间内补充参数（如结果条数）。"""
+        self.Args.update(args)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *_exc) -> bool:
+        return False
+
+    def Set(self, **_args: Any) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def Span(cat: str, name: str, **args: Any):
+    """with Trace.Span("scan", "where", files=n): ...；关闭时返回共享的空对象。"""
+    if not Enabled:
+        return _NULL_SPAN
+    return _Span(cat, name, args)
+
+# ===================== 汇总 / 导出 =====================
+def _fmt_bytes(n: float) -> str:
+    if n >= 1 << 20:
+        return f"{n / (1 << 20):.1f} MB"
+    if n >= 1 << 10:
+        return f"{n / (1 << 10):.1f} KB"
+    return f"{int(n)} B" if n else ""
+
+def Summary() -> str:
+    """按 (类别, 名称) 汇总：次数、总计/平均/最大耗时、输出字节数；末尾给出各类别合计。"""
+    with _Lock:
+        agg = {k: list(v) for (k, v) in _Agg.items()}
+        wall = Now() - _State["t0"]
+        dropped = _State["dropped"]
+    order = {c: i for (i, c) in enumerate(_CATEGORIES)}
+    rows = sorted(agg.items(), key=lambda kv: (order.get(kv[0][0], len(order)), kv[0][0], -kv[1][1]))
+
+    lines = [f"=== 埋点汇总（墙钟 {wall:.3f} s）===",
+             f"{'类别':<6}{'名称':<22}{'次数':>8}{'总计ms':>11}{'平均ms':>10}{'最大ms':>10}  输出"]
+    for (cat, name), (count, total, peak, nbytes) in rows:
+        lines.append(f"{cat:<8}{name:<24}{int(count):>8}{total * 1000:>11.1f}"
+                     f"{total * 1000 / count:>10.2f}{peak * 1000:>10.1f}  {_fmt_bytes(nbytes)}")
+    by_cat: Dict[str, float] = {}
+    for (cat, _name), v in agg.items():
+        by_cat[cat] = by_cat.get(cat, 0.0) + v[1]
+    if by_cat:
+        parts = [f"{c} {t:.3f}s" for (c, t) in sorted(by_cat.items(), key=lambda kv: order.get(kv[0], len(order)))]
+        lines.append("按类别合计（多线程累加，外层阶段包含内层命令）：" + "  ".join(parts))
+    if dropped:
+        lines.append(f"明细事件超过 {MAX_EVENTS} 条，{dropped} 条只计入汇总")
+    return "\n".join(lines)
+
+def ExportChrome(path: str) -> None:
+    """导出 Chrome trace-event JSON（"X" 完整事件 + 线程名元数据）。"""
+    with _Lock:
+        events = list(_Events)
+        threads = dict(_Threads)
+        t0 = _State["t0"]
+    pid = os.getpid()
+    tids = {tid: i for (i, tid) in enumerate(threads, 1)}
+    out: List[Dict[str, Any]] = [
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": tids[tid], "args": {"name": name}}
+        for (tid, name) in threads.items()]
+    for cat, name, tid, start, dur, args in events:
+        ev = {"name": name, "cat": cat, "ph": "X", "pid": pid, "tid": tids.get(tid, 0),
+              "ts": round((start - t0) * 1e6, 1), "dur": round(dur * 1e6, 1)}
+        if args:
+            ev["args"] = args
+        out.append(ev)
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump({"traceEvents": out, "displayTimeUnit": "ms"}, fp, ensure_ascii=False)
+
+def Finish(Stream: Optional[TextIO] = None, ExportPath: str = "") -> None:
+    """开启状态下输出汇总，并按 ExportPath（或 Enable 时给出的路径）导出 trace。"""
+    if not Enabled:
+        return
+    stream = Stream if Stream is not None else sys.stderr
+    stream.write(Summary() + "\n")
+    path = ExportPath or _State["export"]
+    if path:
+        try:
+            ExportChrome(path)
+            stream.write(f"trace 已导出：{path}\n")
+        except OSError as e:
+            stream.write(f"trace 导出失败：{e}\n")
+    stream.flush()
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+
+import os, sys, struct, select, threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ResolveCache import ResolveCache, DirSignature
+from Core import (
+    P4Context, DEFAULT_FS_WORKERS,
+    _p4_where_batch, _where_cache_key, _where_stage, _make_dir_cache,
+    _resolve_local_cases, _target_stage,
+)
+
+# 轮询/等待事件的间隔（秒），以及检测到变化后合并后续事件的等待时间
+DEFAULT_WATCH_INTERVAL = 1.0
+_SETTLE_SECONDS = 0.2
+
+# ===================== 目录监视器 =====================
+class DirWatcher:
+    """
+    目录变化监视器接口：
+      - SetDirs(dirs)：设置要监视的目录集合（增量增删）；
+      - Poll(timeout)：最多等待 timeout 秒，返回期间内容发生变化的目录集合；
+      - Close()：释放资源。
+    只关心目录项的增删/改名（即 listdir 结果的变化），不关心文件内容。
+    """
+    Name = "base"
+
+    def SetDirs(self, dirs: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    def Poll(self, timeout: float) -> Set[str]:
+        raise NotImplementedError
+
+    def Close(self) -> None:
+        pass
+
+class PollingWatcher(DirWatcher):
+    """按 (mtime, inode) 轮询；任何平台可用，开销为每轮每个目录一次 stat。"""
+    Name = "polling"
+
+    def __init__(self):
+        self._Sigs: Dict[str, Optional[Tuple[int, int]]] = {}
+        self._Wake = threading.Event()
+
+    def SetDirs(self, dirs: Iterable[str]) -> None:
+        want = set(dirs)
+        self._Sigs = {d: (self._Sigs[d] if d in self._Sigs else DirSignature(d)) for d in want}
+
+    def Poll(self, timeout: float) -> Set[str]:
+        self._Wake.wait(timeout)
+        changed: Set[str] = set()
+        for d, old in list(self._Sigs.items()):
+            sig = DirSignature(d)
+            if sig != old:
+                self._Sigs[d] = sig
+                changed.add(d)
+        return changed
+
+    def Close(self) -> None:
+        self._Wake.set()
+
+# inotify 常量（<sys/inotify.h>）
+_IN_MOVED_FROM  = 0x00000040
+_IN_MOVED_TO    = 0x00000080
+_IN_CREATE      = 0x00000100
+_IN_DELETE      = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF   = 0x00000800
+_IN_Q_OVERFLOW  = 0x00004000
+_IN_IGNORED     = 0x00008000
+_IN_ONLYDIR     = 0x01000000
+_IN_NONBLOCK    = 0o4000
+_IN_CLOEXEC     = 0o2000000
+_WATCH_MASK = (_IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT_HEAD = struct.Struct("iIII")
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch  # 缺符号时抛 AttributeError
+        return libc
+    except Exception:
+        return None
+
+class InotifyWatcher(DirWatcher):
+    """Linux inotify（通过 ctypes 调用 libc，无第三方依赖）；目录变化即时通知，无需轮询 stat。"""
+    Name = "inotify"
+
+    def __init__(self):
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError("inotify 不可用")
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(f"inotify_init1 失败：errno={self._errno()}")
+        self._ByWd: Dict[int, str] = {}
+        self._ByDir: Dict[str, int] = {}
+
+    @staticmethod
+    def _errno() -> int:
+        import ctypes
+        return ctypes.get_errno()
+
+    def SetDirs(self, dirs: Iterable[str]) -> None:
+        want = set(dirs)
+        for d in [d for d in self._ByDir if d not in want]:
+            self._libc.inotify_rm_watch(self._fd, self._ByDir.pop(d))
+        for d in want:
+            if d in self._ByDir:
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(d), _WATCH_MASK)
+            if wd < 0:
+                # 目录已不存在时跳过；其它错误（如超过 max_user_watches）交给调用方回退到轮询
+                if os.path.isdir(d):
+                    raise OSError(f"inotify_add_watch 失败：{d} errno={self._errno()}")
+                continue
+            self._ByWd[wd] = d
+            self._ByDir[d] = wd
+
+    def Poll(self, timeout: float) -> Set[str]:
+        changed: Set[str] = set()
+        try:
+            ready, _w, _x = select.select([self._fd], [], [], timeout)
+        except (OSError, ValueError):
+            return changed
+        if not ready:
+            return changed
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        off = 0
+        while off + _EVENT_HEAD.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT_HEAD.unpack_from(buf, off)
+            off += _EVENT_HEAD.size + length
+            if mask & _IN_Q_OVERFLOW:
+                return set(self._ByDir)  # 事件丢失：当作全部变化
+            d = self._ByWd.get(wd)
+            if d is None:
+                continue
+            changed.add(d)
+            if mask & _IN_IGNORED:
+                self._ByWd.pop(wd, None)
+                self._ByDir.pop(d, None)
+        return changed
+
+    def Close(self) -> None:
+        if self._fd >= 0:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = -1
+
+def MakeWatcher() -> DirWatcher:
+    """Linux 上优先 inotify，其它平台或初始化失败时使用 mtime 轮询。"""
+    try:
+        return InotifyWatcher()
+    except OSError:
+        return PollingWatcher()
+
+# ===================== 实时增量重扫 =====================
+def _watch_dirs(local_paths: Iterable[str], Root: str = "") -> Set[str]:
+    """
+    需要监视的目录：每个本地文件的父目录及其祖先，一直到 client 根目录（含）。
+    大小写纠正从 client 根开始逐级 listdir，其中任一目录下有增删/改名（包括最上层目录
+    自身改大小写，这体现在它父目录的列表里）都可能改变目标路径。
+    Root 为空或文件不在 Root 之下时，退到所有父目录公共前缀的上一级。
+    """
+    parents = {os.path.dirname(p) for p in local_paths if p}
+    if not parents:
+        return set()
+    root = os.path.normpath(Root).casefold() if Root else ""
+    try:
+        common = os.path.commonpath(list(parents))
+        top = (os.path.dirname(common) or common).casefold()
+    except ValueError:
+        top = ""  # 跨盘符：各自向上直到根
+    out: Set[str] = set()
+    for d in parents:
+        stop = root if root and _is_under(d, root) else top
+        while d and d not in out:
+            out.add(d)
+            if d.casefold() == stop:
+                break
+            up = os.path.dirname(d)
+            if up == d:
+                break
+            d = up
+    return out
+
+def _is_under(path: str, folded_dir: str) -> bool:
+    p = path.casefold()
+    return p.startswith(folded_dir) and (len(p) == len(folded_dir) or p[len(folded_dir)] in "/\\")
+
+class LiveRescan:
+    """
+    监视当前列表涉及的本地目录，目录变化时只对受影响的行重新做大小写纠正。
+      - 行以下标标识（与传入的 Depots 对齐）；
+      - Seed 为刚完成的刷新给出的 {depot: (where 结果, 纠正后本地路径)}（见 ScanBatch.Resolved），
+        其中的行直接沿用，不再 where/纠正；只有不在 Seed 中的行在启动时解析一次；
+      - 监视集合从各文件的父目录一直到 client 根目录（Root，缺省取 ctx.Info.ClientRoot）；
+      - 之后每次有目录变化，只重解析“本地路径位于变化目录之下”的行，
+        目标路径确实改变时调用 OnChanged([(行下标, 新目标), ...])（在后台线程中调用）；
+      - 纠正后的目录可能因改名而变化，每轮结束后按新结果更新监视集合；
+      - ctx 归本对象所有（调用方应传入 Clone()），后台线程退出时关闭。
+    """
+    def __init__(self, ctx: P4Context, Depots: List[str], Targets: List[str],
+                 Cache: Optional[ResolveCache] = None, Watcher: Optional[DirWatcher] = None,
+                 Interval: float = DEFAULT_WATCH_INTERVAL, FsWorkers: int = DEFAULT_FS_WORKERS,
+                 Seed: Optional[Dict[str, Tuple[tuple, str]]] = None, Root: str = ""):
+        self.Ctx = ctx
+        self.Cache = Cache
+        self.Root = Root or (ctx.Info.ClientRoot if ctx.Info is not None else "")
+        self._Seed = dict(Seed or {})
+        self.Interval = max(0.05, float(Interval))
+        self.FsWorkers = FsWorkers
+        self.Watcher = Watcher if Watcher is not None else MakeWatcher()
+        self._Depots = list(Depots)
+        self._Targets = list(Targets)
+        self._Resolved: List = []           # 与行对齐的 _where_stage 结果
+        self._Locals: List[str] = []        # 与行对齐的纠正后本地路径（未映射为 ""）
+        self._Stop = threading.Event()
+        self._Thread: Optional[threading.Thread] = None
+        self.Rescans = 0                    # 增量重扫次数
+        self.RowsRescanned = 0              # 累计重解析的行数
+
+    def Start(self, OnChanged: Callable[[List[Tuple[int, str]]], None]) -> None:
+        self._Thread = threading.Thread(target=self._run, args=(OnChanged,), daemon=True)
+        self._Thread.start()
+
+    def Stop(self) -> None:
+        """后台线程最多在一个 Interval 内退出；轮询模式下立即唤醒。"""
+        self._Stop.set()
+        if isinstance(self.Watcher, PollingWatcher):
+            self.Watcher.Close()
+
+    # —— 解析一组行，返回 {行: 新目标}，同时刷新 _Locals
+    def _resolve_rows(self, rows: List[int]) -> Dict[int, str]:
+        items = [self._Resolved[i] for i in rows]
+        locals_ = [w[2] for (_d, _f, w) in items if w]
+        cases = _resolve_local_cases(locals_, _make_dir_cache(None, self.Cache), self.FsWorkers)
+        _pairs, targets = _target_stage(items, cases, {})
+        out: Dict[int, str] = {}
+        for i, (_d, _f, w), dst in zip(rows, items, targets):
+            self._Locals[i] = cases.get(w[2], w[2]) if w else ""
+            out[i] = dst
+        return out
+
+    def _diff(self, fresh: Dict[int, str]) -> List[Tuple[int, str]]:
+        changed = [(i, dst) for (i, dst) in fresh.items() if dst != self._Targets[i]]
+        for i, dst in changed:
+            self._Targets[i] = dst
+        return changed
+
+    def _rewatch(self) -> None:
+        try:
+            self.Watcher.SetDirs(_watch_dirs((p for p in self._Locals if p), self.Root))
+        except OSError:
+            # inotify 监视数超限等：整体回退到轮询
+            self.Watcher.Close()
+            self.Watcher = PollingWatcher()
+            self.Watcher.SetDirs(_watch_dirs((p for p in self._Locals if p), self.Root))
+
+    def _run(self, on_changed: Callable[[List[Tuple[int, str]]], None]) -> None:
+        try:
+            seed = self._Seed
+            missing = [d for d in self._Depots if d not in seed]
+            fresh: Dict[str, tuple] = {}
+            if missing:
+                where = _p4_where_batch(self.Ctx, missing, self.Cache, _where_cache_key(self.Ctx, self.Cache))
+                fresh = dict(zip(missing, _where_stage([(d, "", "") for d in missing], where)[0]))
+            self._Resolved = [seed[d][0] if d in seed else fresh[d] for d in self._Depots]
+            self._Locals = [seed[d][1] if d in seed else "" for d in self._Depots]
+            rows = [i for (i, d) in enumerate(self._Depots) if d not in seed]
+            if rows:
+                changed = self._diff(self._resolve_rows(rows))
+                if changed and not self._Stop.is_set():
+                    on_changed(changed)
+            self._rewatch()
+
+            while not self._Stop.is_set():
+                dirs = self.Watcher.Poll(self.Interval)
+                if not dirs or self._Stop.is_set():
+                    continue
+                dirs |= self.Watcher.Poll(_SETTLE_SECONDS)  # 合并紧随其后的事件（批量改名）
+                folded = [d.casefold() for d in dirs]
+                rows = [i for (i, p) in enumerate(self._Locals) if p and any(_is_under(p, d) for d in folded)]
+                if not rows:
+                    continue
+                self.Rescans += 1
+                self.RowsRescanned += len(rows)
+                changed = self._diff(self._resolve_rows(rows))
+                self._rewatch()
+                if changed and not self._Stop.is_set():
+                    on_changed(changed)
+        finally:
+            self.Watcher.Close()
+            self.Ctx.Close()
+            if self.Cache is not None:
+                self.Cache.Flush()
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import re
+import bisect
 import tkinter as Tk
+import tkinter.font as TkFont
 from tkinter import ttk, messagebox
 
+from Core import ALL_CHANGELISTS, ChangeSortKey
+import Trace
+
 def _basename(path: str) -> str:
     if not path: return ""
     p = path.replace("\\", "/")
@@ -15,8 +20,18 @@ def _natural_key(s: str):
     parts = re.split(r'(\d+)', s.casefold())
     return [int(p) if p.isdigit() else p for p in parts]
 
+def _fmt_eta(seconds) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds + 0.5)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
 # ------------------ 进度弹窗 ------------------
 class ProgressDialog(Tk.Toplevel):
+    FRAME_MS = 33  # 轮询进度通道的帧间隔（约 30 fps）
+
     def __init__(self, master, total: int, stop_event=None):
         super().__init__(master)
         self.title("执行中…")
@@ -28,6 +43,8 @@ class ProgressDialog(Tk.Toplevel):
         self._completed = False
         self._on_closed = None
         self._stop_event = stop_event  # threading.Event
+        self._channel = None           # Core.ProgressChannel
+        self._seen_version = -1
 
         pad = 10
         box = ttk.Frame(self, padding=pad); box.pack(fill="both", expand=True)
@@ -48,6 +65,9 @@ class ProgressDialog(Tk.Toplevel):
         self.StateVar = Tk.StringVar(value=f"执行中… 0/{self._total}")
         ttk.Label(box, textvariable=self.StateVar).pack(anchor="w", pady=(6, 0))
 
+        self.RateVar = Tk.StringVar(value="")
+        ttk.Label(box, textvariable=self.RateVar, foreground="#444").pack(anchor="w", pady=(2, 0))
+
         self.MsgVar = Tk.StringVar(value="")
         ttk.Label(box, textvariable=self.MsgVar, foreground="#444").pack(anchor="w", pady=(2, 0))
 
@@ -70,6 +90,25 @@ class ProgressDialog(Tk.Toplevel):
     def SetOnClosed(self, fn):
         self._on_closed = fn
 
+    def AttachChannel(self, channel):
+        """按固定帧率轮询进度通道，只渲染最新状态（工作线程不再逐条投递 UI 回调）。"""
+        self._channel = channel
+        self._poll()
+
+    def _poll(self):
+        if self._completed or self._channel is None:
+            return
+        st = self._channel.Snapshot()
+        if st.Version != self._seen_version:
+            self._seen_version = st.Version
+            self.Update(st.Done, st.Ok, st.Fail, st.Skip, st.Msg)
+        # 速率/ETA 即使没有新进度也随时间变化
+        if st.Rate > 0:
+            self.RateVar.set(f"{st.Rate:.1f} 项/秒   剩余 {_fmt_eta(st.Eta)}")
+        if self._channel.Closed:
+            return
+        self.after(self.FRAME_MS, self._poll)
+
     def Update(self, done: int, ok: int, fail: int, skip: int, msg: str = ""):
         done = max(0, min(int(done), self._total))
         self.Bar["value"] = done
@@ -79,13 +118,16 @@ class ProgressDialog(Tk.Toplevel):
         state = "已完成" if self._completed else "执行中…"
         self.StateVar.set(f"{state} {done}/{self._total}")
         self.MsgVar.set(msg or "")
-        self.update_idletasks()
 
     def MarkDone(self, ok: int, fail: int, skip: int):
         self._completed = True
         self.Bar["value"] = self.Bar["maximum"]
         self.ActionBtn.configure(text="关闭")
         self.Update(self._total, ok, fail, skip, "")
+        if self._channel is not None:
+            st = self._channel.Snapshot()
+            if st.Done and st.Rate > 0:
+                self.RateVar.set(f"平均 {st.Rate:.1f} 项/秒")
 
     def _on_action(self):
         if not self._completed:
@@ -107,10 +149,122 @@ class ProgressDialog(Tk.Toplevel):
             except Exception:
                 pass
 
+# ------------------ 列表行槽位 ------------------
+class _RowSlot:
+    """
+    虚拟列表中的一行图元（背景、复选框、两行文字、分隔线）。
+    槽位数只与视口高度有关，滚动时改坐标/文字复用，不新建控件。
+    """
+    def __init__(self, canvas, frame):
+        self._C = canvas
+        self._F = frame
+        c, f = canvas, frame
+        self.Bg   = c.create_rectangle(0, 0, 0, 0, fill=f.NORM_BG, outline="")
+        self.Box  = c.create_rectangle(0, 0, 0, 0, fill="#ffffff", outline=f.COL_BOX)
+        self.Mark = c.create_text(0, 0, text="✔", anchor="center", font=f._Font, fill=f.COL_TEXT)
+        self.Src  = c.create_text(0, 0, text="", anchor="nw", font=f._Font, fill=f.COL_TEXT)
+        self.Dst  = c.create_text(0, 0, text="", anchor="nw", font=f._Font)
+        self.Sep  = c.create_line(0, 0, 0, 0, fill=f.SEP_BG)
+        self._Items = (self.Bg, self.Box, self.Mark, self.Src, self.Dst, self.Sep)
+        self._Checked = None
+        self._BgColor = f.NORM_BG
+
+    def Place(self, y, width):
+        c, f = self._C, self._F
+        pad, box, line = f.ROW_PAD, f.BOX_SIZE, f._LineH
+        body = f._RowH - 1
+        c.coords(self.Bg, 0, y, width, y + body)
+        c.coords(self.Box, pad, y + pad + 1, pad + box, y + pad + 1 + box)
+        c.coords(self.Mark, pad + box / 2, y + pad + 1 + box / 2)
+        text_x = pad * 2 + box
+        c.coords(self.Src, text_x, y + pad)
+        c.coords(self.Dst, text_x, y + pad + line)
+        c.coords(self.Sep, 0, y + body, width, y + body)
+        for it in (self.Bg, self.Box, self.Src, self.Dst, self.Sep):
+            c.itemconfigure(it, state="normal")
+        c.itemconfigure(self.Mark, state="normal" if self._Checked else "hidden")
+
+    def SetText(self, src_text, dst_text, dst_color):
+        self._C.itemconfigure(self.Src, text=src_text)
+        self._C.itemconfigure(self.Dst, text=dst_text, fill=dst_color)
+
+    def SetChecked(self, on: bool):
+        self._Checked = bool(on)
+        self._C.itemconfigure(self.Mark, state="normal" if on else "hidden")
+
+    def SetBackground(self, color):
+        if color != self._BgColor:
+            self._BgColor = color
+            self._C.itemconfigure(self.Bg, fill=color)
+
+    def Hide(self):
+        for it in self._Items:
+            self._C.itemconfigure(it, state="hidden")
+
+# ------------------ 勾选状态 ------------------
+class _CheckState:
+    """
+    与全量行对齐的勾选状态，全选/全不选为 O(1)：
+      - 每行记录 (值, 写入序号)；
+      - 另记两条批量记录：不过滤时的全选、“仅显示有变化”时的全选（只作用于有变化的行）；
+      - 读取时取对该行适用、序号最新的一条。
+    行的“是否有变化”将要改变前须调用 Pin()，把当前状态固化到该行。
+    """
+    def __init__(self, is_changed):
+        self._IsChanged = is_changed
+        self._Val = []
+        self._Seq = []
+        self._Tick = 0
+        self._All = (-1, True)       # 最近一次不过滤时的批量 (序号, 值)
+        self._Changed = (-1, True)   # 最近一次“仅显示有变化”时的批量 (序号, 值)
+
+    def __len__(self):
+        return len(self._Val)
+
+    def __getitem__(self, idx):
+        seq, val = self._Seq[idx], self._Val[idx]
+        if self._All[0] > seq:
+            seq, val = self._All
+        if self._Changed[0] > seq and self._IsChanged(idx):
+            val = self._Changed[1]
+        return val
+
+    def __setitem__(self, idx, on):
+        self._Tick += 1
+        self._Val[idx] = bool(on)
+        self._Seq[idx] = self._Tick
+
+    def Extend(self, n, on=True):
+        # 新行晚于所有批量记录，按默认值生效
+        self._Tick += 1
+        self._Val.extend([bool(on)] * n)
+        self._Seq.extend([self._Tick] * n)
+
+    def SetAll(self, on, only_changed):
+        self._Tick += 1
+        if only_changed:
+            self._Changed = (self._Tick, bool(on))
+        else:
+            self._All = (self._Tick, bool(on))
+
+    def Pin(self, idx):
+        if idx < len(self._Val):
+            self[idx] = self[idx]
+
+    def PinAll(self, n):
+        # 行内容整体替换前调用：只保留当前的 n 行（超出部分属于更早的列表，已无对应行）；O(n)
+        del self._Val[n:], self._Seq[n:]
+        for i in range(len(self._Val)):
+            self._Val[i] = self[i]
+        self._Tick += 1
+        self._Seq = [self._Tick] * len(self._Val)
+
 # ------------------ 主界面 ------------------
 class MainFrame(ttk.Frame):
     """
     单列列表（两行：更改前/更改后）+ 多选（仅高亮）+ 勾选（批量应用）
+    选择“全部待提交 changelist”时按 changelist 分组排序，行首标注所属 changelist。
+    列表为虚拟化 Canvas：只为视口内的行绘制图元，滚动时复用，十万行也不卡。
     顶部：Changelist 下拉 + 过滤 + 颜色说明 + 操作说明
     颜色规则：
       - 灰：更改前后完全一致
@@ -129,12 +283,23 @@ class MainFrame(ttk.Frame):
     COL_GRAY  = "#888888"   # 一致（置灰）
     COL_GREEN = "#2a6f2a"   # 自动修正（绿色）
     COL_RED   = "#cc3333"   # 手动修改（红色）
+    COL_TEXT  = "#000000"
+    COL_BOX   = "#555555"   # 复选框边框
+
+    _CL_MORE  = "__more__"  # 下拉中“加载更多”项的 id
+
+    # 行布局
+    ROW_PAD   = 6           # 行内上下/左右留白
+    BOX_SIZE  = 13          # 复选框边长
 
     def __init__(self, master):
         super().__init__(master, padding=8)
         self.OnListChangelists = None
+        self.OnLoadMoreChangelists = None
         self.OnRefresh = None
         self.OnApply   = None
+        self.OnCancelScan = None
+        self.OnWatchToggle = None
 
         # 复选框样式
         self._style = ttk.Style()
@@ -162,6 +327,12 @@ class MainFrame(ttk.Frame):
                         variable=self.OnlyChangedVar,
                         command=self._apply_filter).pack(side="left", padx=(12,0))
 
+        # —— 跟踪本地改动：目录有增删/改名时只重新纠正受影响的行
+        self.WatchVar = Tk.BooleanVar(value=False)
+        ttk.Checkbutton(top, text="跟踪本地改动",
+                        variable=self.WatchVar,
+                        command=self._on_watch_toggle).pack(side="left", padx=(12,0))
+
         # ===== 列表上方：全选/统计 + 颜色说明 + 操作说明 =====
         header = ttk.Frame(self); header.pack(fill="x", pady=(8,4))
         self.SelectAllVar = Tk.BooleanVar(value=False)
@@ -177,6 +348,12 @@ class MainFrame(ttk.Frame):
         self.CheckedStatLbl = ttk.Label(header, textvariable=self.CheckedStatVar)
         self.CheckedStatLbl.pack(side="right")
 
+        # —— 后台扫描状态：实时计数 + 取消
+        self.CancelScanBtn = ttk.Button(header, text="取消扫描", command=self._on_cancel_scan)
+        self.ScanVar = Tk.StringVar(value="")
+        self.ScanLbl = ttk.Label(header, textvariable=self.ScanVar, foreground="#444")
+        self.ScanLbl.pack(side="right", padx=(0, 12))
+
         # —— 颜色说明行
         legend = ttk.Frame(self); legend.pack(fill="x")
         def chip(parent, color, text):
@@ -194,16 +371,23 @@ class MainFrame(ttk.Frame):
         # ===== 中部：列表（滚动） =====
         mid = ttk.Frame(self); mid.pack(fill="both", expand=True)
 
-        self.Canvas = Tk.Canvas(mid, highlightthickness=0, bg=self.CANVAS_BG)
-        vbar = ttk.Scrollbar(mid, orient="vertical", command=self.Canvas.yview)
-        self.Canvas.configure(yscrollcommand=vbar.set)
+        self._Font  = TkFont.nametofont("TkDefaultFont")
+        self._LineH = self._Font.metrics("linespace")
+        self._RowH  = self._LineH * 2 + self.ROW_PAD * 2 + 1   # 两行文字 + 留白 + 1px 分隔线
+
+        self.Canvas = Tk.Canvas(mid, highlightthickness=0, bg=self.CANVAS_BG,
+                                yscrollincrement=self._RowH)
+        self._VBar = ttk.Scrollbar(mid, orient="vertical", command=self.Canvas.yview)
+        self.Canvas.configure(yscrollcommand=self._on_yscroll)
         self.Canvas.pack(side="left", fill="both", expand=True)
-        vbar.pack(side="left", fill="y")
+        self._VBar.pack(side="left", fill="y")
 
-        self.ListArea = Tk.Frame(self.Canvas, bg=self.NORM_BG)
-        self._canvas_item = self.Canvas.create_window((0, 0), window=self.ListArea, anchor="nw")
-        self.ListArea.bind("<Configure>", lambda e: self.Canvas.configure(scrollregion=self.Canvas.bbox("all")))
         self.Canvas.bind("<Configure>", self._on_canvas_resize)
+        self.Canvas.bind("<Button-1>", self._on_canvas_click)
+        self.Canvas.bind("<Double-Button-1>", self._on_canvas_double)
+        self.Canvas.bind("<MouseWheel>", self._on_wheel)
+        self.Canvas.bind("<Button-4>", lambda e: self.Canvas.yview_scroll(-3, "units"))
+        self.Canvas.bind("<Button-5>", lambda e: self.Canvas.yview_scroll(3, "units"))
 
         # ===== 底部：应用按钮 =====
         btnBox = ttk.Frame(self); btnBox.pack(fill="x", pady=(8,0))
@@ -214,11 +398,19 @@ class MainFrame(ttk.Frame):
         self._Pairs        = []  # [(src, dstCand), ...]
         self._Targets      = []  # 当前“更改后”（用户可改）
         self._AutoTargets  = []  # 自动修正值（初始化时记录，用于与当前值比对）
+        self._Changes      = []  # 与全量对齐的所属 changelist（单个 changelist 模式下为 ""）
+        self._Keys         = []  # 与全量对齐的排序键（加入列表时按自动值计算，编辑后不变）
         self._Order        = []  # 排序后的全量索引
+        self._OrderKeys    = []  # 与 _Order 对齐的排序键（二分插入用）
         self._ViewIdx      = []  # 可见 -> 全量
-        self._SelVars      = []  # 与全量对齐的 BooleanVar（勾选）
-        self._Rows         = {}  # {full_idx: rowFrame}
-        self._ChkRefs      = {}  # {full_idx: ttk.Checkbutton}
+        self._ViewKeys     = []  # 与 _ViewIdx 对齐的排序键
+        self._Scanning     = False
+        self._ScanTotal    = 0
+        self._Checked      = _CheckState(lambda i: self._passes_filter(i, True))  # 与全量对齐的勾选状态
+        self._CheckedCount = 0   # 可见行中已勾选的数量（增量维护）
+        self._Slots        = []  # 复用的行图元槽位 [_RowSlot]
+        self._SlotByIdx    = {}  # {full_idx: _RowSlot}（仅视口内的行）
+        self._Drawn        = None  # 上次绘制的 (first, last, width)，相同则跳过
         self._SelectedSet  = set()
         self._LastAnchor   = None
         self._BulkChecking = False
@@ -227,53 +419,172 @@ class MainFrame(ttk.Frame):
         # 下拉内容
         self._CLItems = []
         self._CLLabelToId = {}
-        self._set_cl_items([("default", "default (未提交)")])
-        self.CLCombo.set("default (未提交)")
+        self._CLCurrent = "default"   # 当前选中的 changelist id（标签刷新后据此重新显示）
+        self.SetChangelistItems([])
 
     # ---------- 回调绑定 ----------
     def SetOnListChangelists(self, fn): self.OnListChangelists = fn
+    def SetOnLoadMoreChangelists(self, fn): self.OnLoadMoreChangelists = fn
     def SetOnRefresh(self, fn):         self.OnRefresh = fn
     def SetOnApply(self, fn):           self.OnApply = fn
+    def SetOnCancelScan(self, fn):      self.OnCancelScan = fn
+    def SetOnWatchToggle(self, fn):     self.OnWatchToggle = fn
 
     # ---------- 对外：渲染 ----------
-    def RenderPairs(self, pairs, targets):
+    def RenderPairs(self, pairs, targets, changes=None):
         """
         pairs: [(src_depot, _dstcand_ignored), ...]
         targets: [dst_depot_by_core, ...]  —— 这是“自动修正值（以本地大小写为准）”
+        changes: 可选，与 pairs 对齐的 changelist（全部 changelist 模式），用于分组
         """
+        t0 = Trace.Now() if Trace.Enabled else 0.0
+        self._Checked.PinAll(len(self._Pairs))  # 行内容整体替换，先固化勾选状态
         self._Pairs        = list(pairs)
         self._Targets      = list(targets)      # 当前显示值（可编辑）
         self._AutoTargets  = list(targets)      # 记录自动修正值，用于颜色判断
+        self._Changes      = list(changes) if changes else [""] * len(self._Pairs)
 
-        # 初始化/扩展勾选变量（默认勾选）
         n = len(self._Pairs)
-        if len(self._SelVars) < n:
-            for _ in range(n - len(self._SelVars)):
-                self._SelVars.append(Tk.BooleanVar(value=True))
+        self._ensure_checked()
 
         # 自动排序：优先更改后文件名，其次更改后完整路径
-        keys = []
-        for i, (src, _dstcand) in enumerate(self._Pairs):
-            dst  = self._Targets[i] if i < len(self._Targets) else ""
-            name = _basename(dst) or _basename(src)
-            keys.append((_natural_key(name), _natural_key(dst or ""), i))
-        keys.sort()
-        self._Order = [i for (_k1, _k2, i) in keys]
+        self._Keys = [self._sort_key(i) for i in range(n)]
+        self._OrderKeys = sorted(self._Keys)
+        self._Order = [k[-1] for k in self._OrderKeys]
 
         self._refresh_view()
+        if t0:
+            Trace.Record("ui", "render_pairs", t0, Trace.Now(), rows=n)
+
+    def AppendPairs(self, pairs, targets, changes=None):
+        """
+        流式追加一批结果（后台扫描逐批调用）：按排序键二分插入，
+        只重绘视口，已有的行不重建。
+        """
+        t0 = Trace.Now() if Trace.Enabled else 0.0
+        base = len(self._Pairs)
+        self._Pairs.extend(pairs)
+        self._Targets.extend(targets)
+        self._AutoTargets.extend(targets)
+        self._Changes.extend(changes if changes else [""] * len(pairs))
+        self._ensure_checked()
+
+        only_changed = self.OnlyChangedVar.get()
+        for i in range(base, len(self._Pairs)):
+            key = self._sort_key(i)
+            self._Keys.append(key)
+            pos = bisect.bisect(self._OrderKeys, key)
+            self._OrderKeys.insert(pos, key)
+            self._Order.insert(pos, i)
+
+            if not self._passes_filter(i, only_changed):
+                continue
+            vpos = bisect.bisect(self._ViewKeys, key)
+            self._ViewKeys.insert(vpos, key)
+            self._ViewIdx.insert(vpos, i)
+            self._CheckedCount += self._Checked[i]
+
+        self._layout_changed()
+        self._update_checked_stat()
+        self._sync_select_all_state()
+        if self._Scanning:
+            self._show_scan_state()
+        if t0:
+            Trace.Record("ui", "append_pairs", t0, Trace.Now(), rows=len(pairs))
+
+    # ---------- 后台扫描状态 ----------
+    def BeginScan(self):
+        """开始一次新的后台扫描：清空列表，显示计数与“取消扫描”。"""
+        self.RenderPairs([], [])
+        self._Scanning = True
+        self._ScanTotal = 0
+        self.ApplyBtn.configure(state="disabled")
+        self.CancelScanBtn.pack(side="right", padx=(0, 6), before=self.ScanLbl)
+        self._show_scan_state()
+
+    def SetScanTotal(self, total: int):
+        self._ScanTotal = max(0, int(total or 0))
+        if self._Scanning:
+            self._show_scan_state()
+
+    def EndScan(self, cancelled: bool = False):
+        self._Scanning = False
+        self.CancelScanBtn.pack_forget()
+        self.ApplyBtn.configure(state="normal")
+        n = len(self._Pairs)
+        if cancelled:
+            self.ScanVar.set(f"已取消（已载入 {n} / {self._ScanTotal}）")
+        else:
+            self.ScanVar.set(f"共 {n} 个文件")
+
+    def IsScanning(self) -> bool:
+        return self._Scanning
+
+    # ---------- 跟踪本地改动 ----------
+    def GetAutoRows(self):
+        """(depot 列表, 自动修正值列表)，与行下标对齐；供实时重扫建立监视。"""
+        return [p[0] for p in self._Pairs], list(self._AutoTargets)
+
+    def UpdateAutoTargets(self, updates):
+        """
+        实时重扫送回的 [(行下标, 新自动值), ...]：
+          - 用户未手动改过的行（当前值 == 旧自动值）随之更新；
+          - 手动改过的行保留用户的值，只更新自动值（颜色按规则重新判断）。
+        只增量更新这些行，排序位置不变。
+        """
+        n = 0
+        for idx, dst in updates:
+            if idx >= len(self._Pairs) or self._AutoTargets[idx] == dst:
+                continue
+            if self._Targets[idx] == self._AutoTargets[idx]:
+                self._Checked.Pin(idx)
+                self._Targets[idx] = dst
+            self._AutoTargets[idx] = dst
+            self._update_row(idx)
+            n += 1
+        if n and not self._Scanning:
+            self.ScanVar.set(f"共 {len(self._Pairs)} 个文件（本地改动，已更新 {n} 行）")
+
+    def _on_watch_toggle(self):
+        if callable(self.OnWatchToggle):
+            self.OnWatchToggle(self.WatchVar.get())
+
+    def _show_scan_state(self):
+        total = f" / {self._ScanTotal}" if self._ScanTotal else ""
+        self.ScanVar.set(f"扫描中… {len(self._Pairs)}{total}")
+
+    def _on_cancel_scan(self):
+        if callable(self.OnCancelScan):
+            self.OnCancelScan()
 
     def ShowResult(self, ok_count, fail_count, logs_tail):
         if logs_tail:
             messagebox.showinfo("日志(末尾)", "\n".join(logs_tail[-20:]))
 
+    def _ensure_checked(self):
+        # 初始化/扩展勾选状态（默认勾选）
+        n = len(self._Pairs)
+        if len(self._Checked) < n:
+            self._Checked.Extend(n - len(self._Checked))
+
+    def _sort_key(self, i):
+        src = self._Pairs[i][0]
+        dst = self._Targets[i] if i < len(self._Targets) else ""
+        name = _basename(dst) or _basename(src)
+        cl = self._Changes[i] if i < len(self._Changes) else ""
+        group = ChangeSortKey(cl) if cl else (0, 0, "")
+        return (group, _natural_key(name), _natural_key(dst or ""), i)
+
     # ---------- 进度弹窗 API（给 Main 调用） ----------
-    def OpenProgress(self, total: int, stop_event, on_closed=None):
+    def OpenProgress(self, total: int, stop_event, on_closed=None, channel=None):
         if self._ProgDlg:
             try: self._ProgDlg.destroy()
             except Exception: pass
         self._ProgDlg = ProgressDialog(self.winfo_toplevel(), total, stop_event=stop_event)
         if on_closed:
             self._ProgDlg.SetOnClosed(on_closed)
+        if channel is not None:
+            self._ProgDlg.AttachChannel(channel)
 
     def UpdateProgress(self, done: int, ok: int, fail: int, skip: int, msg: str = ""):
         if self._ProgDlg:
@@ -288,32 +599,110 @@ class MainFrame(ttk.Frame):
         self._CLItems = list(items)
         self._CLLabelToId = {label: id_ for (id_, label) in self._CLItems}
         self.CLCombo["values"] = [label for (_id, label) in self._CLItems]
+        # 标签可能带文件数而变化：按 id 重新显示当前选择
+        for id_, label in self._CLItems:
+            if id_ == self._CLCurrent:
+                self.CLCombo.set(label)
+                break
 
     def _refresh_changelist_options(self):
+        """
+        下拉展开前调用：OnListChangelists 返回 (items, has_more)，应只取缓存（不访问服务器），
+        以免卡住界面；新结果由后台刷新后经 SetChangelistItems 送回。
+        """
         if not callable(self.OnListChangelists): return
         try:
-            items = self.OnListChangelists() or []
+            items, has_more = self.OnListChangelists()
         except Exception:
-            items = []
+            return
+        self.SetChangelistItems(items, has_more)
+
+    def SetChangelistItems(self, items, has_more: bool = False):
+        """
+        填充下拉项（启动预取或后台刷新的结果）；default 总是排在最前，其后是“全部”。
+        has_more 为 True 时在末尾追加“加载更多”。
+        """
+        items = [i for i in (items or []) if i[0] != ALL_CHANGELISTS]
         if not any(i[0] == "default" for i in items):
             items = [("default", "default (未提交)")] + items
         else:
             items = [i for i in items if i[0] == "default"] + [i for i in items if i[0] != "default"]
+        items.insert(1, (ALL_CHANGELISTS, "全部待提交 changelist（按 changelist 分组）"))
+        if has_more:
+            items.append((self._CL_MORE, "…加载更多 changelist"))
         self._set_cl_items(items)
 
     def _on_cl_selected(self, _evt=None):
-        if not callable(self.OnRefresh):
-            messagebox.showerror("错误", "未绑定 OnRefresh 回调。"); return
         label = self.CLVar.get()
         cl_id = self._CLLabelToId.get(label, "default")
+        if cl_id == self._CL_MORE:
+            self._set_cl_items(self._CLItems)  # 恢复显示当前选择
+            if callable(self.OnLoadMoreChangelists):
+                self.OnLoadMoreChangelists()
+            return
+        if not callable(self.OnRefresh):
+            messagebox.showerror("错误", "未绑定 OnRefresh 回调。"); return
+        self._CLCurrent = cl_id
         self.OnRefresh(cl_id)
 
     # ---------- 视图 ----------
-    def _on_canvas_resize(self, evt):
-        self.Canvas.itemconfig(self._canvas_item, width=evt.width)
+    def _on_canvas_resize(self, _evt=None):
+        self._layout_changed()
+
+    def _on_yscroll(self, lo, hi):
+        self._VBar.set(lo, hi)
+        self._render_viewport()
+
+    def _on_wheel(self, evt):
+        step = -int(evt.delta / 120) if abs(evt.delta) >= 120 else (-1 if evt.delta > 0 else 1)
+        self.Canvas.yview_scroll(step * 3, "units")
 
     def _apply_filter(self):
-        self._refresh_view()
+        """过滤切换：只增删受影响的行，保留选择，并尽量让顶部那一行停在原处。"""
+        only_changed = self.OnlyChangedVar.get()
+        top_key = self._top_visible_key()
+
+        if only_changed:
+            keep = [p for (p, i) in enumerate(self._ViewIdx) if self._passes_filter(i, True)]
+            removed = len(self._ViewIdx) - len(keep)
+            if not removed:
+                return
+            dropped = set(self._ViewIdx) - {self._ViewIdx[p] for p in keep}
+            self._ViewIdx  = [self._ViewIdx[p] for p in keep]
+            self._ViewKeys = [self._ViewKeys[p] for p in keep]
+            self._CheckedCount -= sum(self._Checked[i] for i in dropped)
+            self._SelectedSet -= dropped
+            if self._LastAnchor in dropped:
+                self._LastAnchor = None
+        else:
+            if len(self._ViewIdx) == len(self._Order):
+                return
+            self._ViewIdx  = list(self._Order)
+            self._ViewKeys = list(self._OrderKeys)
+            self._recount_checked()
+
+        self._layout_changed()
+        if top_key is not None:
+            pos = bisect.bisect_left(self._ViewKeys, top_key)
+            self._scroll_to_pos(pos)
+        self._update_checked_stat()
+        self._sync_select_all_state()
+
+    def _passes_filter(self, idx, only_changed: bool) -> bool:
+        if not only_changed:
+            return True
+        src = self._Pairs[idx][0]
+        dst = self._Targets[idx] if idx < len(self._Targets) else ""
+        return bool(dst) and dst != src
+
+    def _top_visible_key(self):
+        pos = int(max(0.0, self.Canvas.canvasy(0)) // self._RowH)
+        return self._ViewKeys[pos] if pos < len(self._ViewKeys) else None
+
+    def _scroll_to_pos(self, pos):
+        n = len(self._ViewIdx)
+        if n:
+            self.Canvas.yview_moveto(min(pos, n) / n)
 
     # —— 颜色判定
     def _color_for(self, idx):
@@ -327,59 +716,124 @@ class MainFrame(ttk.Frame):
         return self.COL_RED        # 与自动不一致 -> 红
 
     def _refresh_view(self):
-        # 关键修复：销毁 ListArea 中的**所有**子控件（包括分隔线），
-        # 避免多次刷新后残留的 sep 堆积成一块灰色区域
-        for w in list(self.ListArea.winfo_children()):
-            try: w.destroy()
-            except Exception: pass
-
-        self._Rows.clear()
-        self._ChkRefs.clear()
+        # 只重算可见索引；图元由 _render_viewport 按视口复用
         self._SelectedSet.clear()
         self._LastAnchor = None
         self._ViewIdx = []
+        self._ViewKeys = []
 
         only_changed = self.OnlyChangedVar.get()
-        for i in self._Order:
-            src, _dstcand = self._Pairs[i]
-            dst = self._Targets[i] if i < len(self._Targets) else ""
-            if only_changed and (not dst or dst == src):
+        for pos, i in enumerate(self._Order):
+            if not self._passes_filter(i, only_changed):
                 continue
             self._ViewIdx.append(i)
-            self._create_row(i, src, dst)
+            self._ViewKeys.append(self._OrderKeys[pos])
 
+        self._recount_checked()
+        self._layout_changed()
         self._update_checked_stat()
         self._sync_select_all_state()
 
-    def _create_row(self, idx, src, dst):
-        row = Tk.Frame(self.ListArea, bg=self.NORM_BG, padx=6, pady=6)
-        row.pack(fill="x", expand=True)
-
-        chk = ttk.Checkbutton(
-            row, variable=self._SelVars[idx],
-            command=lambda i=idx: self._on_check_toggle(i),
-            style="Row.TCheckbutton"
-        )
-        chk.grid(row=0, column=0, rowspan=2, padx=(0,6), sticky="n")
-        self._ChkRefs[idx] = chk
-
-        t1 = Tk.Label(row, text=f"更改前：{src}", anchor="w", bg=self.NORM_BG)
-        color = self._color_for(idx)
-        t2 = Tk.Label(row, text=f"更改后：{dst}", anchor="w", bg=self.NORM_BG, fg=color)
-        t1.grid(row=0, column=1, sticky="w")
-        t2.grid(row=1, column=1, sticky="w")
+    # —— 虚拟化绘制
+    def _layout_changed(self):
+        """可见行数或宽度变化：更新滚动区域并强制重绘视口。"""
+        w = max(1, self.Canvas.winfo_width())
+        h = len(self._ViewIdx) * self._RowH
+        self.Canvas.configure(scrollregion=(0, 0, w, h))
+        self._Drawn = None
+        self._render_viewport()
+
+    def _render_viewport(self):
+        n = len(self._ViewIdx)
+        w = max(1, self.Canvas.winfo_width())
+        top = max(0.0, self.Canvas.canvasy(0))
+        first = min(n, int(top // self._RowH))
+        last  = min(n, int((top + self.Canvas.winfo_height()) // self._RowH) + 1)
+        if self._Drawn == (first, last, w):
+            return
+        self._Drawn = (first, last, w)
+        t0 = Trace.Now() if Trace.Enabled else 0.0
+
+        while len(self._Slots) < last - first:
+            self._Slots.append(_RowSlot(self.Canvas, self))
+        self._SlotByIdx = {}
+        for k, slot in enumerate(self._Slots):
+            pos = first + k
+            if pos < last:
+                idx = self._ViewIdx[pos]
+                self._SlotByIdx[idx] = slot
+                self._draw_slot(slot, pos, idx, w)
+            else:
+                slot.Hide()
+        if t0:
+            Trace.Record("ui", "render_viewport", t0, Trace.Now(), rows=last - first)
+
+    def _draw_slot(self, slot, pos, idx, width):
+        y = pos * self._RowH
+        slot.Place(y, width)
+        cl = self._Changes[idx] if idx < len(self._Changes) else ""
+        tag = f"[{cl}] " if cl else ""
+        slot.SetText(f"{tag}更改前：{self._Pairs[idx][0]}",
+                     f"更改后：{self._Targets[idx]}", self._color_for(idx))
+        slot.SetChecked(self._Checked[idx])
+        slot.SetBackground(self.HI_BG if idx in self._SelectedSet else self.NORM_BG)
+
+    def _update_row(self, idx):
+        """
+        单行内容变化后的增量更新：
+          - 仍可见：只重绘这一行（若在视口内）；
+          - 按过滤条件变为不可见/可见：只从可见序列中移除/插入这一行。
+        """
+        key = self._Keys[idx]
+        vpos = bisect.bisect_left(self._ViewKeys, key)
+        shown = vpos < len(self._ViewKeys) and self._ViewIdx[vpos] == idx
+        want = self._passes_filter(idx, self.OnlyChangedVar.get())
+
+        if shown and want:
+            slot = self._SlotByIdx.get(idx)
+            if slot:
+                self._draw_slot(slot, vpos, idx, max(1, self.Canvas.winfo_width()))
+            return
+        if shown:
+            del self._ViewKeys[vpos]
+            del self._ViewIdx[vpos]
+            self._CheckedCount -= self._Checked[idx]
+            self._SelectedSet.discard(idx)
+            if self._LastAnchor == idx:
+                self._LastAnchor = None
+        elif want:
+            self._ViewKeys.insert(vpos, key)
+            self._ViewIdx.insert(vpos, idx)
+            self._CheckedCount += self._Checked[idx]
+        else:
+            return
 
-        # 单击：高亮；双击：整行编辑
-        for w in (row, t1, t2):
-            w.bind("<Button-1>",        lambda e, i=idx: self._on_row_select(i, e))
-            w.bind("<Double-Button-1>", lambda e, i=idx: self._edit_target(i))
-        # 复选框保持点击切换，不绑定双击
+        self._layout_changed()
+        self._update_checked_stat()
+        self._sync_select_all_state()
 
-        # 分隔线（1px）
-        sep = Tk.Frame(self.ListArea, height=1, bg=self.SEP_BG, bd=0, highlightthickness=0)
-        sep.pack(fill="x")
+    def _hit_test(self, evt):
+        """事件坐标 -> (全量索引, 是否点在复选框上)；未命中返回 (None, False)。"""
+        pos = int(self.Canvas.canvasy(evt.y) // self._RowH)
+        if pos < 0 or pos >= len(self._ViewIdx):
+            return None, False
+        on_box = self.Canvas.canvasx(evt.x) < self.ROW_PAD * 2 + self.BOX_SIZE
+        return self._ViewIdx[pos], on_box
+
+    def _on_canvas_click(self, evt):
+        idx, on_box = self._hit_test(evt)
+        if idx is None:
+            return
+        if on_box:
+            self._on_check_toggle(idx, not self._Checked[idx])
+        else:
+            self._on_row_select(idx, evt)
 
-        self._Rows[idx] = row
+    def _on_canvas_double(self, evt):
+        idx, on_box = self._hit_test(evt)
+        # 复选框保持点击切换，不响应双击
+        if idx is not None and not on_box:
+            self._edit_target(idx)
 
     def _edit_target(self, idx):
         old = self._Targets[idx]
@@ -389,9 +843,10 @@ class MainFrame(ttk.Frame):
         Tk.Entry(win, textvariable=v, width=90).pack(padx=10, pady=10)
 
         def ok():
+            self._Checked.Pin(idx)
             self._Targets[idx] = v.get().strip()
             win.destroy()
-            self._refresh_view()  # 重新渲染，颜色按规则更新
+            self._update_row(idx)  # 只更新这一行，颜色按规则更新
         ttk.Button(win, text="确定", command=ok).pack(pady=(0,10))
 
         win.transient(self.winfo_toplevel())
@@ -432,10 +887,13 @@ class MainFrame(ttk.Frame):
         self._LastAnchor = idx
 
     def _view_pos(self, full_idx):
-        try:
-            return self._ViewIdx.index(full_idx)
-        except ValueError:
+        # 可见序列按排序键有序：二分定位，O(log n)
+        if full_idx >= len(self._Keys):
             return None
+        pos = bisect.bisect_left(self._ViewKeys, self._Keys[full_idx])
+        if pos < len(self._ViewIdx) and self._ViewIdx[pos] == full_idx:
+            return pos
+        return None
 
     def _clear_selection(self):
         for i in list(self._SelectedSet):
@@ -448,22 +906,12 @@ class MainFrame(ttk.Frame):
         self._paint_selected(idx, on)
 
     def _paint_selected(self, idx, on: bool):
-        row = self._Rows.get(idx)
-        if not row: return
-        bg = self.HI_BG if on else self.NORM_BG
-        row.configure(bg=bg)
-        for child in row.winfo_children():
-            try:
-                if isinstance(child, (Tk.Label, Tk.Frame)):
-                    if isinstance(child, Tk.Frame) and child.cget("height") == 1:
-                        continue
-                    child.configure(bg=bg)
-            except Exception:
-                pass
+        slot = self._SlotByIdx.get(idx)
+        if slot:
+            slot.SetBackground(self.HI_BG if on else self.NORM_BG)
 
     # ---------- 勾选逻辑 ----------
-    def _on_check_toggle(self, idx):
-        new_state = self._SelVars[idx].get()
+    def _on_check_toggle(self, idx, new_state: bool):
 
         if idx not in self._SelectedSet:
             self._clear_selection()
@@ -475,7 +923,7 @@ class MainFrame(ttk.Frame):
         try:
             self._BulkChecking = True
             for i in targets:
-                self._SelVars[i].set(new_state)
+                self._set_checked(i, new_state)
         finally:
             self._BulkChecking = False
 
@@ -483,37 +931,42 @@ class MainFrame(ttk.Frame):
         self._sync_select_all_state()
 
     def _update_checked_stat(self):
-        visible_total = len(self._ViewIdx)
-        checked = 0
-        for i in self._ViewIdx:
-            try:
-                if self._SelVars[i].get():
-                    checked += 1
-            except Exception:
-                pass
-        self.CheckedStatVar.set(f"已勾选 {checked} / {visible_total}")
+        self.CheckedStatVar.set(f"已勾选 {self._CheckedCount} / {len(self._ViewIdx)}")
 
     def _sync_select_all_state(self):
-        if not self._ViewIdx:
-            self.SelectAllVar.set(False); return
-        all_on = all(self._SelVars[i].get() for i in self._ViewIdx)
-        self.SelectAllVar.set(bool(all_on))
+        n = len(self._ViewIdx)
+        self.SelectAllVar.set(bool(n) and self._CheckedCount == n)
+
+    def _recount_checked(self):
+        # 仅在可见序列整体重建时调用；其余路径都增量维护 _CheckedCount
+        checked = self._Checked
+        self._CheckedCount = sum(checked[i] for i in self._ViewIdx)
 
     def _on_select_all_toggle(self):
+        # 只记一条批量记录，不逐行改写；重绘仅限视口内的槽位
         target = bool(self.SelectAllVar.get())
-        try:
-            self._BulkChecking = True
-            for i in self._ViewIdx:
-                self._SelVars[i].set(target)
-        finally:
-            self._BulkChecking = False
+        self._Checked.SetAll(target, self.OnlyChangedVar.get())
+        self._CheckedCount = len(self._ViewIdx) if target else 0
+        for slot in self._SlotByIdx.values():
+            slot.SetChecked(target)
         self._update_checked_stat()
 
+    def _set_checked(self, idx, on: bool):
+        # 只对可见行调用（勾选目标来自选择集或可见序列）
+        on = bool(on)
+        if self._Checked[idx] == on:
+            return
+        self._Checked[idx] = on
+        self._CheckedCount += 1 if on else -1
+        slot = self._SlotByIdx.get(idx)
+        if slot:
+            slot.SetChecked(on)
+
     # ---------- 应用 ----------
     def _on_apply(self):
         if not callable(self.OnApply):
             messagebox.showerror("错误", "未绑定 OnApply 回调。"); return
-        indices = [i for i in self._ViewIdx if self._SelVars[i].get()]
+        indices = [i for i in self._ViewIdx if self._Checked[i]]
         if not indices:
             if messagebox.askyesno("提示", "当前未勾选任何项，是否对列表中所有可见项执行？"):
                 indices = list(self._ViewIdx)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+离线测试：在进程内模拟服务器（P4Backend.FakeServer / FakeBackend）上运行，不需要 p4 与图形界面。
+运行：python -m pytest -q Tests
+"""
+
+import os
+import sys
+
+import pytest
+
+def InjectSysPath():
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for p in [base, os.path.join(base, "Source", "Logic")]:
+        if p not in sys.path:
+            sys.path.insert(0, p)
+InjectSysPath()
+
+from Core import P4Context
+from P4Backend import FakeServer, FakeBackend
+
+@pytest.fixture
+def make_ctx(tmp_path):
+    """make_ctx(opened, files=()) -> (ctx, server)：opened 为已打开（edit）的 depot 路径，files 为仅存在于 depot 的文件。"""
+    def make(opened, files=()):
+        server = FakeServer(str(tmp_path / "ws"))
+        for p in opened:
+            server.AddFile(p)
+        for p in files:
+            server.AddFile(p, None)
+        return P4Context("fake:1666", "fake", server.ClientName, FakeBackend(server)), server
+    return make
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""apply 日志的重放（LoadJournal）与中断恢复（PlanRecovery 续做 / 回滚）。"""
+
+import pytest
+
+from Core import ApplyMoves, PlanRecovery
+from Journal import ApplyJournal, LoadJournal
+
+A, A_DST = "//depot/d/a.txt", "//depot/d/A.txt"
+B, B_DST = "//depot/d/b.txt", "//depot/d/B.txt"
+
+def _interrupted(make_ctx, tmp_path, step_landed):
+    """
+    模拟进程在第二次 move 的 step 之后、done 之前被杀：
+      - a.txt -> A.txt 已完成（step + done）；
+      - b.txt -> B.txt 只写了 step；step_landed 表示该 move 在服务器上是否已经生效。
+    """
+    ctx, server = make_ctx([A, B])
+    journal = ApplyJournal(tmp_path / "journal.jsonl", Sync=False)
+    journal.Begin([(0, A, A, A_DST), (1, B, B, B_DST)])
+    n = journal.Step(A, A_DST)
+    server.Run(["move", A, A_DST])
+    journal.Done(n, True, [(A, A_DST)])
+    journal.Step(B, B_DST)
+    if step_landed:
+        server.Run(["move", B, B_DST])
+    journal.Close()  # 不写 end
+    return ctx, server, LoadJournal(tmp_path / "journal.jsonl")
+
+def _opened(server):
+    return sorted(p for (p, o) in server.Opened.items() if "delete" not in o["action"])
+
+def test_replay_keeps_unconfirmed_step_in_flight(make_ctx, tmp_path):
+    _ctx, _server, state = _interrupted(make_ctx, tmp_path, step_landed=False)
+    assert not state.Ended
+    assert [(e.Key, e.Current) for e in state.Entries] == [(0, A_DST), (1, B)]
+    assert state.InFlight == [(B, B_DST)]
+    assert [e.Key for e in state.Pending] == [1]
+
+def test_truncated_last_line_is_ignored(make_ctx, tmp_path):
+    _interrupted(make_ctx, tmp_path, step_landed=False)
+    path = tmp_path / "journal.jsonl"
+    path.write_text(path.read_text(encoding="utf-8") + '{"t":"done","n":2,', encoding="utf-8")
+    state = LoadJournal(path)
+    assert state.InFlight == [(B, B_DST)]
+
+@pytest.mark.parametrize("step_landed", [False, True])
+def test_resume_finishes_only_what_is_left(make_ctx, tmp_path, step_landed):
+    ctx, server, state = _interrupted(make_ctx, tmp_path, step_landed)
+    ok, moves, origins, lost, msg = PlanRecovery(ctx, state)
+    assert ok, msg
+    assert not lost
+    # 已完成的 a.txt 不再移动；b.txt 只在 move 没生效时才需要续做
+    assert moves == ([] if step_landed else [(1, B, B_DST)])
+
+    results, logs = ApplyMoves(ctx, moves, Origins=origins)
+    assert all(st == "ok" for st in results.values()), logs
+    assert _opened(server) == [A_DST, B_DST]
+
+@pytest.mark.parametrize("step_landed", [False, True])
+def test_rollback_restores_original_paths(make_ctx, tmp_path, step_landed):
+    ctx, server, state = _interrupted(make_ctx, tmp_path, step_landed)
+    ok, moves, origins, lost, msg = PlanRecovery(ctx, state, Rollback=True)
+    assert ok, msg
+    assert not lost
+    expected = [(0, A_DST, A)] + ([(1, B_DST, B)] if step_landed else [])
+    assert moves == expected
+    assert origins == {k: orig for (k, _cur, orig) in expected}
+
+    results, logs = ApplyMoves(ctx, moves, Origins=origins)
+    assert all(st == "ok" for st in results.values()), logs
+    assert _opened(server) == [A, B]
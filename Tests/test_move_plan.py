@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""move 计划校验（ValidateMoves）、目录折叠（PlanMoves）与依赖（_plan_dependencies），以及经 ApplyMoves 的端到端行为。"""
+
+from Core import (
+    ApplyMoves, LoadOpenedIndex, OpenedIndex, ValidateMoves, PlanMoves, MoveOp, ALL_CHANGELISTS,
+    _p4_files_batch, _plan_dependencies, _temp_path,
+)
+
+def _validate(ctx, moves):
+    ok, index, msg = LoadOpenedIndex(ctx, ALL_CHANGELISTS)
+    assert ok, msg
+    existing = _p4_files_batch(ctx, [d for (_k, _s, d) in moves] + [_temp_path(d) for (_k, _s, d) in moves])
+    return {(i.Kind, i.Keys) for i in ValidateMoves(moves, index, existing)}
+
+def _opened(server):
+    return sorted(p for (p, o) in server.Opened.items() if "delete" not in o["action"])
+
+# ===================== 计划校验 =====================
+def test_case_swap_cycle_is_blocked(make_ctx):
+    ctx, server = make_ctx(["//depot/d/A.txt", "//depot/d/B.txt"])
+    moves = [(0, "//depot/d/A.txt", "//depot/d/b.txt"), (1, "//depot/d/B.txt", "//depot/d/a.txt")]
+    assert ("cycle", (0, 1)) in _validate(ctx, moves)
+
+    results, logs = ApplyMoves(ctx, moves, Jobs=2)
+    assert results == {0: "fail", 1: "fail"}
+    assert any(l.startswith("[BLOCK] cycle") for l in logs)
+    assert _opened(server) == ["//depot/d/A.txt", "//depot/d/B.txt"]  # 一条都没有执行
+
+def test_chain_is_blocked(make_ctx):
+    ctx, server = make_ctx(["//depot/d/x.txt", "//depot/d/y.txt"])
+    moves = [(0, "//depot/d/x.txt", "//depot/d/Y.txt"), (1, "//depot/d/y.txt", "//depot/d/z.txt")]
+    issues = _validate(ctx, moves)
+    assert ("chain", (0, 1)) in issues
+    assert not any(kind == "cycle" for (kind, _keys) in issues)
+
+    results, _logs = ApplyMoves(ctx, moves)
+    assert results[0] == "fail" and results[1] == "fail"
+    assert _opened(server) == ["//depot/d/x.txt", "//depot/d/y.txt"]
+
+def test_existing_target_is_blocked_others_proceed(make_ctx):
+    # B.txt 只存在于 depot（未打开）；c.txt 与之无关，应照常执行
+    ctx, server = make_ctx(["//depot/d/a.txt", "//depot/d/c.txt"], files=["//depot/d/B.txt"])
+    moves = [(0, "//depot/d/a.txt", "//depot/d/b.txt"), (1, "//depot/d/c.txt", "//depot/d/C.txt")]
+    assert _validate(ctx, moves) == {("target-exists", (0,))}
+
+    results, _logs = ApplyMoves(ctx, moves)
+    assert results == {0: "fail", 1: "ok"}
+    assert _opened(server) == ["//depot/d/C.txt", "//depot/d/a.txt"]
+
+def test_leftover_temp_is_blocked(make_ctx):
+    # 上一次双步 move 残留的临时名仍处于打开状态
+    ctx, server = make_ctx(["//depot/d/c.txt", "//depot/d/C.txt.__tmp__"])
+    moves = [(0, "//depot/d/c.txt", "//depot/d/C.txt")]
+    assert _validate(ctx, moves) == {("temp-exists", (0,))}
+
+    results, _logs = ApplyMoves(ctx, moves)
+    assert results == {0: "fail"}
+    assert "//depot/d/c.txt" in _opened(server)
+
+def test_noop_is_not_blocking():
+    moves = [(0, "//depot/d/a.txt", "//depot/d/a.txt")]
+    issues = ValidateMoves(moves, OpenedIndex(["//depot/d/a.txt"]))
+    assert [(i.Kind, i.Keys) for i in issues] == [("noop", (0,))]
+
+# ===================== 目录折叠 =====================
+def test_partially_collapsible_directory():
+    # content/ 下的已打开文件全部在本批次中 -> 一条目录 move；
+    # art/ 下还有一个不在本批次的已打开文件 -> 不能用通配符，逐文件 move
+    opened = ["//depot/content/a.txt", "//depot/content/sub/b.txt",
+              "//depot/art/x.png", "//depot/art/keep.png"]
+    moves = [(0, "//depot/content/a.txt", "//depot/Content/a.txt"),
+             (1, "//depot/content/sub/b.txt", "//depot/Content/Sub/b.txt"),
+             (2, "//depot/art/x.png", "//depot/Art/x.png")]
+    ops = PlanMoves(moves, opened)
+    assert ops == [
+        MoveOp("//depot/content", "//depot/Content", (0, 1), True),
+        MoveOp("//depot/Content/sub", "//depot/Content/Sub", (1,), True),
+        MoveOp("//depot/art/x.png", "//depot/Art/x.png", (2,), False),
+    ]
+    # 子目录 move 依赖父目录 move；无关的单文件 move 没有依赖
+    assert _plan_dependencies(ops) == [[], [0], []]
+
+def test_collapsed_directory_applies(make_ctx):
+    ctx, server = make_ctx(["//depot/content/a.txt", "//depot/content/sub/b.txt",
+                            "//depot/art/x.png", "//depot/art/keep.png"])
+    moves = [(0, "//depot/content/a.txt", "//depot/Content/a.txt"),
+             (1, "//depot/content/sub/b.txt", "//depot/Content/Sub/b.txt"),
+             (2, "//depot/art/x.png", "//depot/Art/x.png")]
+    results, logs = ApplyMoves(ctx, moves, Jobs=3)
+    assert results == {0: "ok", 1: "ok", 2: "ok"}, logs
+    assert _opened(server) == ["//depot/Art/x.png", "//depot/Content/Sub/b.txt",
+                               "//depot/Content/a.txt", "//depot/art/keep.png"]